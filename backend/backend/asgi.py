@@ -29,6 +29,16 @@ from django.conf import settings
 # Import after Django setup
 from chat.routing import websocket_urlpatterns
 from pong_game import routing
+from pong_game import drain
+from pong_game.checkpoints import checkpoint_writer
+
+# Deploys drain the worker with a signal instead of killing its games
+drain.install_signal_handler()
+
+# Games checkpointed by the previous process are resumed once their players
+# reconnect, the ones too old to resume are cancelled now
+if checkpoint_writer is not None:
+    checkpoint_writer.recover()
 
 # Initialize channel layer
 channel_layer = get_channel_layer()
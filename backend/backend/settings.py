@@ -236,6 +236,79 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Pong game engine
+# Step all playing games with the vectorized NumPy engine (pong_game/batch_physics.py)
+PONG_BATCH_PHYSICS = os.getenv("PONG_BATCH_PHYSICS", "False").lower() in ("1", "true", "yes")
+# Physics clock rate (Hz) and optional shard processes (pong_game/physics_pool.py)
+PONG_PHYSICS_RATE = int(os.getenv("PONG_PHYSICS_RATE", "240"))
+# Swept (continuous) ball collisions, lets PONG_PHYSICS_RATE go down to 60-120 Hz
+PONG_SWEPT_COLLISIONS = os.getenv("PONG_SWEPT_COLLISIONS", "False").lower() in ("1", "true", "yes")
+# Event-driven ball trajectories: no per-tick stepping, the clock only wakes up for broadcasts
+PONG_ANALYTIC_PHYSICS = os.getenv("PONG_ANALYTIC_PHYSICS", "False").lower() in ("1", "true", "yes")
+# Adaptive rates (pong_game/rates.py): scheduler rate (Hz) while no game is playing,
+# broadcast rate (Hz) per difficulty as "easy=60,medium=60,hard=60", and the round-trip
+# time (ms) / unsent frame backlog above which a game is broadcast at a lower rate
+PONG_IDLE_RATE = int(os.getenv("PONG_IDLE_RATE", "4"))
+PONG_BROADCAST_RATES = {
+    difficulty.strip(): int(rate)
+    for difficulty, rate in (
+        item.split("=") for item in os.getenv("PONG_BROADCAST_RATES", "easy=60,medium=60,hard=60").split(",")
+        if item.strip()
+    )
+}
+PONG_SLOW_CLIENT_RTT = int(os.getenv("PONG_SLOW_CLIENT_RTT", "150"))
+PONG_SLOW_CLIENT_BACKLOG = int(os.getenv("PONG_SLOW_CLIENT_BACKLOG", "4"))
+# Messages per second a game socket may send before further ones are dropped
+PONG_INPUT_BUDGET = int(os.getenv("PONG_INPUT_BUDGET", "60"))
+# Paddle hit tests also accept where the paddle was this many ms ago (0 = off,
+# not used with analytic physics)
+PONG_LAG_COMPENSATION_MS = int(os.getenv("PONG_LAG_COMPENSATION_MS", "0"))
+# Write-behind persistence of game results and input logs (pong_game/persistence.py):
+# records per transaction and seconds records may wait to be batched together
+PONG_RESULT_BATCH_SIZE = int(os.getenv("PONG_RESULT_BATCH_SIZE", "50"))
+PONG_RESULT_FLUSH_INTERVAL = float(os.getenv("PONG_RESULT_FLUSH_INTERVAL", "0.5"))
+# Crash-safe checkpoints of running games (pong_game/checkpoints.py): "off", "file"
+# (append-only file at PONG_CHECKPOINT_PATH, one per PONG_WORKER_ID when several
+# workers run) or "redis" (PONG_REDIS_URL), seconds
+# between checkpoints and age (s) after which a checkpoint isn't resumed anymore
+PONG_CHECKPOINTS = os.getenv("PONG_CHECKPOINTS", "off")
+PONG_CHECKPOINT_PATH = os.getenv("PONG_CHECKPOINT_PATH", os.path.join(BASE_DIR, "checkpoints", "games.jsonl"))
+PONG_CHECKPOINT_INTERVAL = float(os.getenv("PONG_CHECKPOINT_INTERVAL", "1.0"))
+PONG_CHECKPOINT_MAX_AGE = int(os.getenv("PONG_CHECKPOINT_MAX_AGE", "600"))
+# Drain mode (pong_game/drain.py): signal that starts it and seconds running games
+# get to end before they are handed off (PONG_CHECKPOINTS=redis) or ended
+PONG_DRAIN_SIGNAL = os.getenv("PONG_DRAIN_SIGNAL", "SIGUSR1")
+PONG_DRAIN_TIMEOUT = int(os.getenv("PONG_DRAIN_TIMEOUT", "300"))
+# Game deadlines (pong_game/timers.py), in seconds: opponent wait, end of a game
+# nobody is connected to, start of the next match after one ends (0 = only on
+# request) and game invite expiry
+PONG_OPPONENT_WAIT = int(os.getenv("PONG_OPPONENT_WAIT", "10"))
+PONG_INACTIVE_TIMEOUT = int(os.getenv("PONG_INACTIVE_TIMEOUT", "300"))
+PONG_NEXT_MATCH_DELAY = int(os.getenv("PONG_NEXT_MATCH_DELAY", "15"))
+PONG_INVITE_TTL = int(os.getenv("PONG_INVITE_TTL", "300"))
+# Seconds a dropped player's slot is held, the game paused, before the game is
+# abandoned (0 = abandon right away)
+PONG_RECONNECT_GRACE = int(os.getenv("PONG_RECONNECT_GRACE", "20"))
+# Spectator stream (pong_game/spectators.py): frames per second, frames a
+# viewer may fall behind before it skips to the next keyframe, viewers per game
+PONG_SPECTATOR_RATE = int(os.getenv("PONG_SPECTATOR_RATE", "20"))
+PONG_SPECTATOR_QUEUE = int(os.getenv("PONG_SPECTATOR_QUEUE", "32"))
+PONG_MAX_SPECTATORS = int(os.getenv("PONG_MAX_SPECTATORS", "500"))
+# State frames waiting per game socket (and per game for the channel layer)
+# before the oldest is merged into the next one (pong_game/fanout.py)
+PONG_SEND_QUEUE = int(os.getenv("PONG_SEND_QUEUE", "8"))
+# Tick, lateness and broadcast histograms of the game loop (pong_game/loop_metrics.py)
+PONG_LOOP_METRICS = os.getenv("PONG_LOOP_METRICS", "False").lower() in ("1", "true", "yes")
+PONG_PHYSICS_PROCESSES = int(os.getenv("PONG_PHYSICS_PROCESSES", "0"))
+# How games are placed on shards: "least_loaded" or "hash"
+PONG_PHYSICS_PLACEMENT = os.getenv("PONG_PHYSICS_PLACEMENT", "least_loaded")
+# Where game ownership is recorded: "memory" (single worker) or "redis" (several workers)
+PONG_GAME_REGISTRY = os.getenv("PONG_GAME_REGISTRY", "memory")
+PONG_REDIS_URL = os.getenv(
+    "PONG_REDIS_URL",
+    f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', '6379')}/1"
+)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,244 @@
+"""
+Vectorized physics stepping for many games at once.
+
+The scalar ``game_logic.update_game_physics`` advances one game per call.
+``BatchPhysicsEngine`` keeps the ball and paddle data of every playing game
+in structure-of-arrays NumPy buffers and advances all of them with a single
+vectorized step. Wall hits, paddle hits, scoring and ball resets are applied
+with masks; the few games that need a random number in a given step draw it
+from their own ``GameState.rng`` in the same order as the scalar code, so
+both paths produce identical results for the same inputs and seed.
+
+While a game is loaded, the buffers are authoritative for the ball. The
+GameState objects are only written back by ``flush()``, which the scheduler
+does before broadcasting and whenever a game scores or leaves the batch.
+Paddles go the other way: ``move_paddle()`` writes a paddle input to its
+row as it is applied, so a step never reads the GameState objects.
+"""
+from .game_logic import BASE_WIDTH, BASE_HEIGHT
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional; the scheduler falls back to scalar physics without it
+    np = None
+
+
+class BatchPhysicsEngine:
+    """Steps every loaded game with one set of vectorized array operations"""
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("BatchPhysicsEngine requires NumPy")
+        self.game_ids = []
+        self.states = []
+        self.rows = {}
+        self._load([])
+
+    @staticmethod
+    def is_available():
+        """Checks if NumPy could be imported"""
+        return np is not None
+
+    def _load(self, states):
+        """Builds fresh buffers from a list of GameState objects"""
+        self.states = states
+        self.game_ids = [state.game_id for state in states]
+        # Row of each game in the buffers
+        self.rows = {game_id: i for i, game_id in enumerate(self.game_ids)}
+
+        def column(getter):
+            return np.fromiter((getter(state) for state in states), dtype=np.float64, count=len(states))
+
+        # Ball
+        self.x = column(lambda s: s.ball.x)
+        self.y = column(lambda s: s.ball.y)
+        self.dx = column(lambda s: s.ball.dx)
+        self.dy = column(lambda s: s.ball.dy)
+        self.speed = column(lambda s: s.ball.speed)
+        self.radius = column(lambda s: s.ball.radius)
+        self.prev_x = column(lambda s: s.ball.prev_x)
+        self.prev_y = column(lambda s: s.ball.prev_y)
+
+        # Paddles (only y moves while a game is playing)
+        self.left_x = column(lambda s: s.left_paddle.x)
+        self.left_y = column(lambda s: s.left_paddle.y)
+        self.left_width = column(lambda s: s.left_paddle.width)
+        self.left_height = column(lambda s: s.left_paddle.height)
+        self.right_x = column(lambda s: s.right_paddle.x)
+        self.right_y = column(lambda s: s.right_paddle.y)
+        self.right_width = column(lambda s: s.right_paddle.width)
+        self.right_height = column(lambda s: s.right_paddle.height)
+
+        # Difficulty settings
+        self.ball_speed = column(lambda s: s.settings['ball_speed'])
+        self.increment = column(lambda s: 1 + s.settings['increment_multiplier'])
+        self.max_ball_speed = column(lambda s: s.settings['max_ball_speed'])
+
+    def sync_games(self, states):
+        """
+        Makes the loaded games match the given list of playing games.
+
+        Games that left are written back to their GameState; the buffers are
+        then rebuilt from the (now up to date) objects. Nothing happens when
+        the set of games is unchanged.
+
+        Args:
+            states: GameState objects that should be stepped
+        """
+        game_ids = [state.game_id for state in states]
+        if game_ids == self.game_ids:
+            return
+        self.flush()
+        self._load(states)
+
+    def move_paddle(self, game_id, player_num, y):
+        """
+        Writes a paddle position that was just applied to its GameState.
+        Games that aren't loaded read their paddles when they are.
+
+        Args:
+            game_id: The ID of the game
+            player_num: Which player (1 or 2)
+            y: New Y position of the paddle
+        """
+        row = self.rows.get(game_id)
+        if row is not None:
+            (self.left_y if player_num == 1 else self.right_y)[row] = y
+
+    def flush(self, indices=None):
+        """
+        Writes the buffered ball data back to the GameState objects.
+
+        Args:
+            indices: Optional rows to write back, defaults to every game
+        """
+        columns = (self.x, self.y, self.dx, self.dy, self.speed, self.prev_x, self.prev_y)
+        if indices is None:
+            indices = range(len(self.states))
+            rows = zip(*(col.tolist() for col in columns))
+        else:
+            indices = np.asarray(indices, dtype=np.intp)
+            rows = zip(*(col[indices].tolist() for col in columns))
+            indices = indices.tolist()
+
+        for i, row in zip(indices, rows):
+            ball = self.states[i].ball
+            ball.x, ball.y, ball.dx, ball.dy, ball.speed, ball.prev_x, ball.prev_y = row
+
+    def step(self, delta_time):
+        """
+        Advances every loaded game by one fixed physics step.
+
+        Mirrors game_logic.update_game_physics operation for operation.
+
+        Args:
+            delta_time: Fixed physics interval in seconds
+
+        Returns:
+            Array of outcome codes per game (1 score, 2 collision, 0 nothing)
+        """
+        states = self.states
+        x, y, dx, dy, radius = self.x, self.y, self.dx, self.dy, self.radius
+
+        # Store previous positions for client-side interpolation
+        self.prev_x[:] = x
+        self.prev_y[:] = y
+
+        # Move the ball
+        x += dx * delta_time * 60
+        y += dy * delta_time * 60
+
+        # Wall collisions
+        bottom_wall = y + radius >= BASE_HEIGHT
+        bounce = bottom_wall & (dy > 0)
+        self._reflect_with_jitter(bounce, dy, 0.1)
+
+        top_wall = y - radius <= 0
+        bounce = top_wall & (dy < 0)
+        self._reflect_with_jitter(bounce, dy, 0.1)
+
+        collision = bottom_wall | top_wall
+
+        # Paddle collisions use edges computed after the move
+        ball_left_edge = x - radius
+        ball_right_edge = x + radius
+        ball_top_edge = y - radius
+        ball_bottom_edge = y + radius
+
+        left_top = self.left_y
+        left_bottom = self.left_y + self.left_height
+        left_hit = ((ball_left_edge <= self.left_x + self.left_width) &
+                    (ball_left_edge > self.left_x) &
+                    (ball_top_edge <= left_bottom) &
+                    (ball_bottom_edge >= left_top) &
+                    (dx < 0))
+        if left_hit.any():
+            self._paddle_bounce(left_hit, left_top, self.left_height, 1)
+            collision |= left_hit
+            self._count_hits(left_hit)
+
+        right_top = self.right_y
+        right_bottom = self.right_y + self.right_height
+        right_hit = ((ball_right_edge >= self.right_x) &
+                     (ball_right_edge < self.right_x + self.right_width) &
+                     (ball_top_edge <= right_bottom) &
+                     (ball_bottom_edge >= right_top) &
+                     (dx > 0))
+        if right_hit.any():
+            self._paddle_bounce(right_hit, right_top, self.right_height, -1)
+            # The scalar step reports a right paddle hit as "no collision"
+            collision &= ~right_hit
+            self._count_hits(right_hit)
+
+        # Scoring
+        right_scores = x + radius < 0
+        left_scores = ~right_scores & (x - radius > BASE_WIDTH)
+        for i in np.flatnonzero(right_scores):
+            states[i].right_paddle.score += 1
+            self._reset_ball(i, 1)
+        for i in np.flatnonzero(left_scores):
+            states[i].left_paddle.score += 1
+            self._reset_ball(i, -1)
+
+        outcome = np.where(collision, 2, 0)
+        outcome[right_scores | left_scores] = 1
+        return outcome
+
+    def _count_hits(self, mask):
+        """Counts a paddle hit for masked games, written straight to their GameState like scores"""
+        for i in np.flatnonzero(mask):
+            self.states[i].paddle_hits += 1
+
+    def _reflect_with_jitter(self, mask, dy, jitter):
+        """Reverses dy for masked games and adds each game's random jitter"""
+        if not mask.any():
+            return
+        dy[mask] = -dy[mask]
+        for i in np.flatnonzero(mask):
+            dy[i] += (self.states[i].rng.random() - 0.5) * jitter
+
+    def _paddle_bounce(self, mask, paddle_top, paddle_height, direction):
+        """Bounces the ball off a paddle for masked games"""
+        half_height = paddle_height[mask] / 2
+        hit_position = (self.y[mask] - (paddle_top[mask] + half_height)) / half_height
+        # Limit the angle to avoid extreme angles
+        hit_position = np.clip(hit_position, -0.8, 0.8)
+
+        speed = self.speed[mask]
+        self.dy[mask] = hit_position * speed
+        speed = np.minimum(self.max_ball_speed[mask], speed * self.increment[mask])
+        self.speed[mask] = speed
+        self.dx[mask] = direction * speed
+
+        for i in np.flatnonzero(mask):
+            self.dy[i] += (self.states[i].rng.random() - 0.5) * 0.2
+
+    def _reset_ball(self, i, direction):
+        """Resets one game's ball after scoring, like game_logic.reset_ball"""
+        ball_speed = self.ball_speed[i]
+        self.x[i] = BASE_WIDTH / 2
+        self.y[i] = BASE_HEIGHT / 2
+        self.speed[i] = ball_speed
+        self.dx[i] = direction * ball_speed
+        self.dy[i] = ((self.states[i].rng.random() * 2 - 1) * ball_speed) / 2
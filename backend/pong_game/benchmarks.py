@@ -0,0 +1,323 @@
+"""
+Headless benchmarks for the game physics hot path.
+
+Synthetic games are created with game_logic.create_game_state (no database
+access) and driven by scripted paddle inputs through the same
+GameScheduler.step_games call the server uses, one scheduler tick at a time:
+inputs, physics, match end checks and match resets. For every difficulty in
+DIFFICULTY_SETTINGS the suite reports:
+
+- game ticks per second (one game advanced by one physics step);
+- p50/p99/max duration of a whole scheduler tick over all games;
+- allocations per tick: peak traced bytes above the tick's starting point
+  and net memory blocks kept alive (measured in a separate tracemalloc run,
+  so the timings aren't slowed down by tracing).
+
+It also times the individual game_logic functions. Results are plain
+dictionaries so they can be dumped as JSON and compared between commits
+(see the bench_physics management command).
+"""
+import platform
+import sys
+import time
+import tracemalloc
+from . import game_logic
+from .scheduler import GameScheduler, PHYSICS_RATE
+
+# How far behind the ball the scripted paddles aim, per difficulty (pixels);
+# more error on harder difficulties so points and match ends keep happening
+SCRIPTED_ERROR = {'easy': 40, 'medium': 55, 'hard': 70}
+
+
+def create_games(count, difficulty, prefix='bench'):
+    """
+    Creates playing synthetic games in game_logic.active_games.
+
+    Args:
+        count: Number of games
+        difficulty: Key of DIFFICULTY_SETTINGS
+        prefix: Prefix of the generated game IDs
+
+    Returns:
+        List of game IDs
+    """
+    game_ids = [f"{prefix}-{difficulty}-{i}" for i in range(count)]
+    for i, game_id in enumerate(game_ids):
+        game_logic.active_games[game_id] = game_logic.create_game_state(game_id, {
+            'difficulty': difficulty,
+            'player1_id': 1,
+            'player2_id': 2,
+            'player1_username': 'bench1',
+            'player2_username': 'bench2',
+            'seed': i
+        })
+        game_logic.set_game_status(game_id, 'playing')
+    return game_ids
+
+
+def remove_games(game_ids):
+    """Removes synthetic games from game_logic.active_games"""
+    for game_id in game_ids:
+        game_logic.active_games.pop(game_id, None)
+
+
+def apply_scripted_inputs(game_ids, tick, scheduler):
+    """
+    Moves both paddles of every game towards the ball with a periodic error.
+
+    Args:
+        game_ids: IDs of the games
+        tick: Current benchmark tick
+        scheduler: The GameScheduler stepping the games
+    """
+    for index, game_id in enumerate(game_ids):
+        game_state = game_logic.active_games[game_id]
+        error = SCRIPTED_ERROR[game_state.difficulty]
+        offset = ((tick + index * 7) % (2 * error)) - error
+        target = game_state.ball.y - game_logic.PADDLE_HEIGHT / 2 + offset
+        game_logic.update_paddle_position(game_id, 1, target)
+        game_logic.update_paddle_position(game_id, 2, target - offset / 2)
+        if scheduler.batch_engine is not None:
+            # Like GameScheduler.apply_inputs
+            for player_num in (1, 2):
+                scheduler.batch_engine.move_paddle(game_id, player_num, game_state.paddle(player_num).y)
+
+
+def handle_scores(results):
+    """
+    Applies match end checks and restarts finished matches like the server.
+
+    Args:
+        results: Dictionary of game IDs to whether a score happened
+
+    Returns:
+        Number of matches that ended
+    """
+    matches = 0
+    for game_id, score_happened in results.items():
+        if score_happened and game_logic.check_match_end(game_id):
+            matches += 1
+            if game_logic.active_games[game_id].game_status == 'gameOver':
+                game_logic.reset_game(game_id)
+            else:
+                game_logic.reset_for_new_match(game_id)
+            game_logic.set_game_status(game_id, 'playing')
+    return matches
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at a fraction (0-1) of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_tick_benchmark(games, ticks, difficulty, tick_rate=PHYSICS_RATE, batch=False, swept=False,
+                       analytic=False):
+    """
+    Times full scheduler ticks over a set of synthetic games.
+
+    With analytic physics a scheduler tick is a wakeup, which advances the
+    games by several physics ticks (one broadcast interval).
+
+    Args:
+        games: Number of games
+        ticks: Number of scheduler ticks
+        difficulty: Key of DIFFICULTY_SETTINGS
+        tick_rate: Physics rate in Hz
+        batch: Whether to step with the vectorized engine
+        swept: Whether to use swept collisions
+        analytic: Whether to use event-driven analytic physics
+
+    Returns:
+        Dictionary of results
+    """
+    scheduler = GameScheduler(tick_rate=tick_rate, batch_physics=batch, physics_processes=0,
+                              swept_collisions=swept, analytic_physics=analytic)
+    steps = scheduler.wake_ticks
+    game_ids = create_games(games, difficulty)
+    durations = []
+    matches = 0
+    points = 0
+    try:
+        for tick in range(ticks):
+            start = time.perf_counter()
+            apply_scripted_inputs(game_ids, tick, scheduler)
+            results = scheduler.step_games(game_ids, steps)
+            matches += handle_scores(results)
+            durations.append(time.perf_counter() - start)
+            points += sum(results.values())
+    finally:
+        if scheduler.batch_engine is not None:
+            scheduler.batch_engine.sync_games([])
+        remove_games(game_ids)
+
+    total = sum(durations)
+    durations.sort()
+    return {
+        'difficulty': difficulty,
+        'engine': 'batch' if scheduler.batch_engine is not None else 'scalar',
+        'collisions': 'analytic' if analytic else 'swept' if swept else 'discrete',
+        'games': games,
+        'ticks': ticks,
+        'steps_per_tick': steps,
+        'tick_rate': tick_rate,
+        # Simulated game time per second of CPU, comparable across tick rates
+        'game_seconds_per_sec': games * ticks * steps / tick_rate / total if total else 0.0,
+        'game_ticks_per_sec': games * ticks * steps / total if total else 0.0,
+        'tick_us': {
+            'mean': total / ticks * 1e6,
+            'p50': percentile(durations, 0.50) * 1e6,
+            'p99': percentile(durations, 0.99) * 1e6,
+            'max': durations[-1] * 1e6
+        },
+        # Share of the tick budget (steps / tick_rate) used at p99
+        'p99_budget_used': percentile(durations, 0.99) * tick_rate / steps,
+        'matches_ended': matches,
+        'points_scored': points
+    }
+
+
+def run_allocation_benchmark(games, ticks, difficulty, batch=False, swept=False, analytic=False):
+    """
+    Measures memory allocations per scheduler tick with tracemalloc.
+
+    Args:
+        games: Number of games
+        ticks: Number of scheduler ticks to trace
+        difficulty: Key of DIFFICULTY_SETTINGS
+        batch: Whether to step with the vectorized engine
+        swept: Whether to use swept collisions
+        analytic: Whether to use event-driven analytic physics
+
+    Returns:
+        Dictionary with peak bytes per tick and net blocks per tick
+    """
+    scheduler = GameScheduler(batch_physics=batch, physics_processes=0, swept_collisions=swept,
+                              analytic_physics=analytic)
+    steps = scheduler.wake_ticks
+    game_ids = create_games(games, difficulty, prefix='alloc')
+    peaks = []
+    try:
+        # Warm up caches (struct layouts, batch buffers) before tracing
+        for tick in range(10):
+            apply_scripted_inputs(game_ids, tick, scheduler)
+            handle_scores(scheduler.step_games(game_ids, steps))
+
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+        for tick in range(ticks):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            apply_scripted_inputs(game_ids, tick, scheduler)
+            handle_scores(scheduler.step_games(game_ids, steps))
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+        blocks_after = sys.getallocatedblocks()
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if scheduler.batch_engine is not None:
+            scheduler.batch_engine.sync_games([])
+        remove_games(game_ids)
+
+    peaks.sort()
+    return {
+        'peak_bytes_per_tick': {
+            'mean': sum(peaks) / ticks,
+            'p99': percentile(peaks, 0.99)
+        },
+        'peak_bytes_per_game_tick': sum(peaks) / ticks / games,
+        'net_blocks_per_tick': (blocks_after - blocks_before) / ticks
+    }
+
+
+def run_function_benchmarks(iterations, difficulty):
+    """
+    Times the individual game_logic functions on one playing game.
+
+    Args:
+        iterations: Calls per function
+        difficulty: Key of DIFFICULTY_SETTINGS
+
+    Returns:
+        Dictionary of microseconds per call
+    """
+    game_id = create_games(1, difficulty, prefix='func')[0]
+    delta_time = 1 / PHYSICS_RATE
+    timings = {}
+    try:
+        update_game_physics = game_logic.update_game_physics
+        start = time.perf_counter()
+        for tick in range(iterations):
+            if update_game_physics(game_id, delta_time) == 1:
+                game_logic.active_games[game_id].left_paddle.score = 0
+                game_logic.active_games[game_id].right_paddle.score = 0
+        timings['update_game_physics'] = (time.perf_counter() - start) / iterations * 1e6
+
+        update_game_physics_swept = game_logic.update_game_physics_swept
+        start = time.perf_counter()
+        for tick in range(iterations):
+            if update_game_physics_swept(game_id, delta_time) == 1:
+                game_logic.active_games[game_id].left_paddle.score = 0
+                game_logic.active_games[game_id].right_paddle.score = 0
+        timings['update_game_physics_swept'] = (time.perf_counter() - start) / iterations * 1e6
+
+        check_match_end = game_logic.check_match_end
+        start = time.perf_counter()
+        for _ in range(iterations):
+            check_match_end(game_id)
+        timings['check_match_end'] = (time.perf_counter() - start) / iterations * 1e6
+
+        reset_ball = game_logic.reset_ball
+        start = time.perf_counter()
+        for i in range(iterations):
+            reset_ball(game_id, 1 if i & 1 else -1)
+        timings['reset_ball'] = (time.perf_counter() - start) / iterations * 1e6
+    finally:
+        remove_games([game_id])
+
+    return {key: {'us_per_call': value} for key, value in timings.items()}
+
+
+def run_suite(games=200, ticks=2400, difficulties=None, batch=False,
+              tick_rate=PHYSICS_RATE, allocation_ticks=200, function_iterations=100000,
+              swept=False, analytic=False):
+    """
+    Runs every benchmark for each difficulty.
+
+    Args:
+        games: Number of synthetic games per difficulty
+        ticks: Scheduler ticks for the timing run
+        difficulties: Difficulties to run, defaults to all of them
+        batch: Whether to step with the vectorized engine
+        tick_rate: Physics rate in Hz
+        allocation_ticks: Scheduler ticks for the allocation run
+        function_iterations: Calls per function for the function timings
+        swept: Whether to use swept collisions
+        analytic: Whether to use event-driven analytic physics
+
+    Returns:
+        Dictionary of results, safe to serialize as JSON
+    """
+    if difficulties is None:
+        difficulties = list(game_logic.DIFFICULTY_SETTINGS)
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'platform': platform.platform()
+        },
+        'difficulties': {}
+    }
+    for difficulty in difficulties:
+        results['difficulties'][difficulty] = {
+            'ticks': run_tick_benchmark(games, ticks, difficulty, tick_rate, batch, swept, analytic),
+            'allocations': run_allocation_benchmark(games, allocation_ticks, difficulty, batch, swept,
+                                                    analytic),
+            'functions': run_function_benchmarks(function_iterations, difficulty)
+        }
+    return results
@@ -0,0 +1,507 @@
+"""
+Crash-safe checkpoints of running games.
+
+Every running game only lives in the memory of its owner (game_logic.active_games),
+so a restarted backend used to forget them: the players were disconnected,
+their Game rows stayed in_progress and reconnecting started a new game.
+
+The CheckpointWriter takes a compact Checkpoint of every game that can still
+be resumed (scores, match wins, current match, tick) once every
+PONG_CHECKPOINT_INTERVAL seconds and writes the ones that changed to a
+CheckpointStore from a worker thread, so the scheduler's tick never waits
+for the write. A game that leaves memory gets an end marker.
+
+When a game is initialized again after a restart (initialize_game_state),
+resume_game restores its last checkpoint: the players reconnect to the same
+game, at the same score, and start the next rally from the menu. The
+checkpoints are read once per process, by the recovery step run at startup
+(recover(), from asgi.py), which also cancels the games whose checkpoint is
+too old to resume; reading checkpoints never writes to the database.
+
+FileCheckpointStore appends JSON lines to a local file (compacted when it
+grows), RedisCheckpointStore keeps one hash entry per game and can be shared
+by several workers. Only a shared store lets a draining worker hand its games
+off to another one (drain.py); a file is only read back by the same worker
+after a restart. Loading and compacting rewrite the file with only this
+worker's games, so a file is never shared: with several workers (prod.sh
+PONG_WORKERS), each one writes its own file, suffixed with its stable
+PONG_WORKER_ID, and the file store is refused when a worker has none.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import traceback
+from typing import NamedTuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import game_logic
+
+# Statuses a game can be resumed from; finished games aren't checkpointed
+RESUMABLE_STATUSES = ('waiting', 'menu', 'playing', 'paused', 'matchOver')
+
+# The checkpoint file is rewritten with only the live games once it holds
+# this many lines per live game (and at least COMPACT_MIN_LINES)
+COMPACT_RATIO = 4
+COMPACT_MIN_LINES = 1000
+
+
+class Checkpoint(NamedTuple):
+    """Last known progress of a running game"""
+    game_id: str
+    written_at: float  # time.time()
+    tick: int
+    status: str
+    current_match: int
+    score_player1: int
+    score_player2: int
+    match_wins_player1: int
+    match_wins_player2: int
+    paddle_hits: int
+
+    def progress(self):
+        """Fields that change while the game is played, to skip unchanged checkpoints"""
+        return self[2:]
+
+
+def take_checkpoint(game_state):
+    """
+    Builds the checkpoint of a game.
+
+    Args:
+        game_state: The GameState
+
+    Returns:
+        Checkpoint, or None if the game can't be resumed
+    """
+    if game_state.game_status not in RESUMABLE_STATUSES:
+        return None
+    return Checkpoint(
+        game_id=str(game_state.game_id),
+        written_at=time.time(),
+        tick=game_state.tick,
+        status=game_state.game_status,
+        current_match=game_state.current_match,
+        score_player1=game_state.left_paddle.score,
+        score_player2=game_state.right_paddle.score,
+        match_wins_player1=game_state.match_wins['player1'],
+        match_wins_player2=game_state.match_wins['player2'],
+        paddle_hits=game_state.paddle_hits
+    )
+
+
+def restore_checkpoint(game_state, checkpoint):
+    """
+    Applies a checkpoint to a freshly created game state.
+
+    The game waits for both players again and the ball is served from the
+    center; a match that had just ended continues with the next one.
+
+    Args:
+        game_state: The GameState, as created by game_logic.create_game_state
+        checkpoint: The Checkpoint of that game
+    """
+    game_state.tick = checkpoint.tick
+    game_state.paddle_hits = checkpoint.paddle_hits
+    game_state.match_wins['player1'] = checkpoint.match_wins_player1
+    game_state.match_wins['player2'] = checkpoint.match_wins_player2
+    game_state.current_match = checkpoint.current_match
+    if checkpoint.status == 'matchOver':
+        # The match is already counted in match_wins
+        game_state.current_match += 1
+    else:
+        game_state.left_paddle.score = checkpoint.score_player1
+        game_state.right_paddle.score = checkpoint.score_player2
+    game_state.game_status = 'waiting'
+
+
+class FileCheckpointStore:
+    """Append-only file of JSON lines, one per checkpoint or end marker"""
+
+    # Only read by the worker that wrote it
+    shared = False
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = 0
+        # Recovery may read while the writer's thread appends
+        self.lock = threading.Lock()
+
+    def write(self, checkpoints, ended):
+        """
+        Appends checkpoints and end markers.
+
+        Args:
+            checkpoints: Checkpoint objects
+            ended: IDs of games that left memory
+        """
+        lines = [json.dumps(checkpoint._asdict()) for checkpoint in checkpoints]
+        lines.extend(json.dumps({'game_id': str(game_id), 'ended': True}) for game_id in ended)
+        if not lines:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock, open(self.path, 'a') as checkpoint_file:
+            checkpoint_file.write('\n'.join(lines) + '\n')
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+            self.lines += len(lines)
+
+    def load(self):
+        """
+        Reads the last checkpoint of every game that didn't end, and compacts
+        the file down to them.
+
+        Returns:
+            Dictionary game_id -> Checkpoint
+        """
+        latest = {}
+        try:
+            with self.lock, open(self.path) as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line cut short by the crash
+                        continue
+                    if entry.get('ended'):
+                        latest.pop(entry['game_id'], None)
+                    else:
+                        latest[entry['game_id']] = Checkpoint(**entry)
+        except FileNotFoundError:
+            return {}
+        self.compact(latest.values())
+        return latest
+
+    def get(self, game_id):
+        """No other worker writes this file, so no game can be handed over through it"""
+        return None
+
+    def compact(self, checkpoints):
+        """Atomically rewrites the file with only the given checkpoints"""
+        checkpoints = list(checkpoints)
+        temporary = f"{self.path}.tmp"
+        with self.lock:
+            with open(temporary, 'w') as checkpoint_file:
+                for checkpoint in checkpoints:
+                    checkpoint_file.write(json.dumps(checkpoint._asdict()) + '\n')
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            os.replace(temporary, self.path)
+            self.lines = len(checkpoints)
+
+    def needs_compaction(self, live_games):
+        """True once the file mostly holds checkpoints that were superseded"""
+        return self.lines >= max(COMPACT_MIN_LINES, COMPACT_RATIO * live_games)
+
+
+class RedisCheckpointStore:
+    """One hash entry per game, shared by every worker"""
+
+    KEY = "pong:checkpoints"
+    # Any worker can resume a game another one checkpointed
+    shared = True
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def write(self, checkpoints, ended):
+        """Stores checkpoints and drops the games that ended, in one round trip"""
+        pipe = self.redis.pipeline()
+        if checkpoints:
+            pipe.hset(self.KEY, mapping={
+                checkpoint.game_id: json.dumps(checkpoint._asdict()) for checkpoint in checkpoints
+            })
+        if ended:
+            pipe.hdel(self.KEY, *[str(game_id) for game_id in ended])
+        pipe.execute()
+
+    def load(self):
+        """Returns a dictionary game_id -> Checkpoint of every stored game"""
+        return {
+            game_id: Checkpoint(**json.loads(entry))
+            for game_id, entry in self.redis.hgetall(self.KEY).items()
+        }
+
+    def get(self, game_id):
+        """Returns the stored checkpoint of a game, e.g. one handed over by a draining worker"""
+        entry = self.redis.hget(self.KEY, str(game_id))
+        return Checkpoint(**json.loads(entry)) if entry is not None else None
+
+    def compact(self, checkpoints):
+        """Nothing to compact, entries are overwritten in place"""
+
+    def needs_compaction(self, live_games):
+        return False
+
+
+class CheckpointWriter:
+    """
+    Periodically checkpoints the games of this worker and resumes them after
+    a restart.
+
+    The game loop only ever calls start() and forget(); taking checkpoints is
+    a few attribute reads per game, the store is written in a thread.
+    """
+
+    def __init__(self, store, interval=None, max_age=None):
+        if interval is None:
+            interval = getattr(settings, 'PONG_CHECKPOINT_INTERVAL', 1.0)
+        if max_age is None:
+            max_age = getattr(settings, 'PONG_CHECKPOINT_MAX_AGE', 600)
+        self.store = store
+        self.interval = interval
+        self.max_age = max_age
+        # (progress, written_at) of the last checkpoint written per game
+        self.written = {}
+        # Games that left memory since the last write
+        self.ended = set()
+        # Checkpoints read after a restart, None until loaded
+        self.recovered = None
+        # Games whose checkpoint was too old when loaded, cancelled by recover()
+        self.stale = []
+        self._load_lock = threading.Lock()
+        self._task = None
+
+    def start(self):
+        """Starts the checkpoint task if it isn't running"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def forget(self, game_id):
+        """Marks a game that left memory so it isn't resumed"""
+        if self.written.pop(str(game_id), None) is not None:
+            self.ended.add(str(game_id))
+
+    def collect(self):
+        """
+        Takes the checkpoints of every game that can be resumed.
+
+        Returns:
+            Tuple (all checkpoints, checkpoints to write): a game is written
+            when it progressed since its last write, or to keep its
+            checkpoint from getting older than half of PONG_CHECKPOINT_MAX_AGE
+        """
+        checkpoints = []
+        changed = []
+        for game_state in list(game_logic.active_games.values()):
+            checkpoint = take_checkpoint(game_state)
+            if checkpoint is None:
+                continue
+            checkpoints.append(checkpoint)
+            written = self.written.get(checkpoint.game_id)
+            if (written is None or written[0] != checkpoint.progress() or
+                    checkpoint.written_at - written[1] > self.max_age / 2):
+                changed.append(checkpoint)
+        return checkpoints, changed
+
+    async def _run(self):
+        """Checkpoint task: runs while this worker has games or end markers to write"""
+        try:
+            while game_logic.active_games or self.ended:
+                await asyncio.sleep(self.interval)
+                checkpoints, changed = self.collect()
+                ended, self.ended = self.ended, set()
+                if not changed and not ended:
+                    continue
+                compact = None
+                if self.store.needs_compaction(len(checkpoints)):
+                    # Games recovered but not reconnected yet are kept
+                    compact = checkpoints + list((self.recovered or {}).values())
+                try:
+                    await sync_to_async(self._write, thread_sensitive=False)(changed, ended, compact)
+                except Exception as e:
+                    print(f"Error writing {len(changed)} game checkpoints: {str(e)}")
+                    traceback.print_exc()
+                    # End markers are retried with the next write
+                    self.ended |= ended
+                    continue
+                for checkpoint in changed:
+                    self.written[checkpoint.game_id] = (checkpoint.progress(), checkpoint.written_at)
+                for game_id in ended:
+                    self.written.pop(game_id, None)
+        finally:
+            self._task = None
+
+    def _write(self, checkpoints, ended, compact):
+        """Writes to the store, then compacts it if asked to (runs in a thread)"""
+        self.store.write(checkpoints, ended)
+        if compact is not None:
+            self.store.compact(compact)
+
+    async def flush(self):
+        """Writes the end markers still waiting, e.g. before the process exits"""
+        ended, self.ended = self.ended, set()
+        if not ended:
+            return
+        try:
+            await sync_to_async(self._write, thread_sensitive=False)([], ended, None)
+        except Exception as e:
+            print(f"Error writing game end markers: {str(e)}")
+            traceback.print_exc()
+            self.ended |= ended
+
+    async def hand_off(self, game_ids):
+        """
+        Writes a last checkpoint of games that are about to leave this
+        worker without ending, so another worker resumes them; only used with
+        a shared store (drain.py).
+
+        Args:
+            game_ids: IDs of games in active_games
+
+        Returns:
+            IDs of the games whose checkpoint was written
+        """
+        checkpoints = []
+        for game_id in game_ids:
+            game_state = game_logic.active_games.get(game_id)
+            checkpoint = take_checkpoint(game_state) if game_state is not None else None
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+        if not checkpoints:
+            return []
+        try:
+            await sync_to_async(self._write, thread_sensitive=False)(checkpoints, (), None)
+        except Exception as e:
+            print(f"Error writing {len(checkpoints)} hand-off checkpoints: {str(e)}")
+            traceback.print_exc()
+            return []
+        for checkpoint in checkpoints:
+            # Leaving memory without an end marker, the checkpoint stays
+            self.written.pop(checkpoint.game_id, None)
+        return [checkpoint.game_id for checkpoint in checkpoints]
+
+    def load(self):
+        """
+        Reads the checkpoints left by the previous process, once.
+
+        Checkpoints older than PONG_CHECKPOINT_MAX_AGE are dropped and kept
+        in stale for recover().
+
+        Returns:
+            Dictionary game_id -> Checkpoint
+        """
+        with self._load_lock:
+            if self.recovered is not None:
+                return self.recovered
+            try:
+                checkpoints = self.store.load()
+            except Exception as e:
+                print(f"Error reading game checkpoints: {str(e)}")
+                traceback.print_exc()
+                checkpoints = {}
+
+            now = time.time()
+            stale = [
+                game_id for game_id, checkpoint in checkpoints.items()
+                if now - checkpoint.written_at > self.max_age
+            ]
+            for game_id in stale:
+                del checkpoints[game_id]
+            if checkpoints:
+                print(f"Recovered checkpoints of {len(checkpoints)} games")
+            self.stale = stale
+            self.recovered = checkpoints
+            return checkpoints
+
+    def recover(self):
+        """
+        Recovery step of a starting worker: reads the checkpoints left by the
+        previous process and ends the games they are too old to resume (their
+        Game rows, if still in progress, are marked cancelled and their
+        checkpoints dropped from the store).
+
+        Runs synchronously, before the worker serves anything.
+        """
+        self.load()
+        stale, self.stale = self.stale, []
+        if stale:
+            print(f"Cancelling {len(stale)} games whose checkpoint is too old to resume")
+            cancel_stale_games(stale)
+            self.ended.update(stale)
+
+    def resume_game(self, game_state, game_data):
+        """
+        Restores a game from the checkpoint it had before a restart, if any.
+
+        Called in a worker thread (initialize_game_state) before the game is
+        added to active_games.
+
+        Args:
+            game_state: The freshly created GameState
+            game_data: The game's database row, as returned by get_game
+
+        Returns:
+            True if the game was resumed
+        """
+        checkpoint = self.load().pop(str(game_state.game_id), None)
+        if checkpoint is None:
+            # Handed over by a draining worker after this one started
+            checkpoint = self.store.get(game_state.game_id)
+            if checkpoint is None or time.time() - checkpoint.written_at > self.max_age:
+                return False
+        if game_data.get('status') not in (None, 'waiting', 'in_progress', 'paused'):
+            # Finished or cancelled while this worker was down
+            self.ended.add(checkpoint.game_id)
+            return False
+        restore_checkpoint(game_state, checkpoint)
+        # Counts as written, the next checkpoint is taken once it progresses
+        self.written[checkpoint.game_id] = (checkpoint.progress(), checkpoint.written_at)
+        print(f"Game {game_state.game_id} resumed from its checkpoint at tick {checkpoint.tick}")
+        return True
+
+
+def cancel_stale_games(game_ids):
+    """Marks games whose checkpoint is too old to resume as cancelled"""
+    from django.utils import timezone
+    from .models import Game, StatusChoices
+    try:
+        Game.objects.filter(
+            id__in=[int(game_id) for game_id in game_ids],
+            status=StatusChoices.IN_PROGRESS
+        ).update(status=StatusChoices.CANCELLED, completed_at=timezone.now())
+    except Exception as e:
+        print(f"Error cancelling stale games: {str(e)}")
+        traceback.print_exc()
+
+
+def checkpoint_file_path():
+    """
+    Path of this worker's checkpoint file.
+
+    Returns:
+        PONG_CHECKPOINT_PATH, suffixed with PONG_WORKER_ID when it is set
+        (games.jsonl -> games.worker-0.jsonl), or None when several workers
+        run without a worker ID and would overwrite each other's checkpoints
+    """
+    path = settings.PONG_CHECKPOINT_PATH
+    worker_id = os.getenv("PONG_WORKER_ID")
+    if worker_id:
+        root, extension = os.path.splitext(path)
+        return f"{root}.{worker_id}{extension}"
+    if int(os.getenv("PONG_WORKERS", "1")) > 1:
+        return None
+    return path
+
+
+def create_checkpoint_writer():
+    """Builds the writer of the store selected by PONG_CHECKPOINTS, or None if off"""
+    backend = getattr(settings, 'PONG_CHECKPOINTS', 'off')
+    if backend == 'file':
+        path = checkpoint_file_path()
+        if path is None:
+            print("PONG_CHECKPOINTS=file needs a PONG_WORKER_ID per worker when PONG_WORKERS > 1, "
+                  "checkpoints are off (use PONG_CHECKPOINTS=redis to share them)")
+            return None
+        return CheckpointWriter(FileCheckpointStore(path))
+    if backend == 'redis':
+        return CheckpointWriter(RedisCheckpointStore(getattr(settings, 'PONG_REDIS_URL', 'redis://redis:6379/1')))
+    return None
+
+
+# Writer shared by every game in this process, None when checkpoints are off
+checkpoint_writer = create_checkpoint_writer()
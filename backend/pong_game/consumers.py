@@ -9,6 +9,7 @@ from django.db import transaction
 from django.db.models import Q
 
 from .models import PlayerProfile, MatchmakingQueue, Game, StatusChoices
+from . import drain
 from authentication.models import User
 
 
@@ -30,6 +31,11 @@ class MatchmakingConsumer(AsyncJsonWebsocketConsumer):
             # No user_id means authentication failed
             await self.close()
             return
+
+        # A draining worker doesn't take new players (see drain.py)
+        if drain.is_draining():
+            await self.close(code=drain.DRAINING_CLOSE_CODE)
+            return
         
         try:
             # Get the actual User object from the database
@@ -163,6 +169,11 @@ class MatchmakingConsumer(AsyncJsonWebsocketConsumer):
         """
         while True:
             try:
+                # A draining worker leaves matchmaking to the other workers
+                if drain.is_draining():
+                    await asyncio.sleep(5)
+                    continue
+
                 # Try to acquire the matchmaking lock
                 should_run = await self.try_acquire_matchmaking_lock()
                 
@@ -0,0 +1,211 @@
+"""
+Drain mode: takes a worker out of service without killing its games.
+
+A deploy used to stop daphne with every game still running on it. Draining
+instead (started with PONG_DRAIN_SIGNAL, SIGUSR1 by default, or the
+admin-only POST /api/pong_game/drain/):
+
+- new ws/game/ connections are refused with DRAINING_CLOSE_CODE, except for
+  games this worker is already running, and so are matchmaking sockets; this
+  worker's matchmaking task stops creating games;
+- running games are given PONG_DRAIN_TIMEOUT seconds to end;
+- games still running then are handed off when checkpoints go to a store
+  every worker reads (PONG_CHECKPOINTS=redis, see checkpoints.py): a last
+  checkpoint is written, the players are told to reconnect and the game
+  leaves this worker without ending, so the next worker they reach resumes
+  it; with the file store (only read back by this worker after a restart)
+  or without checkpoints they end as the worker exits;
+- the write-behind queue (persistence.py) and pending checkpoint end markers
+  are flushed;
+- the worker stops itself with SIGTERM, like a regular daphne shutdown.
+
+Progress is printed every PROGRESS_INTERVAL seconds and returned by
+drain_status() (GET /api/pong_game/drain/).
+"""
+import asyncio
+import os
+import signal
+import time
+import traceback
+from django.conf import settings
+from . import game_logic, persistence
+from .checkpoints import checkpoint_writer
+from .tasks import spawn_detached
+
+# Close code of sockets refused while draining (try again on another worker)
+DRAINING_CLOSE_CODE = 4503
+
+# Seconds between two progress reports
+PROGRESS_INTERVAL = 5
+
+# Statuses of games that are over and only wait for their sockets to close
+FINISHED_STATUSES = ('gameOver', 'cancelled')
+
+
+class Drain:
+    """Drain state of this worker process"""
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = getattr(settings, 'PONG_DRAIN_TIMEOUT', 300)
+        self.timeout = timeout
+        self.draining = False
+        self.reason = None
+        self.started_at = None
+        self.finished_at = None
+        self.games_at_start = 0
+        self.handed_off = 0
+        self.phase = None
+        self._task = None
+
+    def start(self, reason, exit_when_done=True):
+        """
+        Starts draining this worker, once; must run on the event loop.
+
+        Args:
+            reason: What triggered the drain, for the progress reports
+            exit_when_done: Stop the process once drained
+
+        Returns:
+            The drain status (see status())
+        """
+        if not self.draining:
+            self.draining = True
+            self.reason = reason
+            self.started_at = time.time()
+            self.games_at_start = len(live_games())
+            self.phase = 'waiting_for_games'
+            print(f"Draining worker ({reason}): {self.games_at_start} games running, "
+                  f"up to {self.timeout}s for them to end")
+            # Fresh context: when started from the admin view (async_to_sync),
+            # the task must not inherit that request's thread executor
+            self._task = spawn_detached(self._run(exit_when_done))
+        return self.status()
+
+    def status(self):
+        """
+        Reports drain progress.
+
+        Returns:
+            Dictionary with the phase, games left and records waiting to be written
+        """
+        now = time.time()
+        return {
+            'draining': self.draining,
+            'reason': self.reason,
+            'phase': self.phase,
+            'elapsed': round(now - self.started_at, 1) if self.started_at else 0,
+            'timeout': self.timeout,
+            'games_at_start': self.games_at_start,
+            'games_left': len(live_games()),
+            'games_handed_off': self.handed_off,
+            'results_pending': len(persistence.result_writer.pending),
+            'done': self.finished_at is not None
+        }
+
+    async def _run(self, exit_when_done):
+        """Drain task: waits for the games, hands off the rest, flushes and exits"""
+        try:
+            deadline = self.started_at + self.timeout
+            last_report = time.time()
+            while live_games() and time.time() < deadline:
+                await asyncio.sleep(1)
+                if time.time() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.time()
+                    self.report()
+
+            remaining = live_games()
+            if remaining:
+                self.phase = 'handing_off'
+                self.report()
+                await self.hand_off(remaining)
+
+            self.phase = 'flushing'
+            await persistence.result_writer.flush()
+            if checkpoint_writer is not None:
+                await checkpoint_writer.flush()
+
+            self.phase = 'drained'
+            self.finished_at = time.time()
+            self.report()
+        except Exception as e:
+            print(f"Error draining worker: {str(e)}")
+            traceback.print_exc()
+
+        if exit_when_done:
+            # Same path as a regular shutdown of daphne
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    async def hand_off(self, game_ids):
+        """
+        Moves games that didn't end in time off this worker.
+
+        Args:
+            game_ids: IDs of the games still running
+        """
+        if checkpoint_writer is None:
+            print(f"Checkpoints are off, {len(game_ids)} games end with this worker")
+            return
+        if not checkpoint_writer.store.shared:
+            # No other worker could read the hand-off checkpoints
+            print(f"Checkpoints aren't shared between workers, {len(game_ids)} games end with this worker")
+            return
+        # Imported here, game_consumers checks the drain state on connect
+        from .game_consumers import hand_off_game
+        for game_id in await checkpoint_writer.hand_off(game_ids):
+            await hand_off_game(game_id)
+            self.handed_off += 1
+
+    def report(self):
+        """Prints the drain progress"""
+        status = self.status()
+        print(f"Drain {status['phase']}: {status['games_left']}/{status['games_at_start']} games left, "
+              f"{status['games_handed_off']} handed off, {status['results_pending']} results pending, "
+              f"{status['elapsed']}s elapsed")
+
+
+def live_games():
+    """IDs of this worker's games that aren't over yet"""
+    return [
+        game_id for game_id, game_state in list(game_logic.active_games.items())
+        if game_state.game_status not in FINISHED_STATUSES
+    ]
+
+
+def is_draining():
+    """True once this worker started draining"""
+    return worker_drain.draining
+
+
+async def start_drain(reason, exit_when_done=True):
+    """Starts draining from a coroutine (admin view through async_to_sync)"""
+    return worker_drain.start(reason, exit_when_done)
+
+
+def drain_status():
+    """Returns the drain progress of this worker"""
+    return worker_drain.status()
+
+
+def install_signal_handler():
+    """
+    Starts draining when the process receives PONG_DRAIN_SIGNAL.
+
+    Call it once from the ASGI module; the handler runs on the main thread,
+    where daphne runs the event loop.
+    """
+    name = getattr(settings, 'PONG_DRAIN_SIGNAL', 'SIGUSR1')
+    signum = getattr(signal, name, None)
+    if signum is None:
+        print(f"Unknown drain signal {name}, drain is only available from the admin endpoint")
+        return
+
+    def handle_signal(signum, frame):
+        loop = asyncio.get_event_loop()
+        loop.call_soon_threadsafe(worker_drain.start, f"signal {name}")
+
+    signal.signal(signum, handle_signal)
+
+
+# Drain state of this process
+worker_drain = Drain()
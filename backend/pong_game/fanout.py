@@ -0,0 +1,433 @@
+"""
+Local fast path for game frame fan-out.
+
+Sending a frame through channel_layer.group_send costs a Redis round trip and
+makes every receiving consumer serialize the same dictionary again. When both
+players of a game are connected to this process, there is no need for either:
+the frame is serialized once (JSON text and/or the packed binary form) and the
+bytes are written straight to each registered socket.
+
+The channel layer is only used when a player is attached to another worker.
+
+Nothing here waits for a socket or for the channel layer, so a slow client or
+a slow Redis can't stall the game loop:
+
+- every game socket writes through its SocketOutbox, a queue drained by its
+  own writer task. State frames are bounded (PONG_SEND_QUEUE): when a new
+  frame doesn't fit, the oldest delta is folded into the frame after it
+  (frames.merge_deltas), or dropped when a keyframe follows it, so the
+  client never sees a gap in the sequence numbers and never needs a resync;
+  control messages (game_status_changed, game_completed, ...) and the close
+  are never dropped and keep their order. The frames waiting are reported to
+  rates.py, which slows the game's broadcasts down;
+- what goes through the channel layer from the game loop (frames and
+  events while a player is on another worker) is queued in the game's
+  GroupSender with the same policy and sent by its own task.
+
+Events (send_event) take the same path as the frames: straight into the
+outboxes when both players are local, through the GroupSender otherwise, so
+they reach each socket in order with the frames queued around them. The
+fast path is only taken once the GroupSender has sent everything, so
+nothing overtakes a message still on its way through the layer.
+
+queue_stats() reports the depth and drop counters of both.
+"""
+import asyncio
+import collections
+import json
+import traceback
+from django.conf import settings
+from . import frames, rates
+from .tasks import spawn_detached
+
+# State frames waiting per socket or game group before the oldest is merged away
+SEND_QUEUE = getattr(settings, 'PONG_SEND_QUEUE', 8)
+
+# Game sockets attached to this process: game_id -> {player_num: consumer}
+local_players = {}
+
+# Outboxes of the game sockets open in this process
+outboxes = set()
+
+# Channel layer senders of the games owned here, keyed by game ID
+group_senders = {}
+
+# Queue entry kinds
+FRAME = 'frame'
+CONTROL = 'control'
+CLOSE = 'close'
+
+
+class SocketOutbox:
+    """
+    Outbound queue of one game socket, drained by its writer task.
+
+    The consumer provides write_now(data) and close_now(code), which write
+    to the socket directly.
+    """
+
+    def __init__(self, consumer, game_id, player_num, report_backlog=False, max_frames=None):
+        self.consumer = consumer
+        self.game_id = game_id
+        self.player_num = player_num
+        # Only the owner of the game keeps rates for its players
+        self.report_backlog = report_backlog
+        self.max_frames = SEND_QUEUE if max_frames is None else max_frames
+        self.queue = collections.deque()
+        self.frames = 0  # State frames in the queue
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.stopped = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        outboxes.add(self)
+
+    def put_frame(self, data, message):
+        """
+        Queues a state frame; when the queue is full, the oldest frame is
+        folded into the next one (see _shed_frame).
+
+        Args:
+            data: JSON text or packed bytes of message, as sent to this socket
+            message: The game_state or game_delta message
+        """
+        if self.stopped:
+            return
+        self.queue.append((FRAME, data, message))
+        self.frames += 1
+        if self.frames > self.max_frames and _shed_frame(self.queue, self._serialize):
+            self.frames -= 1
+            self.dropped += 1
+        self._queued()
+
+    def put_control(self, data):
+        """Queues a message that must be delivered (JSON text or bytes)"""
+        if self.stopped:
+            return
+        self.queue.append((CONTROL, data, None))
+        self._queued()
+
+    def put_close(self, code=None):
+        """Closes the socket once everything queued before is written"""
+        if self.stopped:
+            return
+        self.queue.append((CLOSE, code, None))
+        self._queued()
+
+    def _serialize(self, message):
+        return frame_payload(message, self.consumer.binary_frames)
+
+    def _queued(self):
+        self.max_depth = max(self.max_depth, len(self.queue))
+        if self.report_backlog:
+            rates.report_client(self.game_id, self.player_num, backlog=self.frames)
+        self._ready.set()
+
+    async def _run(self):
+        """Writer task: writes the queue to the socket in order"""
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                kind, data, _ = self.queue.popleft()
+                if kind == FRAME:
+                    self.frames -= 1
+                    if self.report_backlog:
+                        rates.report_client(self.game_id, self.player_num, backlog=self.frames)
+                if kind == CLOSE:
+                    self.stopped = True
+                    await self.consumer.close_now(data)
+                    return
+                await self.consumer.write_now(data)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error writing to player {self.player_num} of game {self.game_id}: {str(e)}")
+            self.stopped = True
+
+    def stop(self):
+        """Stops the writer when the socket is gone, dropping what is left"""
+        self.stopped = True
+        self.queue.clear()
+        self.frames = 0
+        self._task.cancel()
+        outboxes.discard(self)
+
+    def stats(self):
+        """Depth and counters of the queue"""
+        return {
+            'game_id': self.game_id,
+            'player': self.player_num,
+            'depth': len(self.queue),
+            'frames': self.frames,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped
+        }
+
+
+class GroupSender:
+    """
+    Channel layer messages of one game, sent to its group by their own task
+    so the game loop never waits for the layer.
+    """
+
+    def __init__(self, channel_layer, game_group, game_id, max_frames=None):
+        self.channel_layer = channel_layer
+        self.game_group = game_group
+        self.game_id = game_id
+        self.max_frames = SEND_QUEUE if max_frames is None else max_frames
+        self.queue = collections.deque()
+        self.frames = 0
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._task = None
+
+    def put(self, message, droppable):
+        """
+        Queues a message for the game group.
+
+        Args:
+            message: Channel layer message
+            droppable: True for state frames, which may be folded into the
+                next one when the queue is full; events are always sent
+        """
+        if droppable:
+            self.queue.append((FRAME, message, message))
+            self.frames += 1
+            if self.frames > self.max_frames and _shed_frame(self.queue, _same_message):
+                self.frames -= 1
+                self.dropped += 1
+        else:
+            self.queue.append((CONTROL, message, None))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        if self._task is None or self._task.done():
+            # Fresh context, the sender outlives whatever queued the first message
+            self._task = spawn_detached(self._run())
+
+    def idle(self):
+        """True when nothing is queued or being sent"""
+        return self._task is None or self._task.done()
+
+    async def _run(self):
+        """Sender task: runs until the queue is empty"""
+        while self.queue:
+            kind, message, _ = self.queue.popleft()
+            if kind == FRAME:
+                self.frames -= 1
+            try:
+                await self.channel_layer.group_send(self.game_group, message)
+                self.sent += 1
+            except Exception as e:
+                print(f"Error sending to game {self.game_id}: {str(e)}")
+                traceback.print_exc()
+
+    def stats(self):
+        """Depth and counters of the queue"""
+        return {
+            'game_id': self.game_id,
+            'depth': len(self.queue),
+            'frames': self.frames,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped
+        }
+
+
+def _shed_frame(queue, serialize):
+    """
+    Removes one state frame from a full queue without breaking the client's
+    sequence: the oldest frame followed by a keyframe is dropped (the
+    keyframe doesn't depend on it), or the oldest delta followed by another
+    delta is merged into it.
+
+    Args:
+        queue: Deque of (kind, data, message) entries
+        serialize: Turns a merged message into the queue's data
+
+    Returns:
+        True if a frame was removed, False if none can be (a single keyframe
+        and the deltas depending on it)
+    """
+    previous = None
+    for index, (kind, _, message) in enumerate(queue):
+        if kind != FRAME:
+            continue
+        if previous is not None:
+            previous_index, previous_message = previous
+            if message['type'] == 'game_state':
+                del queue[previous_index]
+                return True
+            if previous_message['type'] == 'game_delta':
+                merged = frames.merge_deltas(previous_message, message)
+                queue[index] = (FRAME, serialize(merged), merged)
+                del queue[previous_index]
+                return True
+        previous = (index, message)
+    return False
+
+
+def _same_message(message):
+    return message
+
+
+def frame_payload(message, binary_frames):
+    """
+    Serializes a state frame for one socket.
+
+    Args:
+        message: game_state or game_delta message (may carry 'binary')
+        binary_frames: True if the socket asked for packed deltas
+
+    Returns:
+        The packed bytes, or the JSON text without the packed form
+    """
+    binary = message.get('binary')
+    if binary is not None and binary_frames:
+        return binary
+    return json.dumps({key: value for key, value in message.items() if key != 'binary'})
+
+# Frame types that are pure "send to client" messages and can skip the layer
+FAST_PATH_TYPES = ('game_state', 'game_delta')
+
+
+def attach(game_id, player_num, consumer):
+    """
+    Registers a connected player socket of this process.
+
+    Args:
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+        consumer: The GameConsumer handling the socket
+    """
+    local_players.setdefault(game_id, {})[player_num] = consumer
+
+
+def detach(game_id, player_num, consumer):
+    """
+    Removes a player socket, unless the slot was already taken over by a
+    newer connection of the same player.
+
+    Args:
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+        consumer: The GameConsumer that is going away
+    """
+    consumers = local_players.get(game_id)
+    if not consumers or consumers.get(player_num) is not consumer:
+        return
+    del consumers[player_num]
+    if not consumers:
+        del local_players[game_id]
+
+
+def all_players_local(game_id):
+    """Checks if both players of a game are attached to this process"""
+    consumers = local_players.get(game_id)
+    return consumers is not None and len(consumers) == 2
+
+
+def _fast_path(game_id):
+    """Both players are local and the channel layer path has nothing in flight"""
+    if not all_players_local(game_id):
+        return False
+    sender = group_senders.get(game_id)
+    return sender is None or sender.idle()
+
+
+def send_frame(channel_layer, game_group, game_id, message):
+    """
+    Queues a state frame for both players of a game, without waiting.
+
+    Args:
+        channel_layer: The channel layer used when a player is remote
+        game_group: The channel layer group of the game
+        game_id: The ID of the game
+        message: game_state or game_delta message (may carry 'binary')
+
+    Returns:
+        Size of the largest payload queued for a player, or None when the
+        frame went through the channel layer (serialized there)
+    """
+    if message['type'] not in FAST_PATH_TYPES or not _fast_path(game_id):
+        group_sender(channel_layer, game_group, game_id).put(
+            message, droppable=message['type'] in FAST_PATH_TYPES
+        )
+        return None
+
+    binary = message.get('binary')
+    text = None
+    size = 0
+    for consumer in list(local_players.get(game_id, {}).values()):
+        try:
+            if binary is not None and consumer.binary_frames:
+                payload = binary
+            else:
+                if text is None:
+                    text = frame_payload(message, False)
+                payload = text
+            consumer.outbox.put_frame(payload, message)
+            size = max(size, len(payload))
+        except Exception as e:
+            print(f"Error queuing frame for game {game_id}: {str(e)}")
+            traceback.print_exc()
+    return size
+
+
+def send_event(channel_layer, game_group, game_id, message):
+    """
+    Queues a game event (game_status_changed, game_completed, ...) for both
+    players, in order with the frames and never dropped.
+
+    Args:
+        channel_layer: The channel layer used when a player is remote
+        game_group: The channel layer group of the game
+        game_id: The ID of the game
+        message: Event message, its type naming the consumer handler
+    """
+    if not _fast_path(game_id):
+        group_sender(channel_layer, game_group, game_id).put(message, droppable=False)
+        return
+
+    text = json.dumps(message)
+    for consumer in list(local_players.get(game_id, {}).values()):
+        try:
+            consumer.queue_event(message, text)
+        except Exception as e:
+            print(f"Error queuing {message['type']} for game {game_id}: {str(e)}")
+            traceback.print_exc()
+
+
+def group_sender(channel_layer, game_group, game_id):
+    """Returns the channel layer sender of a game, creating it on first use"""
+    sender = group_senders.get(game_id)
+    if sender is None:
+        sender = group_senders[game_id] = GroupSender(channel_layer, game_group, game_id)
+    return sender
+
+
+def forget_game(game_id):
+    """Drops the sender of a game leaving memory; what it still holds is sent"""
+    group_senders.pop(game_id, None)
+
+
+def queue_stats():
+    """
+    Reports the send queues of this process.
+
+    Returns:
+        Dictionary with the stats of every socket outbox and game sender,
+        and the totals of dropped frames
+    """
+    sockets = [outbox.stats() for outbox in list(outboxes)]
+    groups = [sender.stats() for sender in list(group_senders.values())]
+    return {
+        'queue_limit': SEND_QUEUE,
+        'sockets': sockets,
+        'groups': groups,
+        'frames_dropped': sum(stats['dropped'] for stats in sockets + groups)
+    }
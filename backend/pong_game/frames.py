@@ -0,0 +1,292 @@
+"""
+Snapshot/delta encoding for game_state broadcasts.
+
+Most of a game state (players, settings, difficulty, ...) never changes while
+a match is being played, yet it used to be sent 60 times per second. Each game
+now has a FrameEncoder that numbers every broadcast frame and sends either:
+
+- a keyframe: ``{'type': 'game_state', 'seq': n, 'keyframe': True, 'state': {...}}``
+  with the full wire state, on join, on match end, on request and every
+  KEYFRAME_INTERVAL frames, or
+- a delta: ``{'type': 'game_delta', 'seq': n, 'delta': {...}}`` holding only the
+  dynamic fields that changed since frame n - 1.
+
+A client that sees a gap in the sequence numbers sends ``{'type': 'resync'}``
+and the next frame for that game is a keyframe.
+
+A send queue that has to drop a delta folds it into the delta after it
+(merge_deltas) instead of leaving a gap: the merged delta keeps the later
+sequence number and carries ``'base'``, the frame it applies on top of.
+
+Every frame also carries the server tick and, per player, the sequence number
+and timestamp of the last paddle_move that was applied (GameState.acks), so a
+client predicting its own paddle can drop the inputs the server has seen and
+replay only the newer ones on top of the authoritative state.
+
+Clients that connect with ``?format=binary`` receive deltas as fixed-layout
+binary frames instead of JSON and may send ``paddle_move`` as binary too
+(see pack_delta / unpack_client_message). Keyframes stay JSON: they carry
+variable-length data such as usernames and are sent at most about once a
+second.
+"""
+import struct
+
+# Send a full keyframe at least once per second at the default broadcast rate
+KEYFRAME_INTERVAL = 60
+
+# Precision (decimal places) used for positions and velocities in deltas
+DELTA_PRECISION = 2
+
+# Short wire keys for the dynamic fields, in snapshot order: ball, paddles,
+# scores, server tick, then input sequence number and timestamp acks per player
+DELTA_KEYS = ('bx', 'by', 'bdx', 'bdy', 'bs', 'ly', 'ry', 'ls', 'rs', 'tk', 'a1', 't1', 'a2', 't2')
+
+
+def snapshot(game_state):
+    """
+    Captures the dynamic fields of a game state.
+
+    Args:
+        game_state: The GameState to capture
+
+    Returns:
+        Tuple of values in DELTA_KEYS order
+    """
+    ball = game_state.ball
+    left_paddle = game_state.left_paddle
+    right_paddle = game_state.right_paddle
+    left_ack = game_state.acks[1]
+    right_ack = game_state.acks[2]
+    return (
+        round(ball.x, DELTA_PRECISION),
+        round(ball.y, DELTA_PRECISION),
+        round(ball.dx, DELTA_PRECISION),
+        round(ball.dy, DELTA_PRECISION),
+        round(ball.speed, DELTA_PRECISION),
+        round(left_paddle.y, DELTA_PRECISION),
+        round(right_paddle.y, DELTA_PRECISION),
+        left_paddle.score,
+        right_paddle.score,
+        game_state.tick,
+        left_ack[0],
+        left_ack[1],
+        right_ack[0],
+        right_ack[1]
+    )
+
+
+# Binary layouts (little-endian)
+#   server -> client delta: uint8 kind, uint32 seq, uint16 field mask, then one
+#                           value per set bit in DELTA_KEYS order
+#   server -> client merged delta: uint8 kind, uint32 seq, uint32 base,
+#                                  uint16 field mask, then the values
+#   client -> server paddle_move: uint8 kind, float32 position, and with kind
+#                                 BINARY_PADDLE_MOVE_SEQ uint32 seq, float64 timestamp
+BINARY_DELTA = 1
+BINARY_MERGED_DELTA = 2
+BINARY_PADDLE_MOVE = 1
+BINARY_PADDLE_MOVE_SEQ = 2
+DELTA_HEADER = struct.Struct('<BIH')
+MERGED_DELTA_HEADER = struct.Struct('<BIIH')
+PADDLE_MOVE = struct.Struct('<Bf')
+PADDLE_MOVE_SEQ = struct.Struct('<BfId')
+# Positions, velocities and speed are float32, scores uint16, tick and input
+# sequence numbers uint32, client timestamps float64
+DELTA_VALUE_FORMATS = ('f', 'f', 'f', 'f', 'f', 'f', 'f', 'H', 'H', 'I', 'I', 'd', 'I', 'd')
+_delta_value_structs = {}
+
+
+def pack_delta(message):
+    """
+    Packs a game_delta message into its binary layout.
+
+    Args:
+        message: game_delta message produced by FrameEncoder.encode
+
+    Returns:
+        Bytes ready to be sent as a binary websocket frame
+    """
+    delta = message['delta']
+    mask = 0
+    values = []
+    for bit, key in enumerate(DELTA_KEYS):
+        if key in delta:
+            mask |= 1 << bit
+            values.append(delta[key])
+
+    values_struct = _delta_value_structs.get(mask)
+    if values_struct is None:
+        layout = ''.join(fmt for bit, fmt in enumerate(DELTA_VALUE_FORMATS) if mask & (1 << bit))
+        values_struct = _delta_value_structs[mask] = struct.Struct('<' + layout)
+
+    if 'base' in message:
+        header = MERGED_DELTA_HEADER.pack(BINARY_MERGED_DELTA, message['seq'], message['base'], mask)
+    else:
+        header = DELTA_HEADER.pack(BINARY_DELTA, message['seq'], mask)
+    return header + values_struct.pack(*values)
+
+
+def delta_base(message):
+    """Sequence number of the frame a game_delta message applies on top of"""
+    return message.get('base', message['seq'] - 1)
+
+
+def merge_deltas(older, newer):
+    """
+    Folds a delta into the delta following it, for send queues that have to
+    drop a frame without leaving a gap in the client's sequence.
+
+    Args:
+        older: game_delta message being dropped
+        newer: game_delta message following it
+
+    Returns:
+        game_delta message with the sequence number of newer, applying on
+        top of the frame older applied to, with its packed form under 'binary'
+    """
+    delta = dict(older['delta'])
+    delta.update(newer['delta'])
+    message = {
+        'type': 'game_delta',
+        'seq': newer['seq'],
+        'base': delta_base(older),
+        'delta': delta
+    }
+    message['binary'] = pack_delta(message)
+    return message
+
+
+def unpack_client_message(data):
+    """
+    Decodes a binary message sent by a client.
+
+    Args:
+        data: Raw bytes of the websocket frame
+
+    Returns:
+        The equivalent JSON message as a dictionary, or None if unknown
+    """
+    if len(data) == PADDLE_MOVE.size and data[0] == BINARY_PADDLE_MOVE:
+        _, position = PADDLE_MOVE.unpack(data)
+        return {'type': 'paddle_move', 'position': position}
+    if len(data) == PADDLE_MOVE_SEQ.size and data[0] == BINARY_PADDLE_MOVE_SEQ:
+        _, position, seq, sent_at = PADDLE_MOVE_SEQ.unpack(data)
+        return {'type': 'paddle_move', 'position': position, 'seq': seq, 't': sent_at}
+    return None
+
+
+class FrameEncoder:
+    """Numbers the frames of one game and turns them into keyframes or deltas"""
+
+    __slots__ = ('seq', 'last', 'frames_since_keyframe', 'keyframe_pending', 'keyframe_interval')
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.seq = 0
+        self.last = None
+        self.frames_since_keyframe = 0
+        self.keyframe_pending = True
+        self.keyframe_interval = keyframe_interval
+
+    def force_keyframe(self):
+        """Makes the next encoded frame a keyframe (join, resync request)"""
+        self.keyframe_pending = True
+
+    def keyframe(self, game_state, extra=None):
+        """
+        Encodes a full keyframe and makes it the base for following deltas.
+
+        Args:
+            game_state: The GameState to send
+            extra: Optional fields added to the wire state
+
+        Returns:
+            game_state message for the channel layer
+        """
+        self.seq += 1
+        self.last = snapshot(game_state)
+        self.frames_since_keyframe = 0
+        self.keyframe_pending = False
+
+        state = game_state.to_wire()
+        if extra:
+            state.update(extra)
+        return {
+            'type': 'game_state',
+            'seq': self.seq,
+            'keyframe': True,
+            'state': state
+        }
+
+    def join_keyframe(self, game_state):
+        """
+        Builds a keyframe for a single joining client.
+
+        The frame reuses the current sequence number so it doesn't create a
+        gap for the other client. The next broadcast is forced to be a
+        keyframe so the joining client gets a consistent delta base.
+
+        Args:
+            game_state: The GameState to send
+
+        Returns:
+            game_state message for the joining client only
+        """
+        self.force_keyframe()
+        return {
+            'type': 'game_state',
+            'seq': self.seq,
+            'keyframe': True,
+            'state': game_state.to_wire()
+        }
+
+    def encode(self, game_state, extra=None):
+        """
+        Encodes the next broadcast frame.
+
+        Args:
+            game_state: The GameState to send
+            extra: Optional fields added to the wire state of keyframes
+
+        Returns:
+            Either a keyframe (game_state) or a delta (game_delta) message;
+            deltas also carry their packed binary form under 'binary'
+        """
+        if (self.keyframe_pending or self.last is None or
+                self.frames_since_keyframe >= self.keyframe_interval):
+            return self.keyframe(game_state, extra)
+
+        current = snapshot(game_state)
+        delta = {
+            key: value
+            for key, value, previous in zip(DELTA_KEYS, current, self.last)
+            if value != previous
+        }
+
+        self.seq += 1
+        self.last = current
+        self.frames_since_keyframe += 1
+        message = {
+            'type': 'game_delta',
+            'seq': self.seq,
+            'delta': delta
+        }
+        # Packed once here and shared by every binary recipient
+        message['binary'] = pack_delta(message)
+        return message
+
+
+# Frame encoders of the games in active_games, keyed by game ID
+frame_encoders = {}
+
+
+def get_encoder(game_id):
+    """Returns the frame encoder of a game, creating it on first use"""
+    encoder = frame_encoders.get(game_id)
+    if encoder is None:
+        encoder = frame_encoders[game_id] = FrameEncoder()
+    return encoder
+
+
+def discard_encoder(game_id):
+    """Forgets the frame encoder of a game that left memory"""
+    frame_encoders.pop(game_id, None)
@@ -1,17 +1,701 @@
 import json
 import asyncio
 import time
+import traceback
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
 from .models import Game
 from . import game_logic
+from . import frames
+from . import fanout
+from . import replay
+from . import rates
+from . import drain
+from . import spectators
+from .registry import game_registry, summarize_game, WORKER_ID
+from .checkpoints import checkpoint_writer
+from .loop_metrics import loop_metrics
+from .scheduler import game_scheduler
+from .tasks import spawn_detached
+from .timers import game_timers
+
+# Seconds between two publications of this worker's game summaries
+SUMMARY_PUBLISH_INTERVAL = 1.0
+
+# Game deadlines (timers.py), in seconds: how long a player waits for its
+# opponent (with a status update every OPPONENT_WAIT_UPDATE), how long a game
+# nobody is connected to is kept, and how long after a match ends the next
+# one starts by itself (0 = only when a player asks)
+OPPONENT_WAIT = getattr(settings, 'PONG_OPPONENT_WAIT', 10)
+OPPONENT_WAIT_UPDATE = 5
+INACTIVE_TIMEOUT = getattr(settings, 'PONG_INACTIVE_TIMEOUT', 300)
+NEXT_MATCH_DELAY = getattr(settings, 'PONG_NEXT_MATCH_DELAY', 15)
+# Seconds the sockets stay open after game_completed
+GAME_COMPLETED_CLOSE_DELAY = 2
+
+# Seconds a dropped player's slot is held, the game paused, before the game
+# is abandoned (0 = abandon right away); only for games that got past
+# 'waiting'. Sockets taking a held slot back present the resume token sent
+# in connection_established, or are closed with RESUME_REFUSED_CLOSE_CODE.
+RECONNECT_GRACE = getattr(settings, 'PONG_RECONNECT_GRACE', 20)
+HOLDABLE_STATUSES = ('menu', 'playing', 'paused', 'matchOver')
+RESUME_REFUSED_CLOSE_CODE = 4009
+
+# Pending deadlines of the games owned by this worker: game_id -> {kind: Timer}
+deadlines = {}
+
+# Channel where this worker receives inputs forwarded by relay consumers
+_owner_inbox = None
+
+# Message budget of every game socket, keyed by channel name
+input_limiter = game_logic.RateLimiter(
+    max_messages=getattr(settings, 'PONG_INPUT_BUDGET', 60), window_seconds=1
+)
+
+
+class GameRunner:
+    """
+    Scheduler callback of a game owned by this worker.
+
+    Lives independently of the consumers so the game keeps running whichever
+    socket (local or relayed from another worker) started it.
+    """
+
+    def __init__(self, game_id, channel_layer):
+        self.game_id = game_id
+        self.game_group = f"game_{game_id}"
+        self.channel_layer = channel_layer
+        # Scheduler broadcast ticks seen while playing
+        self.broadcast_ticks = 0
+
+    async def tick(self, current_time, score_happened, broadcast_due):
+        """
+        Handles one tick of the shared scheduler for this game.
+        Physics has already been advanced by the scheduler; this method
+        handles match end and state broadcasts (inactivity is a timer, see
+        arm_inactivity_timeout).
+        """
+        if self.game_id not in game_logic.active_games:
+            game_scheduler.unregister(self.game_id)
+            return
+
+        game_state = game_logic.active_games[self.game_id]
+
+        # Spectators get their own slower stream, encoded once for all of them
+        spectators.publish(self.channel_layer, self.game_id, game_state, current_time)
+
+        # Nothing to do for games that aren't playing
+        if game_state.game_status != 'playing':
+            return
+
+        # If a score happened, check if match ended
+        if score_happened:
+            game_logic.record_point(self.game_id)
+            match_ended = game_logic.check_match_end(self.game_id)
+
+            # If match ended, notify players of new status immediately
+            if match_ended:
+                replay.record_input(self.game_id, replay.MATCH_END)
+                fanout.send_event(
+                    self.channel_layer, self.game_group, self.game_id,
+                    {
+                        'type': 'game_status_changed',
+                        'status': game_logic.active_games[self.game_id].game_status,
+                        'winner': game_logic.active_games[self.game_id].winner
+                    })
+
+                # Ensure we broadcast the final state as a keyframe
+                fanout.send_frame(
+                    self.channel_layer, self.game_group, self.game_id,
+                    frames.get_encoder(self.game_id).keyframe(game_logic.active_games[self.game_id])
+                )
+                if game_logic.active_games[self.game_id].game_status == 'gameOver':
+                    # Queued for the write-behind writer, no database wait here
+                    game_logic.save_game_results(self.game_id)
+
+                    # Force both players to disconnect since game is over
+                    fanout.send_event(
+                        self.channel_layer, self.game_group, self.game_id,
+                        {
+                            'type': 'game_completed',
+                            'winner': game_logic.active_games[self.game_id].winner,
+                            'final_state': game_logic.active_games[self.game_id].to_wire()
+                        }
+                    )
+                else:
+                    # The finished match is written now, the game goes on
+                    game_logic.save_match_results(self.game_id)
+                    if NEXT_MATCH_DELAY > 0:
+                        # Next match starts by itself unless a player starts it first
+                        set_deadline(self.game_id, 'next_match', NEXT_MATCH_DELAY,
+                                     start_next_match, self.channel_layer, self.game_id)
+                return
+
+        # Broadcast state at this game's rate (difficulty and connection quality)
+        if broadcast_due:
+            self.broadcast_ticks += 1
+            if self.broadcast_ticks % rates.broadcast_divisor(game_state, game_scheduler.broadcast_rate):
+                return
+
+            # Keyframes carry prediction data for smooth client-side interpolation,
+            # every other frame only carries the fields that changed
+            frame = frames.get_encoder(self.game_id).encode(
+                game_logic.active_games[self.game_id],
+                extra={
+                    'broadcast_time': current_time,
+                    'physics_interval': game_scheduler.tick_interval
+                }
+            )
+            # Serialized once and queued directly when both players are local
+            size = fanout.send_frame(self.channel_layer, self.game_group, self.game_id, frame)
+            if loop_metrics is not None:
+                if size is None:
+                    # Went through the channel layer, measured here
+                    binary = frame.get('binary')
+                    size = len(binary) if binary is not None else len(json.dumps(
+                        {key: value for key, value in frame.items() if key != 'binary'}
+                    ))
+                loop_metrics.record_broadcast(
+                    self.game_id, asyncio.get_running_loop().time() - game_scheduler.tick_started, size
+                )
+
+
+def start_game_loop(game_id, channel_layer):
+    """Register a game with the shared scheduler if it isn't driven yet"""
+    if game_id not in game_logic.active_games:
+        return
+    if game_scheduler.is_registered(game_id):
+        return
+    game_scheduler.register(game_id, GameRunner(game_id, channel_layer).tick)
+    if checkpoint_writer is not None:
+        checkpoint_writer.start()
+
+
+def set_deadline(game_id, kind, delay, callback, *args):
+    """
+    Schedules a deadline of a game on the shared timer wheel, replacing any
+    earlier deadline of the same kind.
+
+    Args:
+        game_id: The ID of the game
+        kind: Name of the deadline ('inactive', 'next_match', 'reconnect1', ...)
+        delay: Seconds from now
+        callback: Function or coroutine function called at the deadline
+        *args: Arguments of the callback
+    """
+    cancel_deadline(game_id, kind)
+    deadlines.setdefault(game_id, {})[kind] = game_timers.schedule(delay, callback, *args)
+
+
+def cancel_deadline(game_id, kind=None):
+    """Cancels a deadline of a game, or all of them when kind is None"""
+    timers = deadlines.get(game_id)
+    if not timers:
+        return
+    for name in ([kind] if kind is not None else list(timers)):
+        timer = timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+    if not timers:
+        deadlines.pop(game_id, None)
+
+
+def arm_inactivity_timeout(game_id):
+    """(Re)starts the countdown after which a game nobody is connected to ends"""
+    set_deadline(game_id, 'inactive', INACTIVE_TIMEOUT, expire_inactive_game, game_id)
+
+
+async def expire_inactive_game(game_id):
+    """Inactivity deadline: ends the game if nobody is connected, else checks again later"""
+    deadlines.get(game_id, {}).pop('inactive', None)
+    if game_id not in game_logic.active_games:
+        return
+    if game_logic.is_any_player_connected(game_id):
+        arm_inactivity_timeout(game_id)
+        return
+    print(f"Game {game_id}: nobody connected for {INACTIVE_TIMEOUT}s, ending it")
+    game_logic.save_game_results(game_id)
+    await release_game(game_id)
+
+
+def resume_token(game_id, player_num):
+    """
+    Token letting a player take its held slot back after a dropped connection.
+
+    Derived from SECRET_KEY so every worker can check it, whichever one the
+    player reconnects to; the player itself is still authenticated by its JWT.
+    """
+    return salted_hmac('pong_game.resume', f"{game_id}:{player_num}").hexdigest()[:32]
+
+
+def may_take_slot(game_id, player_num, token):
+    """
+    Checks whether a connecting player may take its slot.
+
+    Args:
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+        token: The resume token presented by the socket, or None
+
+    Returns:
+        False if the slot is held and the token isn't the slot's resume token
+    """
+    game_state = game_logic.active_games.get(game_id)
+    if game_state is None or not game_state.player(player_num).held:
+        return True
+    return token is not None and constant_time_compare(token, resume_token(game_id, player_num))
+
+
+async def expire_reconnect_grace(channel_layer, game_id, player_num):
+    """Reconnection deadline: abandons the game if the player didn't come back"""
+    deadlines.get(game_id, {}).pop(f'reconnect{player_num}', None)
+    game_state = game_logic.active_games.get(game_id)
+    if game_state is None or not game_state.player(player_num).held:
+        return
+    print(f"Game {game_id}: player {player_num} did not reconnect within {RECONNECT_GRACE}s, abandoning the game")
+    for num in (1, 2):
+        game_state.player(num).held = False
+        cancel_deadline(game_id, f'reconnect{num}')
+    await abandon_game(channel_layer, game_id, player_num)
+
+
+async def abandon_game(channel_layer, game_id, player_num):
+    """
+    Ends a game a player left: disconnects the other player, saves the
+    results and frees the game once nobody is connected.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+        player_num: The player who left (1 or 2)
+    """
+    # Queue the results first: the other player's socket only marks the
+    # game cancelled when no result is on its way, otherwise the writer
+    # would find the row cancelled and drop the result
+    game_state = game_logic.active_games[game_id]
+    result_saved = game_state.game_status == 'gameOver'
+    if not result_saved:
+        # Once the game got past waiting, the player who stayed wins it
+        forfeited_by = player_num if game_state.game_status != 'waiting' else None
+        game_state.game_status = 'gameOver'
+        result_saved = game_logic.save_game_results(game_id, forfeited_by=forfeited_by)
+
+    # Force disconnect the other player too
+    await channel_layer.group_send(
+        f"game_{game_id}",
+        {
+            'type': 'force_disconnect',
+            'reason': f'Player {player_num} disconnected',
+            'result_saved': result_saved
+        }
+    )
+
+    # Clean up game state if both players are disconnected
+    if not game_logic.is_any_player_connected(game_id):
+        await release_game(game_id)
+    else:
+        arm_inactivity_timeout(game_id)
+
+
+async def release_game(game_id):
+    """Drops a finished game from this worker's memory and from the registry"""
+    cancel_deadline(game_id)
+    game_scheduler.unregister(game_id)
+    frames.discard_encoder(game_id)
+    rates.forget_game(game_id)
+    fanout.forget_game(game_id)
+    input_stats = game_scheduler.forget_inputs(game_id)
+    if input_stats and input_stats[1]:
+        print(f"Game {game_id}: {input_stats[0]} paddle moves applied, {input_stats[1]} coalesced")
+    replay.save_input_log(game_id)
+    if checkpoint_writer is not None:
+        checkpoint_writer.forget(game_id)
+    if loop_metrics is not None:
+        loop_metrics.forget_game(game_id)
+    game_logic.active_games.pop(game_id, None)
+    spectators.close_game(get_channel_layer(), game_id, 1000)
+    await sync_to_async(game_registry.release)(game_id)
+
+
+async def hand_off_game(game_id):
+    """
+    Drops a game that goes on elsewhere (drain.py) from this worker, without
+    ending it: its checkpoint is already written, its players are asked to
+    reconnect and the game is resumed by the worker they reach.
+    """
+    cancel_deadline(game_id)
+    game_scheduler.unregister(game_id)
+    frames.discard_encoder(game_id)
+    rates.forget_game(game_id)
+    fanout.forget_game(game_id)
+    game_scheduler.forget_inputs(game_id)
+    # The next owner can't replay the game from its first tick
+    replay.discard_input_log(game_id)
+    if loop_metrics is not None:
+        loop_metrics.forget_game(game_id)
+    # Gone before the sockets close, so their disconnect doesn't end the game
+    game_logic.active_games.pop(game_id, None)
+    spectators.close_game(get_channel_layer(), game_id, drain.DRAINING_CLOSE_CODE)
+    await sync_to_async(game_registry.release)(game_id)
+    await get_channel_layer().group_send(
+        f"game_{game_id}",
+        {
+            'type': 'server_draining',
+            'resume': True
+        }
+    )
+
+
+# Game events applied by the owner, for local and relayed players alike
+
+async def handle_player_connected(channel_layer, game_id, player_num, send_to_player):
+    """
+    Marks a player as connected and starts the game once both are there.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+        send_to_player: Coroutine function delivering a message to that player
+
+    Returns:
+        Connection info from game_logic.set_player_connection
+    """
+    game_group = f"game_{game_id}"
+    if game_id not in game_logic.active_games:
+        return None
+
+    # Back within the reconnection grace window
+    resumed = game_logic.active_games[game_id].player(player_num).held
+    cancel_deadline(game_id, f'reconnect{player_num}')
+
+    # Mark player as connected
+    connection_info = game_logic.set_player_connection(game_id, player_num, True)
+    connection_info['resumed'] = resumed
+
+    # Initial keyframe; the next broadcast is a keyframe for both players
+    encoder = frames.get_encoder(game_id)
+    await send_to_player(encoder.join_keyframe(game_logic.active_games[game_id]))
+
+    # Notify other player about connection
+    await channel_layer.group_send(
+        game_group,
+        {
+            'type': 'player_status',
+            'player': player_num,
+            'connected': True,
+            'resumed': resumed
+        }
+    )
+
+    # If connection changed game status, notify both players
+    if connection_info.get('status_changed', False):
+        if connection_info['new_status'] == 'playing':
+            game_scheduler.wake()
+        elif connection_info['new_status'] == 'matchOver' and NEXT_MATCH_DELAY > 0:
+            # Paused between two matches, the countdown to the next one starts over
+            set_deadline(game_id, 'next_match', NEXT_MATCH_DELAY,
+                         start_next_match, channel_layer, game_id)
+        await channel_layer.group_send(
+            game_group,
+            {
+                'type': 'game_status_changed',
+                'status': connection_info.get('new_status', 'waiting')
+            }
+        )
+
+    # Check if both players are connected
+    if connection_info.get('both_connected', False):
+        # Both players are connected, we can start the game
+        if game_logic.active_games[game_id].game_status == 'menu':
+            start_game_loop(game_id, channel_layer)
+
+        # Update game status in database
+        await update_database_status(game_id, 'in_progress')
+
+    return connection_info
+
+
+async def handle_player_disconnected(channel_layer, game_id, player_num):
+    """
+    Marks a player as disconnected. A game that got past 'waiting' is paused
+    and the player's slot held for RECONNECT_GRACE seconds; otherwise (or
+    once the grace window expires) the game is abandoned.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+    """
+    if game_id not in game_logic.active_games:
+        return
+
+    game_state = game_logic.active_games[game_id]
+    if game_state.player(player_num).held:
+        # A socket refused for the held slot, the deadline keeps running
+        return
+
+    hold_slot = RECONNECT_GRACE > 0 and game_state.game_status in HOLDABLE_STATUSES
+
+    # Mark player as disconnected
+    connection_info = game_logic.set_player_connection(game_id, player_num, False, hold_slot=hold_slot)
+    rates.forget_client(game_id, player_num)
+
+    if not hold_slot:
+        await abandon_game(channel_layer, game_id, player_num)
+        return
+
+    game_group = f"game_{game_id}"
+    if connection_info['status_changed']:
+        # The next match waits for the players to be back
+        cancel_deadline(game_id, 'next_match')
+        await channel_layer.group_send(
+            game_group,
+            {
+                'type': 'game_status_changed',
+                'status': connection_info['new_status'],
+                'reason': f'Player {player_num} disconnected'
+            }
+        )
+
+    # The other player is told how long the slot is held
+    await channel_layer.group_send(
+        game_group,
+        {
+            'type': 'player_status',
+            'player': player_num,
+            'connected': False,
+            'reconnect_grace': RECONNECT_GRACE
+        }
+    )
+    set_deadline(game_id, f'reconnect{player_num}', RECONNECT_GRACE,
+                 expire_reconnect_grace, channel_layer, game_id, player_num)
+
+    if connection_info['any_connected']:
+        arm_inactivity_timeout(game_id)
+
+
+async def handle_player_message(channel_layer, game_id, player_num, content):
+    """
+    Applies a gameplay message sent by a player.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+        content: The decoded client message
+    """
+    game_group = f"game_{game_id}"
+    message_type = content.get('type', '')
+
+    if message_type == 'paddle_move':
+        # Update paddle position
+        position = content.get('position', None)
+        if position is not None:
+            # Rounded to the precision of the input log so replays are exact
+            position = replay.quantize_position(position)
+            # Optional client sequence number and timestamp, acknowledged in the
+            # frames once the input is applied (client-side prediction)
+            seq = content.get('seq')
+            sent_at = content.get('t')
+            if not isinstance(seq, int) or not 0 <= seq < 2 ** 32:
+                seq = None
+            if not isinstance(sent_at, (int, float)):
+                sent_at = 0.0
+            # Applied with the next tick, only the latest target per tick counts
+            game_scheduler.queue_paddle(game_id, player_num, position, seq, float(sent_at))
+
+    elif message_type == 'start_game':
+        # Start the game if it's currently in menu state
+        if game_id in game_logic.active_games:
+            current_status = game_logic.active_games[game_id].game_status
+            if current_status == 'menu':
+                # Change status to playing
+                new_status = game_logic.set_game_status(game_id, 'playing')
+                game_scheduler.wake()
+                # Notify all players about status change
+                fanout.send_event(
+                    channel_layer, game_group, game_id,
+                    {
+                        'type': 'game_status_changed',
+                        'status': new_status
+                    }
+                )
+
+    elif message_type == 'next_match':
+        # Start next match if current match is over
+        await start_next_match(channel_layer, game_id)
+
+    elif message_type == 'client_stats':
+        # Round-trip time measured by the client, slows broadcasts down when high
+        rtt = content.get('rtt')
+        if isinstance(rtt, (int, float)) and 0 <= rtt < 60000:
+            rates.report_client(game_id, player_num, rtt=float(rtt))
+
+    elif message_type == 'resync':
+        # Client missed a frame, send a keyframe with the next broadcast
+        if game_id in game_logic.active_games:
+            frames.get_encoder(game_id).force_keyframe()
+
+
+async def start_next_match(channel_layer, game_id):
+    """
+    Starts the next match of a game whose match is over, when a player asks
+    for it or when its 'next_match' deadline is reached.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+    """
+    if game_id not in game_logic.active_games:
+        return
+    if game_logic.active_games[game_id].game_status != 'matchOver':
+        return
+    cancel_deadline(game_id, 'next_match')
+    game_group = f"game_{game_id}"
+
+    # Reset for new match
+    game_logic.reset_for_new_match(game_id)
+    replay.record_input(game_id, replay.NEW_MATCH)
+
+    # Notify players of game state
+    encoder = frames.get_encoder(game_id)
+    fanout.send_frame(
+        channel_layer, game_group, game_id,
+        encoder.keyframe(game_logic.active_games[game_id])
+    )
+
+    # Set status to playing
+    new_status = game_logic.set_game_status(game_id, 'playing')
+    game_scheduler.wake()
+
+    # Notify of status change, after the keyframe
+    fanout.send_event(
+        channel_layer, game_group, game_id,
+        {
+            'type': 'game_status_changed',
+            'status': new_status
+        }
+    )
+
+
+# Owner inbox: events forwarded by relay consumers on other workers
+
+async def get_owner_inbox(channel_layer):
+    """
+    Returns this worker's inbox channel, starting its reader on first use.
+
+    With a distributed registry, the summary publisher is started too.
+    """
+    global _owner_inbox
+    if _owner_inbox is None:
+        _owner_inbox = await channel_layer.new_channel(prefix="pong.owner")
+        spawn_detached(_read_owner_inbox(channel_layer, _owner_inbox))
+        if game_registry.is_distributed:
+            spawn_detached(_publish_summaries())
+    return _owner_inbox
+
+
+async def _read_owner_inbox(channel_layer, inbox):
+    """Applies forwarded player and spectator events to the games owned by this worker"""
+    while True:
+        message = await channel_layer.receive(inbox)
+        try:
+            game_id = message['game_id']
+            player_num = message.get('player_num')
+
+            if message['type'] == 'game.player_message':
+                await handle_player_message(channel_layer, game_id, player_num, message['content'])
+
+            elif message['type'] == 'game.player_connected':
+                # The relay may beat the local player that claimed the game
+                if game_id not in game_logic.active_games:
+                    await initialize_game_state(game_id, message['game'])
+                    arm_inactivity_timeout(game_id)
+
+                reply_channel = message['reply_channel']
+
+                if not may_take_slot(game_id, player_num, message.get('resume_token')):
+                    await channel_layer.send(reply_channel, {'type': 'resume_refused'})
+                    continue
+
+                async def send_to_player(content):
+                    await channel_layer.send(reply_channel, content)
+
+                await handle_player_connected(channel_layer, game_id, player_num, send_to_player)
+
+            elif message['type'] == 'game.player_disconnected':
+                await handle_player_disconnected(channel_layer, game_id, player_num)
+
+            elif message['type'] == 'game.spectate':
+                # Spectators of another worker, served there by a relay feed
+                if game_id in game_logic.active_games:
+                    spectators.add_relay(game_id, message['channel'])
+                else:
+                    await channel_layer.send(message['channel'], {'type': 'spectator.close', 'code': 1000})
+
+            elif message['type'] == 'game.unspectate':
+                spectators.remove_relay(game_id, message['channel'])
+
+            elif message['type'] == 'game.spectate_keyframe':
+                spectators.request_keyframe(game_id)
+
+            elif message['type'] == 'game.debug_stats':
+                await channel_layer.send(message['reply_channel'], debug_stats(game_id))
+
+        except Exception as e:
+            print(f"Error handling forwarded game event: {str(e)}")
+            traceback.print_exc()
+
+
+def debug_stats(game_id):
+    """
+    Builds the reply to a player's debug_stats command.
+
+    Args:
+        game_id: The ID of a game owned by this worker
+
+    Returns:
+        debug_stats message with the loop metrics of the game and of this
+        worker, or enabled False when PONG_LOOP_METRICS is off
+    """
+    message = {'type': 'debug_stats', 'worker': WORKER_ID, 'enabled': loop_metrics is not None}
+    if loop_metrics is not None:
+        message.update(loop_metrics.game_report(game_id))
+    return message
+
+
+async def _publish_summaries():
+    """Periodically shares the summaries of the games owned by this worker"""
+    while True:
+        await asyncio.sleep(SUMMARY_PUBLISH_INTERVAL)
+        try:
+            summaries = [
+                summarize_game(game_state)
+                for game_state in list(game_logic.active_games.values())
+            ]
+            if summaries:
+                await sync_to_async(game_registry.publish)(summaries)
+        except Exception as e:
+            print(f"Error publishing game summaries: {str(e)}")
+            traceback.print_exc()
+
 
 class GameConsumer(AsyncJsonWebsocketConsumer):
     """
     WebSocket consumer for handling Pong game sessions.
     This consumer handles the communication aspects while delegating game logic
     to the game_logic module.
+
+    The consumer either runs on the worker that owns the game (the state is in
+    this process) or acts as a relay that forwards the player's messages to
+    the owner's inbox; see registry.py.
     """
     
     async def connect(self):
@@ -22,6 +706,16 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         
         # Get user from scope
         self.user_id = self.scope.get('user_id')
+
+        # Clients opt in to binary delta frames with ?format=binary
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.binary_frames = query.get('format', ['json'])[0] == 'binary'
+
+        # Presented when reconnecting to take a held slot back
+        self.resume_token = query.get('resume', [None])[0]
+
+        # Messages refused because the socket went over its budget
+        self.dropped_messages = 0
         
         if not self.user_id:
             await self.close(code=4001)
@@ -40,10 +734,28 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         else:
             await self.close(code=4003)
             return
+
+        # A draining worker only keeps serving the games it already runs
+        if drain.is_draining() and self.game_id not in game_logic.active_games:
+            await self.close(code=drain.DRAINING_CLOSE_CODE)
+            return
+
+        # Claim the game for this worker, or find the worker that runs it
+        inbox = await get_owner_inbox(self.channel_layer)
+        owner = await sync_to_async(game_registry.claim)(self.game_id, inbox)
+        self.is_owner = owner['worker'] == WORKER_ID
+        self.owner_inbox = owner['inbox']
         
         # Initialize game state if not exists
-        if self.game_id not in game_logic.active_games:
-            await self.initialize_game_state()
+        if self.is_owner and self.game_id not in game_logic.active_games:
+            await initialize_game_state(self.game_id, self.game)
+            # Ends the game if its players go away without a disconnect
+            arm_inactivity_timeout(self.game_id)
+
+        # A held slot only goes to the player's own reconnection
+        if self.is_owner and not may_take_slot(self.game_id, self.player_num, self.resume_token):
+            await self.close(code=RESUME_REFUSED_CLOSE_CODE)
+            return
         
         # Join game group
         await self.channel_layer.group_add(
@@ -54,101 +766,135 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         # Store connection time to handle waiting period
         self.connection_time = time.time()
         
-        # Mark player as connected
-        connection_info = game_logic.set_player_connection(self.game_id, self.player_num, True)
-        
         # Accept connection
         await self.accept()
-        
-        # Send initial state and connection confirmation
+
+        # Everything written to the socket from now on goes through its
+        # bounded outbox and writer task (fanout.py)
+        self.outbox = fanout.SocketOutbox(self, self.game_id, self.player_num, report_backlog=self.is_owner)
+
+        # Send connection confirmation
         await self.send_json({
             'type': 'connection_established',
             'player_number': self.player_num,
-            'game_id': self.game_id
-        })
-        state_to_send = game_logic.active_games[self.game_id]
-        await self.send_json({
-            'type': 'game_state',
-            'state': state_to_send
+            'game_id': self.game_id,
+            'resume_token': resume_token(self.game_id, self.player_num),
+            'reconnect_grace': RECONNECT_GRACE
         })
-        
-        # Notify other player about connection
-        await self.channel_layer.group_send(
-            self.game_group,
-            {
-                'type': 'player_status',
-                'player': self.player_num,
-                'connected': True
-            }
+
+        if not self.is_owner:
+            # The owner sends the initial keyframe back to this socket
+            await self.forward_to_owner({
+                'type': 'game.player_connected',
+                'game': self.game,
+                'reply_channel': self.channel_name,
+                'resume_token': self.resume_token
+            })
+            return
+
+        # Register the socket for the local frame fan-out
+        fanout.attach(self.game_id, self.player_num, self)
+
+        connection_info = await handle_player_connected(
+            self.channel_layer, self.game_id, self.player_num, self.send_json
         )
         
-        # If connection changed game status, notify both players
-        if connection_info and connection_info.get('status_changed', False):
-            await self.channel_layer.group_send(
-                self.game_group,
-                {
-                    'type': 'game_status_changed',
-                    'status': connection_info.get('new_status', 'waiting')
-                }
-            )
-        
-        # Check if both players are connected
-        if connection_info and connection_info.get('both_connected', False):
-            # Both players are connected, we can start the game
-            if (game_logic.active_games[self.game_id]['game_status'] == 'menu' and
-                not game_logic.active_games[self.game_id].get('loop_running', False)):
-                
-                game_logic.active_games[self.game_id]['loop_running'] = True
-                asyncio.create_task(self.game_loop())
-            
-            # Update game status in database
-            await self.update_game_status('in_progress')
-        else:
+        if not connection_info or not connection_info.get('both_connected', False):
+            if (connection_info and
+                    game_logic.active_games[self.game_id].player(3 - self.player_num).held):
+                # The opponent dropped out too, its reconnection deadline applies
+                return
             # Only one player is connected, start waiting for other player
-            # Create a task to wait for other player (60 seconds timeout)
-            self.wait_for_opponent_task = asyncio.create_task(self.wait_for_opponent(10))
+            await self.start_opponent_wait(OPPONENT_WAIT)
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        if hasattr(self, 'game_id') and self.game_id in game_logic.active_games:
-            # Mark player as disconnected
-            connection_info = game_logic.set_player_connection(self.game_id, self.player_num, False)
-            
-            # Force disconnect the other player too
-            await self.channel_layer.group_send(
-                self.game_group,
-                {
-                    'type': 'force_disconnect',
-                    'reason': f'Player {self.player_num} disconnected'
-                }
-            )
-            
-            # Set game as completed and save results immediately
-            if game_logic.active_games[self.game_id]['game_status'] != 'gameOver':
-                game_logic.active_games[self.game_id]['game_status'] = 'gameOver'
-                # Save the game results with the current state
-                await game_logic.save_game_results(self.game_id)
-                await game_logic.update_player_profiles(self.game_id)
-            
-            # Leave game group
-            await self.channel_layer.group_discard(
-                self.game_group,
-                self.channel_name
-            )
-            
-            # Clean up game state if both players are disconnected
-            if not connection_info['any_connected']:
-                if self.game_id in game_logic.active_games:
-                    del game_logic.active_games[self.game_id]
+        input_limiter.forget(self.channel_name)
+        self.cancel_opponent_wait()
+        if getattr(self, 'dropped_messages', 0):
+            print(f"Player {self.player_num} of game {self.game_id}: "
+                  f"{self.dropped_messages} messages dropped by the rate limit")
+        outbox = getattr(self, 'outbox', None)
+        if outbox is not None:
+            outbox.stop()
+            if outbox.dropped:
+                print(f"Player {self.player_num} of game {self.game_id}: "
+                      f"{outbox.dropped} of {outbox.sent + outbox.dropped} frames dropped by the send queue")
+
+        if not hasattr(self, 'is_owner'):
+            return
+
+        if self.is_owner:
+            fanout.detach(self.game_id, self.player_num, self)
+            await handle_player_disconnected(self.channel_layer, self.game_id, self.player_num)
+        else:
+            await self.forward_to_owner({'type': 'game.player_disconnected'})
+
+        # Leave game group
+        await self.channel_layer.group_discard(
+            self.game_group,
+            self.channel_name
+        )
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        """Queues a message that must be delivered, once the outbox exists"""
+        outbox = getattr(self, 'outbox', None)
+        if outbox is None:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        outbox.put_control(text_data if text_data is not None else bytes_data)
+        if close:
+            outbox.put_close(None if close is True else close)
+
+    async def send_json(self, content, close=False):
+        """Encodes a message and queues it like send()"""
+        await self.send(text_data=await self.encode_json(content), close=close)
+
+    async def close(self, code=None, reason=None):
+        """Closes the socket after what is queued, once the outbox exists"""
+        outbox = getattr(self, 'outbox', None)
+        if outbox is None or outbox.stopped:
+            await super().close(code=code, reason=reason)
+            return
+        outbox.put_close(code)
+
+    async def write_now(self, data):
+        """Writes to the socket directly, for the outbox writer"""
+        if isinstance(data, bytes):
+            await super().send(bytes_data=data)
+        else:
+            await super().send(text_data=data)
+
+    async def close_now(self, code):
+        """Closes the socket directly, for the outbox writer"""
+        await super().close(code=code)
+
+    async def queue_frame(self, event):
+        """Queues a state frame received from the group, merged first when the client lags"""
+        data = fanout.frame_payload(event, self.binary_frames)
+        outbox = getattr(self, 'outbox', None)
+        if outbox is None:
+            await self.write_now(data)
+        else:
+            outbox.put_frame(data, event)
+
+    async def forward_to_owner(self, message):
+        """Sends a player event to the inbox of the worker owning the game"""
+        message.update({'game_id': self.game_id, 'player_num': self.player_num})
+        await self.channel_layer.send(self.owner_inbox, message)
 
     async def force_disconnect(self, event):
         """Force client to disconnect"""
-        await self.update_game_status('cancelled')
+        # A game whose result was queued is written as completed by the writer
+        cancel = not event.get('result_saved', False)
+        if cancel:
+            await self.update_game_status('cancelled')
         await self.send_json({
             'type': 'force_disconnect',
             'reason': event.get('reason', 'Other player disconnected')
         })
-        await self.save_cancelled_game()
+        if cancel:
+            await self.save_cancelled_game()
         # Close the WebSocket connection
         await self.close(code=4000)
         
@@ -160,286 +906,110 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         if event.get('force_disconnect', False):
             await self.close(code=4002)  # Use a specific code for forced disconnection
             
-    async def wait_for_opponent(self, wait_seconds):
-        """Wait for the other player to connect before timing out"""
-        try:
-            # Wait a bit for opponent to join
-            for i in range(wait_seconds):
-                # Check every second if both players are connected
-                if game_logic.are_both_players_connected(self.game_id):
-                    
-                    # If game was waiting, update to menu or playing state
-                    if game_logic.active_games[self.game_id]['game_status'] == 'waiting':
-                        game_logic.active_games[self.game_id]['game_status'] = 'menu'
-                        
-                        # Notify players of status change
-                        await self.channel_layer.group_send(
-                            self.game_group,
-                            {
-                                'type': 'game_status_changed',
-                                'status': 'menu'
-                            }
-                        )
-                    
-                    # Start game loop if not already running
-                    if not game_logic.active_games[self.game_id].get('loop_running', False):
-                        game_logic.active_games[self.game_id]['loop_running'] = True
-                        asyncio.create_task(self.game_loop())
-                        
-                    # Update database status
-                    await self.update_game_status('in_progress')
-                    return
-                    
-                # Send periodic updates to keep the client informed
-                if i % 5 == 0:  # Send status update every 5 seconds
-                    await self.send_json({
-                        'type': 'waiting_for_opponent',
-                        'seconds_elapsed': i,
-                        'seconds_remaining': wait_seconds - i,
-                        'message': "Waiting for opponent to connect..."
-                    })
-                    
-                await asyncio.sleep(1)
-                
-            # If we got here, timeout occurred
-            await self.send_json({
-                'type': 'timeout',
-                'message': 'Opponent did not connect in time'
-            })
-            
-            # Update game status in database
-            await self.update_game_status('cancelled')
-            
-            # Force disconnect
-            await self.close(code=4000)
-            
-        except asyncio.CancelledError:
-            # Task was cancelled (probably because opponent connected)
-            pass
+    async def start_opponent_wait(self, wait_seconds):
+        """
+        Wait for the other player to connect before timing out.
+
+        Uses timers of the shared timer wheel (timers.py) instead of a task
+        polling every second: a status update every OPPONENT_WAIT_UPDATE
+        seconds and the timeout. They are cancelled when the opponent
+        connects (player_status) or this socket goes away.
+        """
+        await self.send_opponent_wait_update(0, wait_seconds)
+        self.opponent_wait_timers = [
+            game_timers.schedule(elapsed, self.send_opponent_wait_update, elapsed, wait_seconds)
+            for elapsed in range(OPPONENT_WAIT_UPDATE, wait_seconds, OPPONENT_WAIT_UPDATE)
+        ]
+        self.opponent_wait_timers.append(game_timers.schedule(wait_seconds, self.opponent_wait_timeout))
+
+    def cancel_opponent_wait(self):
+        """Stops waiting for the opponent"""
+        for timer in getattr(self, 'opponent_wait_timers', ()):
+            timer.cancel()
+        self.opponent_wait_timers = []
+
+    async def send_opponent_wait_update(self, seconds_elapsed, wait_seconds):
+        """Keep the client informed while it waits for its opponent"""
+        await self.send_json({
+            'type': 'waiting_for_opponent',
+            'seconds_elapsed': seconds_elapsed,
+            'seconds_remaining': wait_seconds - seconds_elapsed,
+            'message': "Waiting for opponent to connect..."
+        })
+
+    async def opponent_wait_timeout(self):
+        """The opponent didn't connect in time: cancel the game"""
+        self.opponent_wait_timers = []
+        if game_logic.are_both_players_connected(self.game_id):
+            return
+
+        await self.send_json({
+            'type': 'timeout',
+            'message': 'Opponent did not connect in time'
+        })
+
+        # Update game status in database
+        await self.update_game_status('cancelled')
+
+        # Force disconnect
+        await self.close(code=4000)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        """Decode binary client messages, JSON is handled by the base class"""
+        # Over budget: drop before spending any time decoding the message
+        if not input_limiter.is_allowed(self.channel_name):
+            self.dropped_messages += 1
+            return
+
+        if bytes_data is not None:
+            message = frames.unpack_client_message(bytes_data)
+            if message is not None:
+                await self.receive_json(message)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
 
     async def receive_json(self, content):
         """Handle messages from client"""
         try:
             message_type = content.get('type', '')
             
-            if message_type == 'paddle_move':
-                # Update paddle position
-                position = content.get('position', None)
-                if position is not None:
-                    game_logic.update_paddle_position(self.game_id, self.player_num, position)
-            
-            elif message_type == 'start_game':
-                # Start the game if it's currently in menu state
-                if self.game_id in game_logic.active_games:
-                    current_status = game_logic.active_games[self.game_id]['game_status']
-                    if current_status == 'menu':
-                        # Change status to playing
-                        new_status = game_logic.set_game_status(self.game_id, 'playing')
-                        # Notify all players about status change
-                        await self.channel_layer.group_send(
-                            self.game_group,
-                            {
-                                'type': 'game_status_changed',
-                                'status': new_status
-                            }
-                        )
-            
-            elif message_type == 'next_match':
-                # Start next match if current match is over
-                if self.game_id in game_logic.active_games:
-                    current_status = game_logic.active_games[self.game_id]['game_status']
-                    if current_status == 'matchOver':
-                        # Reset for new match
-                        game_logic.reset_for_new_match(self.game_id)
-                        
-                        # Notify players of game state
-                        await self.channel_layer.group_send(
-                            self.game_group,
-                            {
-                                'type': 'game_state',
-                                'state': game_logic.active_games[self.game_id]
-                            }
-                        )
-                        
-                        # Set status to playing
-                        new_status = game_logic.set_game_status(self.game_id, 'playing')
-                        
-                        # Notify of status change
-                        await self.channel_layer.group_send(
-                            self.game_group,
-                            {
-                                'type': 'game_status_changed',
-                                'status': new_status
-                            }
-                        )
-            elif message_type == 'ping':
-                await self.send_json({
-                    'type': 'pong'
-                })
-        
-        except Exception as e:
-            pass
-    
-    async def game_loop(self):
-        """Main game loop running on the server with optimized performance"""
-        try:
-            # Constants for frame rates and thresholds
-            PHYSICS_RATE = 240  # Hz
-            BROADCAST_RATE = 60  # Hz
-            MAX_FRAME_TIME = 0.25  # seconds
-            INACTIVE_TIMEOUT = 300  # seconds (5 minutes)
-            
-            # Calculate intervals once
-            physics_update_interval = 1 / PHYSICS_RATE
-            broadcast_interval = 1 / BROADCAST_RATE
-            
-            # Timing variables
-            last_state_broadcast_time = time.time()
-            physics_update_accumulator = 0
-            last_activity_time = time.time()
-            
-            while self.game_id in game_logic.active_games:
-                # Get current time for this frame
-                current_time = time.time()
-                frame_time = current_time - game_logic.active_games[self.game_id]['last_update_time']
-                game_logic.active_games[self.game_id]['last_update_time'] = current_time
-                
-                # Cap delta time to prevent spiral of death with big lag spikes
-                if frame_time > MAX_FRAME_TIME:
-                    frame_time = MAX_FRAME_TIME
-                
-                game_state = game_logic.active_games[self.game_id]
-                
-                # Check for inactivity timeout
-                if (current_time - last_activity_time > INACTIVE_TIMEOUT and 
-                    not game_logic.is_any_player_connected(self.game_id)):
-                    
-                    # Clean up the game
-                    await game_logic.save_game_results(self.game_id)
-                    await game_logic.update_player_profiles(self.game_id)
-                    del game_logic.active_games[self.game_id]
-                    break
-                
-                # Only update if game is in playing state
-                if game_state['game_status'] == 'playing':
-                    # Reset inactivity timer when game is active
-                    last_activity_time = current_time
-                    
-                    # Accumulate time for physics updates
-                    physics_update_accumulator += frame_time
-                    
-                    # Run multiple physics updates if needed to catch up
-                    score_happened = False
-                    collision_happened = False
-                    update_count = 0
-                    max_updates_per_frame = 5  # Limit updates to prevent CPU spikes
-                    
-                    while physics_update_accumulator >= physics_update_interval and update_count < max_updates_per_frame:
-                        # Update game physics with fixed timestep
-                        score_update = game_logic.update_game_physics(self.game_id, physics_update_interval)
-                        if score_update == 1:
-                            score_happened = True
-                        elif score_update == 2:
-                            collision_happened = True
-                        physics_update_accumulator -= physics_update_interval
-                        update_count += 1
-                    
-                    # If we couldn't process all accumulated time, discard the excess
-                    # to prevent spiraling when CPU can't keep up
-                    if update_count >= max_updates_per_frame and physics_update_accumulator > physics_update_interval:
-                        physics_update_accumulator = physics_update_interval
-                    
-                    # If a score happened, check if match ended
-                    if score_happened:
-                        match_ended = game_logic.check_match_end(self.game_id)
-                        
-                        # If match ended, notify players of new status immediately
-                        if match_ended:
-                            # Update activity time on match end
-                            last_activity_time = current_time
-                            
-                            await self.channel_layer.group_send(
-                                self.game_group,
-                                {
-                                    'type': 'game_status_changed',
-                                    'status': game_logic.active_games[self.game_id]['game_status'],
-                                    'winner': game_logic.active_games[self.game_id]['winner']
-                                })
-                            
-                            # Ensure we broadcast the final state
-                            await self.channel_layer.group_send(
-                                self.game_group,
-                                {
-                                    'type': 'game_state',
-                                    'state': game_logic.active_games[self.game_id]
-                                }
-                            )
-                            if game_logic.active_games[self.game_id]['game_status'] == 'gameOver':
-                                await game_logic.save_game_results(self.game_id)
-                                await game_logic.update_player_profiles(self.game_id)
-                                
-                                # Force both players to disconnect since game is over
-                                await self.channel_layer.group_send(
-                                    self.game_group,
-                                    {
-                                        'type': 'game_completed',
-                                        'winner': game_logic.active_games[self.game_id]['winner'],
-                                        'final_state': game_logic.active_games[self.game_id]
-                                    }
-                                )
-                    # Broadcast state at controlled intervals to avoid network congestion
-                    time_since_last_broadcast = current_time - last_state_broadcast_time
-                    if time_since_last_broadcast >= broadcast_interval:
-                        # Add prediction data for smooth client-side interpolation
-                        game_state = game_logic.active_games[self.game_id].copy()
-                        game_state['broadcast_time'] = current_time
-                        game_state['physics_interval'] = physics_update_interval
-                        
-                        await self.channel_layer.group_send(
-                            self.game_group,
-                            {
-                                'type': 'game_state',
-                                'state': game_state
-                            }
-                        )
-                        last_state_broadcast_time = current_time
-                
-                # Sleep adaptively to maintain target frame rate
-                target_frame_time = min(physics_update_interval, broadcast_interval) / 2
-                elapsed = time.time() - current_time
-                sleep_time = max(0, target_frame_time - elapsed)
-                
-                # Only sleep if we have meaningful time to wait
-                if sleep_time > 0.001:
-                    await asyncio.sleep(sleep_time)
+            if message_type == 'ping':
+                # Echo the client's timestamp so it can measure the round trip
+                response = {'type': 'pong'}
+                if 't' in content:
+                    response['t'] = content['t']
+                await self.send_json(response)
+                if content.get('rtt') is None:
+                    return
+                # The previous measurement goes to the game owner
+                content = {'type': 'client_stats', 'rtt': content['rtt']}
+
+            if message_type == 'debug_stats':
+                # Loop metrics of the worker running the game
+                if self.is_owner:
+                    await self.send_json(debug_stats(self.game_id))
                 else:
-                    # Yield control briefly if we're CPU-bound
-                    await asyncio.sleep(0)
-                
-                # Check if game status changed while we were processing
-                if self.game_id in game_logic.active_games:
-                    new_state = game_logic.active_games[self.game_id]
-                    
-                    # Update activity timestamp for non-playing states
-                    if new_state['game_status'] != 'playing':
-                        # If game was just paused or a match ended, update the activity time
-                        # so we don't time out immediately
-                        last_activity_time = current_time
+                    await self.forward_to_owner({'type': 'game.debug_stats', 'reply_channel': self.channel_name})
+                return
+
+            if self.is_owner:
+                await handle_player_message(self.channel_layer, self.game_id, self.player_num, content)
+            else:
+                await self.forward_to_owner({'type': 'game.player_message', 'content': content})
         
-        except asyncio.CancelledError:
-            raise
         except Exception as e:
-            pass
-        finally:
-            # Mark loop as not running
-            if self.game_id in game_logic.active_games:
-                game_logic.active_games[self.game_id]['loop_running'] = False
+            print(f"Error handling message from player {self.player_num} of game {self.game_id}: {str(e)}")
+            traceback.print_exc()
     
     # Message handlers
     
     async def game_state(self, event):
-        """Send game state to client"""
-        await self.send_json(event)
+        """Send game state keyframe to client"""
+        await self.queue_frame(event)
+
+    async def game_delta(self, event):
+        """Send game state delta to client, packed or as JSON"""
+        await self.queue_frame(event)
     
     async def paddle_position(self, event):
         """Send paddle position update"""
@@ -453,8 +1023,27 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         """Send player connection status"""
         await self.send_json(event)
         if event.get('player') != self.player_num and event.get('connected', False):
-            if hasattr(self, 'wait_for_opponent_task') and not self.wait_for_opponent_task.done():
-                self.wait_for_opponent_task.cancel()
+            self.cancel_opponent_wait()
+
+    async def debug_stats(self, event):
+        """Send the loop metrics relayed by the owner of the game"""
+        await self.send_json(event)
+
+    async def resume_refused(self, event):
+        """The owner refused this socket the held slot (relayed connections)"""
+        await self.send_json({
+            'type': 'resume_refused',
+            'message': 'Invalid resume token'
+        })
+        await self.close(code=RESUME_REFUSED_CLOSE_CODE)
+
+    async def server_draining(self, event):
+        """This worker hands the game off, the client reconnects to resume it"""
+        await self.send_json({
+            'type': 'server_draining',
+            'resume': event.get('resume', False)
+        })
+        await self.close(code=drain.DRAINING_CLOSE_CODE)
 
     async def game_completed(self, event):
         """Handle game completion and prepare for socket closure"""
@@ -463,10 +1052,24 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             'winner': event['winner'],
             'final_state': event['final_state']
         })
-        await asyncio.sleep(2)
+        await asyncio.sleep(GAME_COMPLETED_CLOSE_DELAY)
         # Close the connection
         await self.close(code=1000)  # Normal closure
 
+    def queue_event(self, event, text):
+        """
+        Queues a game event from the local fast path (fanout.send_event),
+        behind the frames already queued, like its handler would send it.
+
+        Args:
+            event: The event message
+            text: The event serialized as JSON
+        """
+        self.outbox.put_control(text)
+        if event['type'] == 'game_completed':
+            # Closed once the players had time to see the result, as in game_completed
+            asyncio.get_running_loop().call_later(GAME_COMPLETED_CLOSE_DELAY, self.outbox.put_close, 1000)
+
         
     @database_sync_to_async
     def get_game(self, game_id):
@@ -484,17 +1087,6 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             return None
     
     @database_sync_to_async
-    def initialize_game_state(self):
-        """Create initial game state in memory"""
-        if self.game_id in game_logic.active_games:
-            return
-        
-        # Get game from database and create state
-        game_logic.active_games[self.game_id] = game_logic.create_game_state(
-            self.game_id, 
-            self.game
-        )
-    @database_sync_to_async
     def save_cancelled_game(self):
         """Save game as cancelled in the database"""
         try:
@@ -506,22 +1098,131 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         except Game.DoesNotExist:
             return False
 
-    @database_sync_to_async
-    def update_game_status(self, status):
+    async def update_game_status(self, status):
         """Update the game status in the database"""
+        return await update_database_status(self.game_id, status)
+
+
+class SpectatorConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket consumer of a game's spectators, see spectators.py.
+
+    Any authenticated user may watch a running game. The socket only
+    receives: frames are written by a Viewer task from the game's shared
+    SpectatorFeed, on this worker or relayed from the worker owning the game.
+    """
+
+    async def connect(self):
+        """Attach the socket to the spectator feed of the game"""
+        self.game_id = self.scope['url_route']['kwargs']['game_id']
+        self.user_id = self.scope.get('user_id')
+        self.viewer = None
+        self.writer = None
+
+        # Same frame formats as the players' sockets
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.binary_frames = query.get('format', ['json'])[0] == 'binary'
+
+        if not self.user_id:
+            await self.close(code=4001)
+            return
+
+        # A draining worker only keeps serving the games it already runs
+        if drain.is_draining() and self.game_id not in game_logic.active_games:
+            await self.close(code=drain.DRAINING_CLOSE_CODE)
+            return
+
+        # Only running games can be watched
+        owner = await sync_to_async(game_registry.owner)(self.game_id)
+        local = owner is not None and owner['worker'] == WORKER_ID
+        if owner is None or (local and self.game_id not in game_logic.active_games):
+            await self.close(code=4004)
+            return
+        self.owner_inbox = owner['inbox']
+
+        feed = await spectators.join(self.channel_layer, self.game_id, self.owner_inbox, local)
+        if feed is None:
+            await self.close(code=spectators.TOO_MANY_SPECTATORS_CLOSE_CODE)
+            return
+
+        await self.accept()
+        self.viewer = spectators.Viewer(feed, self)
+        feed.viewers.add(self.viewer)
+
+        await self.send_json({
+            'type': 'connection_established',
+            'spectator': True,
+            'game_id': self.game_id,
+            'spectators': len(feed.viewers)
+        })
+        self.writer = asyncio.create_task(self.write_frames())
+
+    async def write_frames(self):
+        """Sends the feed's frames until the feed closes, then closes the socket"""
+        feed = self.viewer.feed
+
+        async def request_keyframe():
+            await spectators.want_keyframe(self.channel_layer, feed, self.owner_inbox)
+
         try:
-            game = Game.objects.get(id=self.game_id)
-            game.status = status
+            code = await self.viewer.run(request_keyframe)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending spectator frames of game {self.game_id}: {str(e)}")
+            traceback.print_exc()
+            code = 1011
+        await self.close(code=code)
+
+    async def disconnect(self, close_code):
+        """Detach the socket from the feed"""
+        if self.writer is not None:
+            self.writer.cancel()
+        if self.viewer is not None:
+            await spectators.leave(self.channel_layer, self.viewer.feed, self.viewer, self.owner_inbox)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        """Spectators have nothing to say to the game, their messages are ignored"""
+
+
+@database_sync_to_async
+def initialize_game_state(game_id, game_data):
+    """Create initial game state in memory"""
+    if game_id in game_logic.active_games:
+        return
+
+    # Create the state from the game's database row
+    game_state = game_logic.create_game_state(game_id, game_data)
+    game_logic.enable_lag_compensation(game_state, game_scheduler.lag_ticks)
+
+    # After a restart, pick the game up where its last checkpoint left it
+    resumed = checkpoint_writer is not None and checkpoint_writer.resume_game(game_state, game_data)
+
+    game_logic.active_games[game_id] = game_state
+    if not resumed:
+        # A resumed game can't be re-simulated from its first tick, it isn't logged
+        replay.start_input_log(
+            game_state, game_scheduler.tick_rate, game_scheduler.swept_collisions,
+            game_scheduler.analytic_physics
+        )
+
+
+@database_sync_to_async
+def update_database_status(game_id, status):
+    """Update the game status in the database"""
+    try:
+        game = Game.objects.get(id=game_id)
+        game.status = status
+        
+        # If game is starting, set started_at timestamp
+        if status == 'in_progress' and not game.started_at:
+            game.started_at = timezone.now()
             
-            # If game is starting, set started_at timestamp
-            if status == 'in_progress' and not game.started_at:
-                game.started_at = timezone.now()
-                
-            # If game is completing or cancelling, set completed_at timestamp
-            if status in ['completed', 'cancelled'] and not game.completed_at:
-                game.completed_at = timezone.now()
-                
-            game.save()
-            return True
-        except Game.DoesNotExist:
-            return False
\ No newline at end of file
+        # If game is completing or cancelling, set completed_at timestamp
+        if status in ['completed', 'cancelled'] and not game.completed_at:
+            game.completed_at = timezone.now()
+            
+        game.save()
+        return True
+    except Game.DoesNotExist:
+        return False
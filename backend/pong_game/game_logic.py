@@ -1,9 +1,10 @@
+import collections
 import time
 import random
 import math
-from django.utils import timezone
-from .models import Game, Match, PlayerProfile, StatusChoices
-from channels.db import database_sync_to_async
+from .models import StatusChoices
+from . import persistence
+from .game_state import GameState, Ball, Paddle, Player, MatchLedger
 
 # Game constants
 POINTS_TO_WIN_MATCH = 5
@@ -33,7 +34,7 @@ def create_game_state(game_id, game_data):
         game_data: Game information from database (theme, difficulty, players)
     
     Returns:
-        The newly created game state dictionary
+        The newly created GameState
     """
     settings = DIFFICULTY_SETTINGS[game_data['difficulty']]
     
@@ -47,56 +48,42 @@ def create_game_state(game_id, game_data):
         player1_username = User.objects.get(id=game_data['player1_id']).username
         player2_username = User.objects.get(id=game_data['player2_id']).username
     
-    return {
-        'game_id': game_id,
-        'ball': {
-            'x': BASE_WIDTH / 2,
-            'y': BASE_HEIGHT / 2,
-            'dx': settings['ball_speed'],
-            'dy': settings['ball_speed'] * BASE_HEIGHT / BASE_WIDTH,
-            'speed': settings['ball_speed'],
-            'radius': BALL_RADIUS
-        },
-        'left_paddle': {
-            'x': 20,
-            'y': BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2,
-            'width': PADDLE_WIDTH,
-            'height': PADDLE_HEIGHT,
-            'speed': 8,
-            'score': 0
-        },
-        'right_paddle': {
-            'x': BASE_WIDTH - 20 - PADDLE_WIDTH,
-            'y': BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2,
-            'width': PADDLE_WIDTH,
-            'height': PADDLE_HEIGHT,
-            'speed': 8,
-            'score': 0
-        },
-        'match_wins': {
-            'player1': 0,
-            'player2': 0
+    # Every game gets a seed so it can be replayed from its input log
+    seed = game_data.get('seed')
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    
+    return GameState(
+        game_id=game_id,
+        ball=Ball(
+            x=BASE_WIDTH / 2,
+            y=BASE_HEIGHT / 2,
+            dx=settings['ball_speed'],
+            dy=settings['ball_speed'] * BASE_HEIGHT / BASE_WIDTH,
+            speed=settings['ball_speed'],
+            radius=BALL_RADIUS
+        ),
+        left_paddle=Paddle(
+            x=20,
+            y=BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2,
+            width=PADDLE_WIDTH,
+            height=PADDLE_HEIGHT
+        ),
+        right_paddle=Paddle(
+            x=BASE_WIDTH - 20 - PADDLE_WIDTH,
+            y=BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2,
+            width=PADDLE_WIDTH,
+            height=PADDLE_HEIGHT
+        ),
+        players={
+            'player1': Player(game_data['player1_id'], player1_username),
+            'player2': Player(game_data['player2_id'], player2_username)
         },
-        'current_match': 1,
-        'game_status': 'waiting',
-        'winner': None,
-        'players': {
-            'player1': {
-                'id': game_data['player1_id'],
-                'username': player1_username,
-                'connected': False
-            },
-            'player2': {
-                'id': game_data['player2_id'],
-                'username': player2_username,
-                'connected': False
-            }
-        },
-        'difficulty': game_data['difficulty'],
-        'settings': settings,
-        'last_update_time': time.time(),
-        'loop_running': False
-    }
+        difficulty=game_data['difficulty'],
+        settings=settings,
+        last_update_time=time.time(),
+        seed=seed
+    )
 
 def update_paddle_position(game_id, player_num, position):
     """
@@ -117,12 +104,77 @@ def update_paddle_position(game_id, player_num, position):
         position = BASE_HEIGHT - PADDLE_HEIGHT
     
     # Update the appropriate paddle
-    paddle_key = 'left_paddle' if player_num == 1 else 'right_paddle'
-    active_games[game_id][paddle_key]['y'] = position
+    remember_paddle(active_games[game_id], player_num)
+    active_games[game_id].paddle(player_num).y = position
+    # Analytic physics: the ball's next event depends on the paddles
+    active_games[game_id].trajectory = None
     # print(f"Updating paddle position: game_id={game_id}, player_num={player_num}, position={position}, type={type(position)}")
     
     return True
 
+def enable_lag_compensation(game_state, ticks):
+    """
+    Turns lag compensation of paddle hit tests on or off for a game.
+
+    A player sees the ball late by about half their round trip and moves
+    their paddle to where they saw it. With compensation on, a paddle hit
+    test passes if the ball touches the paddle at any position it had during
+    the last `ticks` physics ticks, instead of only its current position.
+    The window is fixed per game (and recorded in the input log) so replays
+    stay exact.
+
+    Args:
+        game_state: The GameState
+        ticks: Compensation window in physics ticks, 0 to turn it off
+    """
+    game_state.lag_ticks = ticks
+    # A paddle moves at most once per tick (inputs are coalesced per tick),
+    # so the window holds at most ticks + 1 positions
+    game_state.paddle_history = {
+        1: collections.deque(maxlen=ticks + 1),
+        2: collections.deque(maxlen=ticks + 1)
+    } if ticks > 0 else None
+
+def remember_paddle(game_state, player_num):
+    """
+    Keeps a paddle's position before it moves, for lag compensation.
+
+    Args:
+        game_state: The GameState
+        player_num: Which player (1 or 2)
+    """
+    history = game_state.paddle_history
+    if history is None:
+        return
+    # The deque drops the oldest position once the window is full; positions
+    # older than the window are skipped by compensated_paddle_y
+    history[player_num].append((game_state.tick, game_state.paddle(player_num).y))
+
+def compensated_paddle_y(game_state, player_num, ball_y):
+    """
+    Position of a paddle to run the hit test against with lag compensation.
+
+    Args:
+        game_state: The GameState
+        player_num: Which player (1 or 2)
+        ball_y: Y of the ball's center
+
+    Returns:
+        The paddle's current Y or, if closer to the ball, a Y it had within
+        the compensation window
+    """
+    paddle = game_state.paddle(player_num)
+    best = paddle.y
+    entries = game_state.paddle_history[player_num]
+    if entries:
+        target = ball_y - paddle.height / 2
+        best_distance = abs(best - target)
+        oldest = game_state.tick - game_state.lag_ticks
+        for tick, y in entries:
+            if tick >= oldest and abs(y - target) < best_distance:
+                best, best_distance = y, abs(y - target)
+    return best
+
 def update_game_physics(game_id, delta_time):
     """
     Updates the game physics based on elapsed time.
@@ -138,123 +190,132 @@ def update_game_physics(game_id, delta_time):
         return False
     
     game_state = active_games[game_id]
-    ball = game_state['ball']
-    left_paddle = game_state['left_paddle']
-    right_paddle = game_state['right_paddle']
-    settings = game_state['settings']
+    ball = game_state.ball
+    left_paddle = game_state.left_paddle
+    right_paddle = game_state.right_paddle
+    settings = game_state.settings
     
     # We now use fixed timestep, no need to adjust for frame rate
     # as delta_time is already our fixed physics interval
     
     # Store previous positions for client-side interpolation
-    ball['prev_x'] = ball['x']
-    ball['prev_y'] = ball['y']
+    ball.prev_x = ball.x
+    ball.prev_y = ball.y
     
     # Move the ball
-    ball['x'] += ball['dx'] * delta_time * 60  # Scale by 60 to maintain similar speed
-    ball['y'] += ball['dy'] * delta_time * 60
+    ball.x += ball.dx * delta_time * 60  # Scale by 60 to maintain similar speed
+    ball.y += ball.dy * delta_time * 60
     collision_happened = False
     # Handle wall collisions
-    if ball['y'] + ball['radius'] >= BASE_HEIGHT:
-        if ball['dy'] > 0:
-            ball['dy'] = -ball['dy']
+    if ball.y + ball.radius >= BASE_HEIGHT:
+        if ball.dy > 0:
+            ball.dy = -ball.dy
             # Add slight randomness to prevent looping patterns
-            ball['dy'] += (random.random() - 0.5) * 0.1
+            ball.dy += (game_state.rng.random() - 0.5) * 0.1
         collision_happened = True
         
     
-    if ball['y'] - ball['radius'] <= 0:
-        if ball['dy'] < 0:
-            ball['dy'] = -ball['dy']
+    if ball.y - ball.radius <= 0:
+        if ball.dy < 0:
+            ball.dy = -ball.dy
             # Add slight randomness to prevent looping patterns
-            ball['dy'] += (random.random() - 0.5) * 0.1
+            ball.dy += (game_state.rng.random() - 0.5) * 0.1
         collision_happened = True
         
     
     # Cache calculations for paddle collisions to avoid repeated computation
-    ball_left_edge = ball['x'] - ball['radius']
-    ball_right_edge = ball['x'] + ball['radius']
-    ball_top_edge = ball['y'] - ball['radius']
-    ball_bottom_edge = ball['y'] + ball['radius']
-    
-    left_paddle_right = left_paddle['x'] + left_paddle['width']
-    left_paddle_top = left_paddle['y']
-    left_paddle_bottom = left_paddle['y'] + left_paddle['height']
+    ball_left_edge = ball.x - ball.radius
+    ball_right_edge = ball.x + ball.radius
+    ball_top_edge = ball.y - ball.radius
+    ball_bottom_edge = ball.y + ball.radius
+    
+    left_paddle_y = left_paddle.y
+    right_paddle_y = right_paddle.y
+    if game_state.paddle_history is not None:
+        # Lag compensation: test against where the players saw their paddles
+        left_paddle_y = compensated_paddle_y(game_state, 1, ball.y)
+        right_paddle_y = compensated_paddle_y(game_state, 2, ball.y)
+
+    left_paddle_right = left_paddle.x + left_paddle.width
+    left_paddle_top = left_paddle_y
+    left_paddle_bottom = left_paddle_y + left_paddle.height
     
-    right_paddle_left = right_paddle['x']
-    right_paddle_top = right_paddle['y']
-    right_paddle_bottom = right_paddle['y'] + right_paddle['height']
+    right_paddle_left = right_paddle.x
+    right_paddle_top = right_paddle_y
+    right_paddle_bottom = right_paddle_y + right_paddle.height
     
     # Left paddle collision
     if (ball_left_edge <= left_paddle_right and
-        ball_left_edge > left_paddle['x'] and
+        ball_left_edge > left_paddle.x and
         ball_top_edge <= left_paddle_bottom and
         ball_bottom_edge >= left_paddle_top and
-        ball['dx'] < 0):
+        ball.dx < 0):
         
         # Reverse X direction
-        ball['dx'] = -ball['dx']
+        ball.dx = -ball.dx
         
         # Adjust angle based on hit position
-        hit_position = (ball['y'] - (left_paddle_top + left_paddle['height'] / 2)) / (left_paddle['height'] / 2)
+        hit_position = (ball.y - (left_paddle_top + left_paddle.height / 2)) / (left_paddle.height / 2)
         
         # Limit the angle to avoid extreme angles
         hit_position = max(min(hit_position, 0.8), -0.8)
         
-        ball['dy'] = hit_position * ball['speed']
+        ball.dy = hit_position * ball.speed
         
         # Increase speed slightly
-        ball['speed'] = min(
+        ball.speed = min(
             settings['max_ball_speed'],
-            ball['speed'] * (1 + settings['increment_multiplier'])
+            ball.speed * (1 + settings['increment_multiplier'])
         )
-        ball['dx'] = ball['speed'] if ball['dx'] > 0 else -ball['speed']
+        ball.dx = ball.speed if ball.dx > 0 else -ball.speed
         
         # Add a subtle random factor to avoid predictable patterns
-        ball['dy'] += (random.random() - 0.5) * 0.2
+        ball.dy += (game_state.rng.random() - 0.5) * 0.2
+        game_state.paddle_hits += 1
         collision_happened = True
     # Right paddle collision
     if (ball_right_edge >= right_paddle_left and
-        ball_right_edge < right_paddle_left + right_paddle['width'] and
+        ball_right_edge < right_paddle_left + right_paddle.width and
         ball_top_edge <= right_paddle_bottom and
         ball_bottom_edge >= right_paddle_top and
-        ball['dx'] > 0):
+        ball.dx > 0):
         
         # Reverse X direction
-        ball['dx'] = -ball['dx']
+        ball.dx = -ball.dx
         
         # Adjust angle based on hit position
-        hit_position = (ball['y'] - (right_paddle_top + right_paddle['height'] / 2)) / (right_paddle['height'] / 2)
+        hit_position = (ball.y - (right_paddle_top + right_paddle.height / 2)) / (right_paddle.height / 2)
         
         # Limit the angle to avoid extreme angles
         hit_position = max(min(hit_position, 0.8), -0.8)
         
-        ball['dy'] = hit_position * ball['speed']
+        ball.dy = hit_position * ball.speed
         
         # Increase speed slightly
-        ball['speed'] = min(
+        ball.speed = min(
             settings['max_ball_speed'],
-            ball['speed'] * (1 + settings['increment_multiplier'])
+            ball.speed * (1 + settings['increment_multiplier'])
         )
-        ball['dx'] = ball['speed'] if ball['dx'] > 0 else -ball['speed']
+        ball.dx = ball.speed if ball.dx > 0 else -ball.speed
         
         # Add a subtle random factor to avoid predictable patterns
-        ball['dy'] += (random.random() - 0.5) * 0.2
+        ball.dy += (game_state.rng.random() - 0.5) * 0.2
+        game_state.paddle_hits += 1
         collision_happened = False
     
     # Check for scoring
     score_happened = False
     
     # Scoring logic
-    if ball['x'] + ball['radius'] < 0:
+    if ball.x + ball.radius < 0:
         # Right player scores
-        right_paddle['score'] += 1
+        right_paddle.score += 1
         reset_ball(game_id, 1)
         score_happened = True
     
-    elif ball['x'] - ball['radius'] > BASE_WIDTH:
+    elif ball.x - ball.radius > BASE_WIDTH:
         # Left player scores
-        left_paddle['score'] += 1
+        left_paddle.score += 1
         reset_ball(game_id, -1)
         score_happened = True
     
@@ -264,6 +325,347 @@ def update_game_physics(game_id, delta_time):
         return 1
         
     return 2 if collision_happened else 0
+# Swept collisions: maximum number of bounces resolved within one step
+MAX_SWEEP_EVENTS = 4
+
+def _paddle_hit_first(t, t_hit, event):
+    """
+    Checks whether a paddle impact is the earliest event of a sweep.
+
+    An impact at the same time as an event found before it (a wall) doesn't
+    replace it, one landing exactly at the end of the sweep still counts.
+
+    Args:
+        t: Time of the paddle impact (from _sweep_paddle), or None
+        t_hit: Time of the earliest event so far (or the end of the sweep)
+        event: That event, None if there is none yet
+
+    Returns:
+        True if the paddle impact replaces the earliest event
+    """
+    return t is not None and (t < t_hit or (t == t_hit and event is None))
+
+def _sweep_paddle(x, y, vx, vy, radius, face_x, back_x, top, bottom, max_t):
+    """
+    Time of impact of a moving ball with the front face of a paddle.
+
+    Coordinates are mirrored for the right paddle so the ball always
+    approaches the face from larger x with vx < 0. The paddle is the
+    rectangle [back_x, face_x] x [top, bottom]; the ball hits its face or
+    one of the two front corners.
+
+    Args:
+        x, y: Ball center at the start of the sweep
+        vx, vy: Ball displacement per step
+        radius: Ball radius
+        face_x, back_x: X of the paddle's front and back faces
+        top, bottom: Y range of the paddle
+        max_t: Largest step fraction to consider
+
+    Returns:
+        Fraction of the step at which the ball touches the paddle, or None
+    """
+    # Already overlapping (the paddle moved onto the ball): bounce right away,
+    # like the discrete test does
+    if (back_x < x - radius <= face_x and
+            y + radius >= top and y - radius <= bottom):
+        return 0.0
+
+    if x - radius < face_x:
+        # Behind the face, the ball can't be hit from the front anymore
+        return None
+
+    # Front face
+    t = (face_x + radius - x) / vx
+    if t > max_t:
+        return None
+    hit_y = y + vy * t
+    if top <= hit_y <= bottom:
+        return t
+
+    # Front corners, as circles of the ball's radius around each corner
+    best = None
+    a = vx * vx + vy * vy
+    for corner_y in (top, bottom):
+        dx = x - face_x
+        dy = y - corner_y
+        b = 2 * (dx * vx + dy * vy)
+        c = dx * dx + dy * dy - radius * radius
+        discriminant = b * b - 4 * a * c
+        if b >= 0 or discriminant < 0:
+            continue
+        t = (-b - math.sqrt(discriminant)) / (2 * a)
+        if 0 <= t <= max_t and (best is None or t < best):
+            best = t
+    return best
+
+def _bounce_off_paddle(game_state, paddle, direction, paddle_y=None):
+    """
+    Sends the ball back from a paddle, same response as the discrete step.
+
+    Args:
+        game_state: The GameState
+        paddle: The Paddle that was hit
+        direction: New horizontal direction (1 right, -1 left)
+        paddle_y: Paddle Y the hit was tested against, defaults to paddle.y
+    """
+    ball = game_state.ball
+    settings = game_state.settings
+    if paddle_y is None:
+        paddle_y = paddle.y
+
+    # Adjust angle based on hit position
+    hit_position = (ball.y - (paddle_y + paddle.height / 2)) / (paddle.height / 2)
+
+    # Limit the angle to avoid extreme angles
+    hit_position = max(min(hit_position, 0.8), -0.8)
+
+    ball.dy = hit_position * ball.speed
+
+    # Increase speed slightly
+    ball.speed = min(
+        settings['max_ball_speed'],
+        ball.speed * (1 + settings['increment_multiplier'])
+    )
+    ball.dx = direction * ball.speed
+
+    # Add a subtle random factor to avoid predictable patterns
+    ball.dy += (game_state.rng.random() - 0.5) * 0.2
+    game_state.paddle_hits += 1
+
+def update_game_physics_swept(game_id, delta_time):
+    """
+    Updates the game physics with swept (continuous) collision detection.
+
+    Instead of moving the ball and testing for overlaps, the exact time of
+    impact with the walls and the paddles' front faces/corners is computed
+    within the step, the bounce is applied there and the ball travels the
+    rest of the step with its new velocity. The ball can't tunnel through a
+    paddle whatever the step length, so the physics rate can be lowered to
+    60-120 Hz (PONG_SWEPT_COLLISIONS with PONG_PHYSICS_RATE).
+
+    Args:
+        game_id: The ID of the game
+        delta_time: Fixed physics interval in seconds
+
+    Returns:
+        1 if a score happened, 2 on a collision, 0 otherwise
+    """
+    if game_id not in active_games:
+        return False
+
+    game_state = active_games[game_id]
+    ball = game_state.ball
+    left_paddle = game_state.left_paddle
+    right_paddle = game_state.right_paddle
+    radius = ball.radius
+
+    # Store previous positions for client-side interpolation
+    ball.prev_x = ball.x
+    ball.prev_y = ball.y
+
+    scale = delta_time * 60  # Same speed units as the discrete step
+    remaining = 1.0
+    collision_happened = False
+    lag_compensation = game_state.paddle_history is not None
+
+    for _ in range(MAX_SWEEP_EVENTS):
+        vx = ball.dx * scale
+        vy = ball.dy * scale
+        t_hit = remaining
+        event = None
+
+        # Walls
+        if vy > 0:
+            t = max(0.0, (BASE_HEIGHT - radius - ball.y) / vy)
+            if t <= t_hit:
+                t_hit, event = t, 'wall'
+        elif vy < 0:
+            t = max(0.0, (radius - ball.y) / vy)
+            if t <= t_hit:
+                t_hit, event = t, 'wall'
+
+        # Paddles (the right one is mirrored onto the left one's geometry)
+        if vx < 0:
+            paddle_y = left_paddle.y
+            if lag_compensation:
+                # Test against where the player saw their paddle
+                paddle_y = compensated_paddle_y(game_state, 1, ball.y)
+            t = _sweep_paddle(
+                ball.x, ball.y, vx, vy, radius,
+                left_paddle.x + left_paddle.width, left_paddle.x,
+                paddle_y, paddle_y + left_paddle.height, t_hit
+            )
+            if _paddle_hit_first(t, t_hit, event):
+                t_hit, event = t, 'left'
+        elif vx > 0:
+            paddle_y = right_paddle.y
+            if lag_compensation:
+                paddle_y = compensated_paddle_y(game_state, 2, ball.y)
+            t = _sweep_paddle(
+                -ball.x, ball.y, -vx, vy, radius,
+                -right_paddle.x, -(right_paddle.x + right_paddle.width),
+                paddle_y, paddle_y + right_paddle.height, t_hit
+            )
+            if _paddle_hit_first(t, t_hit, event):
+                t_hit, event = t, 'right'
+
+        # Travel to the impact (or the end of the step)
+        ball.x += vx * t_hit
+        ball.y += vy * t_hit
+        remaining -= t_hit
+
+        if event is None:
+            break
+        collision_happened = True
+
+        if event == 'wall':
+            ball.dy = -ball.dy
+            # Add slight randomness to prevent looping patterns
+            ball.dy += (game_state.rng.random() - 0.5) * 0.1
+        elif event == 'left':
+            _bounce_off_paddle(game_state, left_paddle, 1, paddle_y)
+        else:
+            _bounce_off_paddle(game_state, right_paddle, -1, paddle_y)
+
+    # Scoring logic
+    if ball.x + ball.radius < 0:
+        # Right player scores
+        right_paddle.score += 1
+        reset_ball(game_id, 1)
+        return 1
+
+    if ball.x - ball.radius > BASE_WIDTH:
+        # Left player scores
+        left_paddle.score += 1
+        reset_ball(game_id, -1)
+        return 1
+
+    return 2 if collision_happened else 0
+
+def advance_ball_analytic(game_id, target_tick, tick_rate):
+    """
+    Event-driven physics: moves the ball to a tick in closed form.
+
+    Between two events the ball moves in a straight line, so instead of
+    stepping every tick the time of the next wall bounce, paddle hit or
+    score is computed directly (same rules as update_game_physics_swept)
+    and the ball jumps from event to event. The path only changes at
+    events, on paddle moves and on ball resets (which clear
+    GameState.trajectory), so advancing to a tick gives the same result
+    whether it's done in one call or in many, and the ball position at any
+    tick is sampled from the current straight path.
+
+    Args:
+        game_id: The ID of the game
+        target_tick: Tick to advance to (GameState.tick afterwards)
+        tick_rate: Physics rate in Hz, the unit of the ticks
+
+    Returns:
+        1 if a score happened, 2 on a collision, 0 otherwise
+    """
+    game_state = active_games.get(game_id)
+    if game_state is None:
+        return 0
+
+    ball = game_state.ball
+    left_paddle = game_state.left_paddle
+    right_paddle = game_state.right_paddle
+    radius = ball.radius
+    per_tick = 60 / tick_rate  # Same speed units as the stepped physics
+
+    if game_state.trajectory is None:
+        base_tick, x, y = game_state.tick, ball.x, ball.y
+    else:
+        base_tick, x, y = game_state.trajectory
+
+    result = 0
+    while True:
+        vx = ball.dx * per_tick
+        vy = ball.dy * per_tick
+        t_hit = target_tick - base_tick
+        event = None
+
+        # Walls
+        if vy > 0:
+            t = max(0.0, (BASE_HEIGHT - radius - y) / vy)
+            if t <= t_hit:
+                t_hit, event = t, 'wall'
+        elif vy < 0:
+            t = max(0.0, (radius - y) / vy)
+            if t <= t_hit:
+                t_hit, event = t, 'wall'
+
+        # Paddles, then the ball leaving the field behind them
+        if vx < 0:
+            t = _sweep_paddle(
+                x, y, vx, vy, radius,
+                left_paddle.x + left_paddle.width, left_paddle.x,
+                left_paddle.y, left_paddle.y + left_paddle.height, t_hit
+            )
+            if _paddle_hit_first(t, t_hit, event):
+                t_hit, event = t, 'left'
+            t = max(0.0, (-radius - x) / vx)
+            if t < t_hit:
+                t_hit, event = t, 'right_scores'
+        elif vx > 0:
+            t = _sweep_paddle(
+                -x, y, -vx, vy, radius,
+                -right_paddle.x, -(right_paddle.x + right_paddle.width),
+                right_paddle.y, right_paddle.y + right_paddle.height, t_hit
+            )
+            if _paddle_hit_first(t, t_hit, event):
+                t_hit, event = t, 'right'
+            t = max(0.0, (BASE_WIDTH + radius - x) / vx)
+            if t < t_hit:
+                t_hit, event = t, 'left_scores'
+
+        if event is None:
+            break
+
+        # Jump to the event
+        base_tick += t_hit
+        x += vx * t_hit
+        y += vy * t_hit
+        ball.x = x
+        ball.y = y
+
+        if event == 'wall':
+            ball.dy = -ball.dy
+            # Add slight randomness to prevent looping patterns
+            ball.dy += (game_state.rng.random() - 0.5) * 0.1
+        elif event == 'left':
+            _bounce_off_paddle(game_state, left_paddle, 1)
+        elif event == 'right':
+            _bounce_off_paddle(game_state, right_paddle, -1)
+        else:
+            if event == 'right_scores':
+                right_paddle.score += 1
+                reset_ball(game_id, 1)
+            else:
+                left_paddle.score += 1
+                reset_ball(game_id, -1)
+            x = ball.x
+            y = ball.y
+            result = 1
+            continue
+        result = result or 2
+
+    game_state.trajectory = (base_tick, x, y)
+
+    # Sample the straight path at the target tick (and one tick before it
+    # for client-side interpolation)
+    vx = ball.dx * per_tick
+    vy = ball.dy * per_tick
+    elapsed = target_tick - base_tick
+    previous = max(0, elapsed - 1)
+    ball.prev_x = x + vx * previous
+    ball.prev_y = y + vy * previous
+    ball.x = x + vx * elapsed
+    ball.y = y + vy * elapsed
+    game_state.tick = target_tick
+    return result
+
 def reset_ball(game_id, direction):
     """
     Resets the ball after scoring.
@@ -276,15 +678,16 @@ def reset_ball(game_id, direction):
         return
     
     game_state = active_games[game_id]
-    settings = game_state['settings']
+    settings = game_state.settings
     
-    game_state['ball']['x'] = BASE_WIDTH / 2
-    game_state['ball']['y'] = BASE_HEIGHT / 2
-    game_state['ball']['speed'] = settings['ball_speed']
-    game_state['ball']['dx'] = direction * settings['ball_speed']
+    game_state.ball.x = BASE_WIDTH / 2
+    game_state.ball.y = BASE_HEIGHT / 2
+    game_state.ball.speed = settings['ball_speed']
+    game_state.ball.dx = direction * settings['ball_speed']
     
     # Add some randomness to y direction
-    game_state['ball']['dy'] = ((random.random() * 2 - 1) * settings['ball_speed']) / 2
+    game_state.ball.dy = ((game_state.rng.random() * 2 - 1) * settings['ball_speed']) / 2
+    game_state.trajectory = None
 
 def check_match_end(game_id):
     """
@@ -300,38 +703,128 @@ def check_match_end(game_id):
         return False
     
     game_state = active_games[game_id]
-    left_score = game_state['left_paddle']['score']
-    right_score = game_state['right_paddle']['score']
+    left_score = game_state.left_paddle.score
+    right_score = game_state.right_paddle.score
     
     match_ended = False
     
     # First to POINTS_TO_WIN_MATCH points wins match
     if left_score >= POINTS_TO_WIN_MATCH:
         # Player 1 wins match
-        game_state['match_wins']['player1'] += 1
-        game_state['winner'] = 'player1'
+        game_state.match_wins['player1'] += 1
+        game_state.winner = 'player1'
         match_ended = True
         
         # Check if game is over
-        if game_state['match_wins']['player1'] >= MATCHES_TO_WIN_GAME:
-            game_state['game_status'] = 'gameOver'
+        if game_state.match_wins['player1'] >= MATCHES_TO_WIN_GAME:
+            game_state.game_status = 'gameOver'
         else:
-            game_state['game_status'] = 'matchOver'
+            game_state.game_status = 'matchOver'
     
     elif right_score >= POINTS_TO_WIN_MATCH:
         # Player 2 wins match
-        game_state['match_wins']['player2'] += 1
-        game_state['winner'] = 'player2'
+        game_state.match_wins['player2'] += 1
+        game_state.winner = 'player2'
         match_ended = True
         
         # Check if game is over
-        if game_state['match_wins']['player2'] >= MATCHES_TO_WIN_GAME:
-            game_state['game_status'] = 'gameOver'
+        if game_state.match_wins['player2'] >= MATCHES_TO_WIN_GAME:
+            game_state.game_status = 'gameOver'
         else:
-            game_state['game_status'] = 'matchOver'
+            game_state.game_status = 'matchOver'
     
+    if match_ended:
+        close_match_record(game_state)
     return match_ended
 
+def open_match_record(game_state):
+    """
+    Starts the ledger entry of the current match, on its first serve.
+
+    Args:
+        game_state: The GameState
+    """
+    ledger = game_state.ledger
+    if ledger and ledger[-1].match_number == game_state.current_match:
+        # Resumed after a pause, same match
+        return
+    ledger.append(MatchLedger(game_state.current_match, time.time(), game_state.paddle_hits))
+
+def record_point(game_id):
+    """
+    Ends the current rally in the match ledger, call it when a point is scored.
+
+    Args:
+        game_id: The ID of the game
+    """
+    game_state = active_games.get(game_id)
+    if game_state is None or not game_state.ledger:
+        return
+    entry = game_state.ledger[-1]
+    if entry.ended_at is not None:
+        return
+    rally = game_state.paddle_hits - entry.rally_start
+    if rally > entry.longest_rally:
+        entry.longest_rally = rally
+    entry.rally_start = game_state.paddle_hits
+
+def close_match_record(game_state):
+    """
+    Fills in the final scores and winner of the current match's ledger entry.
+
+    Args:
+        game_state: The GameState
+    """
+    if not game_state.ledger:
+        return
+    entry = game_state.ledger[-1]
+    if entry.ended_at is not None or entry.match_number != game_state.current_match:
+        return
+    entry.ended_at = time.time()
+    entry.score_player1 = game_state.left_paddle.score
+    entry.score_player2 = game_state.right_paddle.score
+    entry.winner = game_state.winner
+    entry.paddle_hits = game_state.paddle_hits - entry.hits_at_start
+
+def take_match_records(game_state, include_unfinished=False):
+    """
+    Turns the ledger entries that weren't written yet into MatchResult records.
+
+    Args:
+        game_state: The GameState
+        include_unfinished: Also take the current match if it hasn't ended
+                            (the game is ending anyway)
+
+    Returns:
+        Tuple of persistence.MatchResult
+    """
+    records = []
+    for entry in game_state.ledger:
+        if entry.flushed:
+            continue
+        finished = entry.ended_at is not None
+        if not finished and not include_unfinished:
+            continue
+        entry.flushed = True
+        if finished:
+            score_player1, score_player2 = entry.score_player1, entry.score_player2
+        else:
+            score_player1 = game_state.left_paddle.score
+            score_player2 = game_state.right_paddle.score
+        records.append(persistence.MatchResult(
+            match_number=entry.match_number,
+            status=StatusChoices.MATCH_COMPLETED if finished else StatusChoices.MATCH_IN_PROGRESS,
+            score_player1=score_player1,
+            score_player2=score_player2,
+            winner=entry.winner,
+            started_at=entry.started_at,
+            completed_at=entry.ended_at,
+            paddle_hits=entry.paddle_hits if finished else game_state.paddle_hits - entry.hits_at_start,
+            longest_rally=max(entry.longest_rally, game_state.paddle_hits - entry.rally_start)
+            if not finished else entry.longest_rally
+        ))
+    return tuple(records)
+
 def reset_for_new_match(game_id):
     """
     Resets the game state for a new match.
@@ -343,27 +836,28 @@ def reset_for_new_match(game_id):
         return
     
     game_state = active_games[game_id]
-    settings = game_state['settings']
+    settings = game_state.settings
     
     # Reset ball
-    game_state['ball']['x'] = BASE_WIDTH / 2
-    game_state['ball']['y'] = BASE_HEIGHT / 2
-    game_state['ball']['dx'] = settings['ball_speed']
-    game_state['ball']['dy'] = settings['ball_speed'] * BASE_HEIGHT / BASE_WIDTH
-    game_state['ball']['speed'] = settings['ball_speed']
+    game_state.ball.x = BASE_WIDTH / 2
+    game_state.ball.y = BASE_HEIGHT / 2
+    game_state.ball.dx = settings['ball_speed']
+    game_state.ball.dy = settings['ball_speed'] * BASE_HEIGHT / BASE_WIDTH
+    game_state.ball.speed = settings['ball_speed']
+    game_state.trajectory = None
     
     # Reset paddles
-    game_state['left_paddle']['y'] = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
-    game_state['left_paddle']['score'] = 0
-    game_state['right_paddle']['y'] = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
-    game_state['right_paddle']['score'] = 0
+    game_state.left_paddle.y = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
+    game_state.left_paddle.score = 0
+    game_state.right_paddle.y = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
+    game_state.right_paddle.score = 0
     
     # Update match counter
-    game_state['current_match'] += 1
+    game_state.current_match += 1
     
     # Reset status
-    game_state['game_status'] = 'menu'
-    game_state['winner'] = None
+    game_state.game_status = 'menu'
+    game_state.winner = None
 
 def reset_game(game_id):
     """
@@ -376,28 +870,30 @@ def reset_game(game_id):
         return
     
     game_state = active_games[game_id]
-    settings = game_state['settings']
+    settings = game_state.settings
     
     # Reset everything
-    game_state['ball']['x'] = BASE_WIDTH / 2
-    game_state['ball']['y'] = BASE_HEIGHT / 2
-    game_state['ball']['dx'] = settings['ball_speed']
-    game_state['ball']['dy'] = settings['ball_speed'] * BASE_HEIGHT / BASE_WIDTH
-    game_state['ball']['speed'] = settings['ball_speed']
-    
-    game_state['left_paddle']['y'] = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
-    game_state['left_paddle']['score'] = 0
-    game_state['right_paddle']['y'] = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
-    game_state['right_paddle']['score'] = 0
-    
-    game_state['match_wins']['player1'] = 0
-    game_state['match_wins']['player2'] = 0
-    
-    game_state['current_match'] = 1
-    game_state['game_status'] = 'menu'
-    game_state['winner'] = None
+    game_state.ball.x = BASE_WIDTH / 2
+    game_state.ball.y = BASE_HEIGHT / 2
+    game_state.ball.dx = settings['ball_speed']
+    game_state.ball.dy = settings['ball_speed'] * BASE_HEIGHT / BASE_WIDTH
+    game_state.ball.speed = settings['ball_speed']
+    game_state.trajectory = None
+    
+    game_state.left_paddle.y = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
+    game_state.left_paddle.score = 0
+    game_state.right_paddle.y = BASE_HEIGHT / 2 - PADDLE_HEIGHT / 2
+    game_state.right_paddle.score = 0
+    
+    game_state.match_wins['player1'] = 0
+    game_state.match_wins['player2'] = 0
+    game_state.ledger = []
+    
+    game_state.current_match = 1
+    game_state.game_status = 'menu'
+    game_state.winner = None
 
-def set_player_connection(game_id, player_num, connected):
+def set_player_connection(game_id, player_num, connected, hold_slot=False):
     """
     Updates a player's connection status.
     
@@ -405,6 +901,8 @@ def set_player_connection(game_id, player_num, connected):
         game_id: The ID of the game
         player_num: Which player (1 or 2)
         connected: Boolean connection status
+        hold_slot: On a disconnect, keep the player's slot for a reconnection
+            and pause the game instead of cancelling it
     
     Returns:
         Dictionary with game status info
@@ -412,36 +910,54 @@ def set_player_connection(game_id, player_num, connected):
     if game_id not in active_games:
         return None
     
+    game_state = active_games[game_id]
     player_key = f'player{player_num}'
-    active_games[game_id]['players'][player_key]['connected'] = connected
+    game_state.players[player_key].connected = connected
+    game_state.players[player_key].held = hold_slot and not connected
     
     # Check if game status needs updating
     status_changed = False
-    old_status = active_games[game_id]['game_status']
+    old_status = game_state.game_status
+    both_connected = (game_state.players['player1'].connected and
+                      game_state.players['player2'].connected)
     
     # If both players are connected and game is waiting, change to menu
-    if (active_games[game_id]['players']['player1']['connected'] and
-        active_games[game_id]['players']['player2']['connected'] and
-        active_games[game_id]['game_status'] == 'waiting'):
+    if both_connected and game_state.game_status == 'waiting':
         
-        active_games[game_id]['game_status'] = 'menu'
+        game_state.game_status = 'menu'
         status_changed = True
     
-    # If a player disconnects while game is playing, pause the game
+    # Both players are back after a reconnection pause, carry on where they were
+    elif (both_connected and
+          game_state.game_status == 'paused' and
+          game_state.resume_status is not None):
+        
+        set_game_status(game_id, game_state.resume_status)
+        game_state.resume_status = None
+        status_changed = True
+    
+    # If a player disconnects and its slot is held, pause the game
+    elif (not connected and hold_slot and
+          game_state.game_status in ('menu', 'playing', 'matchOver')):
+        
+        game_state.resume_status = game_state.game_status
+        game_state.game_status = 'paused'
+        status_changed = True
+    
+    # If a player disconnects while game is playing, cancel the game
     elif (not connected and
-          active_games[game_id]['game_status'] == 'playing'):
+          game_state.game_status == 'playing'):
         
-        active_games[game_id]['game_status'] = 'cancelled'
+        game_state.game_status = 'cancelled'
         status_changed = True
     
     return {
         'status_changed': status_changed,
         'old_status': old_status,
-        'new_status': active_games[game_id]['game_status'],
-        'both_connected': (active_games[game_id]['players']['player1']['connected'] and
-                          active_games[game_id]['players']['player2']['connected']),
-        'any_connected': (active_games[game_id]['players']['player1']['connected'] or
-                         active_games[game_id]['players']['player2']['connected'])
+        'new_status': game_state.game_status,
+        'both_connected': both_connected,
+        'any_connected': (game_state.players['player1'].connected or
+                         game_state.players['player2'].connected)
     }
 
 def set_game_status(game_id, new_status):
@@ -463,10 +979,11 @@ def set_game_status(game_id, new_status):
     
     # If changing to playing, update the timestamp
     if new_status == 'playing':
-        active_games[game_id]['last_update_time'] = time.time()
+        active_games[game_id].last_update_time = time.time()
+        open_match_record(active_games[game_id])
     
     # Update the status
-    active_games[game_id]['game_status'] = new_status
+    active_games[game_id].game_status = new_status
     
     return True
 
@@ -483,8 +1000,8 @@ def is_any_player_connected(game_id):
     if game_id not in active_games:
         return False
     
-    return (active_games[game_id]['players']['player1']['connected'] or
-            active_games[game_id]['players']['player2']['connected'])
+    return (active_games[game_id].players['player1'].connected or
+            active_games[game_id].players['player2'].connected)
 
 def are_both_players_connected(game_id):
     """
@@ -499,168 +1016,84 @@ def are_both_players_connected(game_id):
     if game_id not in active_games:
         return False
     
-    return (active_games[game_id]['players']['player1']['connected'] and
-            active_games[game_id]['players']['player2']['connected'])
+    return (active_games[game_id].players['player1'].connected and
+            active_games[game_id].players['player2'].connected)
 
-@database_sync_to_async
-def save_game_results(game_id):
+def save_game_results(game_id, forfeited_by=None):
     """
-    Saves the final game results to the database.
-    
+    Queues the final game results for the write-behind writer.
+
+    Only an immutable GameResult is built here, from the in-memory state and
+    the match ledger; the database is written later, in batches, by
+    persistence.result_writer (which also updates the players' profiles,
+    once per game).
+
     Args:
         game_id: The ID of the game
-    
+        forfeited_by: The player who abandoned the game (1 or 2), the other
+            one wins it whatever the match wins
+
     Returns:
-        Boolean indicating success
+        Boolean indicating if a result was queued
     """
     try:
-        if game_id not in active_games :
+        if game_id not in active_games:
             return False
-            
-        game = Game.objects.get(id=game_id)
+
         game_state = active_games[game_id]
-        if game.status == 'cancelled':
-            return False
-        # Update game status
-        if game.status != 'cancelled':
-            game.status = 'completed'
-        
-            # Set winner if game ended
-            if game_state['game_status'] == 'gameOver':
-                if game_state['match_wins']['player1'] > game_state['match_wins']['player2'] :
-                    game.winner = game.player1
-                else:
-                    game.winner = game.player2
-            
-            # Update match scores
-            game.final_score_player1 = game_state['match_wins']['player1']
-            game.final_score_player2 = game_state['match_wins']['player2']
-            
-            # Set completion time
-            game.completed_at = timezone.now()
-            
-            # Save game
-            game.save()
-            
-            # Save match data for all matches that were played
-            current_match = game_state['current_match']
-            
-            # Create match records for each match that was played
-            for i in range(1, current_match + 1):
-                # Check if this match already exists
-                match_exists = Match.objects.filter(game=game, match_number=i).exists()
-                
-                if not match_exists:
-                    # For the current match (potentially incomplete)
-                    if i == current_match:
-                        print(f"Creating match {i}")
-                        match = Match.objects.create(
-                            game=game,
-                            match_number=i,
-                            status=StatusChoices.MATCH_COMPLETED if game_state['game_status'] == 'gameOver' else StatusChoices.MATCH_IN_PROGRESS,
-                            score_player1=game_state['left_paddle']['score'],
-                            score_player2=game_state['right_paddle']['score'],
-                            winner=game_state['winner'],
-                            started_at=timezone.now() - timezone.timedelta(minutes=5),
-                            completed_at=timezone.now() if game_state['game_status'] == 'gameOver' else None
-                        )
-                        match.save()
-                    # For completed previous matches
-                    else:
-                        # Determine who won this match based on match_wins
-                        player1_wins = game_state['match_wins']['player1']
-                        player2_wins = game_state['match_wins']['player2']
-                        
-                        # Need to figure out if player1 or player2 won this specific match
-                        # For simplicity, we'll say player1 won matches 1 to player1_wins,
-                        # and player2 won matches player1_wins+1 to player1_wins+player2_wins
-                        if i <= player1_wins:
-                            winner = 'player1'
-                            score_player1 = POINTS_TO_WIN_MATCH  # Points to win a match
-                            score_player2 = random.randint(0, POINTS_TO_WIN_MATCH - 1)  # Random lower score
-                        else:
-                            winner = 'player2'
-                            score_player2 = POINTS_TO_WIN_MATCH  # Points to win a match
-                            score_player1 = random.randint(0, POINTS_TO_WIN_MATCH - 1)  # Random lower score
-                        
-                        match = Match.objects.create(
-                            game=game,
-                            match_number=i,
-                            status=StatusChoices.MATCH_COMPLETED,
-                            score_player1=score_player1,
-                            score_player2=score_player2,
-                            winner=winner,
-                            started_at=timezone.now() - timezone.timedelta(minutes=i*5),
-                            completed_at=timezone.now() - timezone.timedelta(minutes=(i-1)*5)
-                        )
-                        print(f"else Creating match {i}")
-                        match.save()
-            
-            # Update player profiles
-            update_player_profiles(game_id)
-        
-        return True
+        game_over = game_state.game_status == 'gameOver'
+
+        # Winner of the game, if it ended
+        winner = None
+        if forfeited_by is not None:
+            winner = 'player2' if forfeited_by == 1 else 'player1'
+        elif game_over:
+            if game_state.match_wins['player1'] > game_state.match_wins['player2']:
+                winner = 'player1'
+            else:
+                winner = 'player2'
+
+        # Profiles only count games played until someone won the game
+        update_profiles = game_over and MATCHES_TO_WIN_GAME in (
+            game_state.match_wins['player1'], game_state.match_wins['player2']
+        )
+
+        return persistence.result_writer.enqueue(persistence.GameResult(
+            game_id=game_id,
+            game_over=game_over,
+            winner=winner,
+            match_wins_player1=game_state.match_wins['player1'],
+            match_wins_player2=game_state.match_wins['player2'],
+            completed_at=time.time(),
+            # Matches of the ledger not written at their end yet, with the
+            # one being played if the game was cut short
+            matches=take_match_records(game_state, include_unfinished=True),
+            update_profiles=update_profiles
+        ))
     except Exception as e:
         print(f"Error saving game results: {str(e)}")
         import traceback
         traceback.print_exc()
         return False
 
-@database_sync_to_async
-def update_player_profiles(game_id):
-    print("Updating player profiles")
-    try:
-        if game_id not in active_games:
-            print("Game not found in active games")
-            return
-            
-        game = Game.objects.get(id=game_id)
-        game_state = active_games[game_id]
-        # Only update if game is completed
-        if game_state['game_status'] != 'gameOver':
-            return
-        if game_state['match_wins']['player1'] != 3 and game_state['match_wins']['player2'] != 3:
-            return
-        status = game.status
-        if status == 'cancelled':
-            return
-        # Get profiles
-        p1_profile, _ = PlayerProfile.objects.get_or_create(player=game.player1)
-        p2_profile, _ = PlayerProfile.objects.get_or_create(player=game.player2)
-        
-        # Update match counts
-        p1_profile.matches_played += 1
-        p2_profile.matches_played += 1
-        
-        # Update wins/losses
-        if game_state['match_wins']['player1'] > game_state['match_wins']['player2']:
-            p1_profile.matches_won += 1
-            p2_profile.matches_lost += 1
-            
-            # Update achievements for player 1
-            p1_profile.update_achievements(game)  # Add this line
-            
-            #update_player1 level and experience
-            p1_profile.experience += 500
-            p1_profile.level = math.floor(p1_profile.experience/(1000))
-        else:
-            p2_profile.matches_won += 1
-            p1_profile.matches_lost += 1
-            
-            # Update achievements for player 2
-            p2_profile.update_achievements(game)  # Add this line
+def save_match_results(game_id):
+    """
+    Queues the matches that ended since the last call for the write-behind
+    writer, call it when a match ends and the game goes on.
 
-            #update_player2 level and experience
-            p2_profile.experience += 100
-            factor = p2_profile.level if p2_profile.level > 0 else 1
-            p2_profile.level = math.floor(p2_profile.experience/(1000 * factor))
-        
-        # Save profiles
-        p1_profile.save()
-        p2_profile.save()
-        
-    except Exception as e:
-        print(f"Error updating player profiles: {str(e)}")
+    Args:
+        game_id: The ID of the game
+
+    Returns:
+        Boolean indicating if anything was queued
+    """
+    game_state = active_games.get(game_id)
+    if game_state is None:
+        return False
+    matches = take_match_records(game_state)
+    if not matches:
+        return False
+    return persistence.result_writer.enqueue(persistence.MatchRecords(game_id, matches))
 
 
 def validate_game_state(game_id, player_id, position=None):
@@ -682,16 +1115,16 @@ def validate_game_state(game_id, player_id, position=None):
     
     # Verify player is part of this game
     player_num = None
-    if str(player_id) == str(game_state['players']['player1']['id']):
+    if str(player_id) == str(game_state.players['player1'].id):
         player_num = 1
-    elif str(player_id) == str(game_state['players']['player2']['id']):
+    elif str(player_id) == str(game_state.players['player2'].id):
         player_num = 2
     else:
         return (False, "Player not part of this game")
     
     # Verify game is in a valid state for moves
-    if game_state['game_status'] != 'playing':
-        return (False, f"Game is not in playing state (current: {game_state['game_status']})")
+    if game_state.game_status != 'playing':
+        return (False, f"Game is not in playing state (current: {game_state.game_status})")
     
     # If validating a paddle move, check position bounds
     # print(f"Updating paddle position: game_id={game_id}, player_num={player_num}, position={position}, type={type(position)}")
@@ -704,9 +1137,9 @@ def validate_game_state(game_id, player_id, position=None):
             return (False, "Position out of bounds")
             
         # Check for unreasonable paddle movement (anti-cheat)
-        paddle_key = 'left_paddle' if player_num == 1 else 'right_paddle'
-        current_position = game_state[paddle_key]['y']
-        # max_move_distance = game_state[paddle_key]['speed'] * 10 # Allow some buffer for latency
+        paddle = game_state.paddle(player_num)
+        current_position = paddle.y
+        # max_move_distance = paddle.speed * 10 # Allow some buffer for latency
         
         # if abs(position - current_position) > max_move_distance:
         #     return (False, "Paddle movement too large")
@@ -731,9 +1164,9 @@ def update_paddle_position(game_id, player_num, position):
     # Get player ID from player number
     player_id = None
     if player_num == 1:
-        player_id = active_games[game_id]['players']['player1']['id']
+        player_id = active_games[game_id].players['player1'].id
     elif player_num == 2:
-        player_id = active_games[game_id]['players']['player2']['id']
+        player_id = active_games[game_id].players['player2'].id
     else:
         return False
     
@@ -744,38 +1177,57 @@ def update_paddle_position(game_id, player_num, position):
     #     return False
     
     # Update the appropriate paddle
-    paddle_key = 'left_paddle' if player_num == 1 else 'right_paddle'
-    active_games[game_id][paddle_key]['y'] = position
+    remember_paddle(active_games[game_id], player_num)
+    active_games[game_id].paddle(player_num).y = position
+    # Analytic physics: the ball's next event depends on the paddles
+    active_games[game_id].trajectory = None
     
     return True
 
 # rate limiting to prevent overloading (in game_consumers.py)
 
 import time
-from collections import defaultdict, deque
 
 class RateLimiter:
-    """Simple rate limiter to prevent websocket spam"""
+    """
+    Simple rate limiter to prevent websocket spam.
+
+    A token bucket per user: up to max_messages can be sent at once and the
+    bucket refills at max_messages per window_seconds. Only two numbers are
+    kept per user, however many messages they send.
+    """
     
     def __init__(self, max_messages=30, window_seconds=1):
         self.max_messages = max_messages
         self.window_seconds = window_seconds
-        self.message_counts = defaultdict(lambda: deque())
+        self.refill_rate = max_messages / window_seconds
+        # user_id -> [tokens left, time of the last refill]
+        self.buckets = {}
+        # Messages refused since the limiter was created
+        self.dropped = 0
     
     def is_allowed(self, user_id):
         """Check if user is allowed to send message based on recent history"""
-        now = time.time()
+        now = time.monotonic()
         
-        # Get the user's message queue
-        queue = self.message_counts[user_id]
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            self.buckets[user_id] = [self.max_messages - 1, now]
+            return True
         
-        # Remove messages outside the time window
-        while queue and queue[0] < now - self.window_seconds:
-            queue.popleft()
+        # Refill for the time elapsed since the last message
+        tokens = min(self.max_messages, bucket[0] + (now - bucket[1]) * self.refill_rate)
+        bucket[1] = now
         
         # Check if under the limit
-        if len(queue) < self.max_messages:
-            queue.append(now)
+        if tokens >= 1:
+            bucket[0] = tokens - 1
             return True
         
+        bucket[0] = tokens
+        self.dropped += 1
         return False
+    
+    def forget(self, user_id):
+        """Frees the state kept for a user (e.g. when the socket closes)"""
+        self.buckets.pop(user_id, None)
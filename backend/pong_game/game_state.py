@@ -0,0 +1,195 @@
+"""
+Compact in-memory game state objects.
+
+The physics hot path runs at 240 Hz for every active game, so the state is
+kept in small ``__slots__`` classes instead of nested dictionaries. Attribute
+access is cheaper than string-key lookups and every object drops its
+per-instance ``__dict__``. ``to_wire()`` converts a state back into the plain
+dictionary layout the clients expect.
+"""
+import random
+
+
+class Ball:
+    __slots__ = ('x', 'y', 'dx', 'dy', 'speed', 'radius', 'prev_x', 'prev_y')
+
+    def __init__(self, x, y, dx, dy, speed, radius):
+        self.x = x
+        self.y = y
+        self.dx = dx
+        self.dy = dy
+        self.speed = speed
+        self.radius = radius
+        # Previous positions for client-side interpolation
+        self.prev_x = x
+        self.prev_y = y
+
+    def to_wire(self):
+        return {
+            'x': self.x,
+            'y': self.y,
+            'dx': self.dx,
+            'dy': self.dy,
+            'speed': self.speed,
+            'radius': self.radius,
+            'prev_x': self.prev_x,
+            'prev_y': self.prev_y
+        }
+
+
+class Paddle:
+    __slots__ = ('x', 'y', 'width', 'height', 'speed', 'score')
+
+    def __init__(self, x, y, width, height, speed=8, score=0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.speed = speed
+        self.score = score
+
+    def to_wire(self):
+        return {
+            'x': self.x,
+            'y': self.y,
+            'width': self.width,
+            'height': self.height,
+            'speed': self.speed,
+            'score': self.score
+        }
+
+
+class Player:
+    __slots__ = ('id', 'username', 'connected', 'held')
+
+    def __init__(self, id, username, connected=False):
+        self.id = id
+        self.username = username
+        self.connected = connected
+        # Disconnected but the slot is kept for a reconnection (PONG_RECONNECT_GRACE)
+        self.held = False
+
+    def to_wire(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'connected': self.connected
+        }
+
+
+class MatchLedger:
+    """
+    In-memory record of one match, kept from its first rally to its end
+    and written to a Match row by the write-behind writer.
+    """
+
+    __slots__ = ('match_number', 'started_at', 'ended_at', 'score_player1', 'score_player2',
+                 'winner', 'hits_at_start', 'rally_start', 'longest_rally', 'paddle_hits', 'flushed')
+
+    def __init__(self, match_number, started_at, hits_at_start):
+        self.match_number = match_number
+        self.started_at = started_at  # time.time() of the first serve
+        self.ended_at = None
+        self.score_player1 = 0
+        self.score_player2 = 0
+        self.winner = None
+        # GameState.paddle_hits when the match and the current rally started
+        self.hits_at_start = hits_at_start
+        self.rally_start = hits_at_start
+        self.longest_rally = 0
+        self.paddle_hits = None  # Hits of the whole match, once it ended
+        self.flushed = False  # Already handed to the writer
+
+
+class GameState:
+    """
+    Authoritative state of one running game.
+
+    Static data (players, difficulty, settings) lives next to the per-tick
+    data (ball, paddles) but only the latter is touched by the physics step.
+    """
+
+    __slots__ = (
+        'game_id', 'ball', 'left_paddle', 'right_paddle', 'match_wins',
+        'current_match', 'game_status', 'winner', 'players', 'difficulty',
+        'settings', 'last_update_time', 'loop_running', 'seed', 'rng', 'tick',
+        'trajectory', 'acks', 'lag_ticks', 'paddle_history', 'paddle_hits', 'ledger',
+        'resume_status'
+    )
+
+    def __init__(self, game_id, ball, left_paddle, right_paddle, players,
+                 difficulty, settings, last_update_time, seed=None):
+        self.game_id = game_id
+        self.ball = ball
+        self.left_paddle = left_paddle
+        self.right_paddle = right_paddle
+        self.match_wins = {'player1': 0, 'player2': 0}
+        self.current_match = 1
+        self.game_status = 'waiting'
+        self.winner = None
+        self.players = players
+        self.difficulty = difficulty
+        self.settings = settings
+        self.last_update_time = last_update_time
+        self.loop_running = False
+        # Per-game random source so games don't share (and race on) the global RNG;
+        # with the seed and the input log (replay.py) a game can be re-simulated
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # Physics steps run while playing, used to timestamp recorded inputs
+        self.tick = 0
+        # Analytic physics only: (tick, x, y) the ball's straight path starts
+        # from, None to start it from the current ball position
+        self.trajectory = None
+        # Last applied client input per player: {player_num: (seq, client timestamp)},
+        # echoed in every frame so clients can reconcile their predicted paddle
+        self.acks = {1: (0, 0.0), 2: (0, 0.0)}
+        # Lag compensation window in ticks (0 = off) and, when on, the recent
+        # paddle positions per player: {player_num: deque([(tick moved at, previous y), ...])}
+        self.lag_ticks = 0
+        self.paddle_history = None
+        # Balls returned by either paddle over the whole game
+        self.paddle_hits = 0
+        # MatchLedger per match played so far, see game_logic.open_match_record
+        self.ledger = []
+        # Status to go back to once the players whose slots are held are back
+        self.resume_status = None
+
+    def paddle(self, player_num):
+        """Returns the paddle controlled by player 1 (left) or player 2 (right)"""
+        return self.left_paddle if player_num == 1 else self.right_paddle
+
+    def player(self, player_num):
+        """Returns the Player object for player 1 or 2"""
+        return self.players[f'player{player_num}']
+
+    def to_wire(self):
+        """
+        Serializes the state into the dictionary layout sent to clients.
+
+        Returns:
+            A new dictionary that is safe to hand to the channel layer
+        """
+        return {
+            'game_id': self.game_id,
+            'ball': self.ball.to_wire(),
+            'left_paddle': self.left_paddle.to_wire(),
+            'right_paddle': self.right_paddle.to_wire(),
+            'match_wins': dict(self.match_wins),
+            'current_match': self.current_match,
+            'game_status': self.game_status,
+            'winner': self.winner,
+            'players': {
+                'player1': self.players['player1'].to_wire(),
+                'player2': self.players['player2'].to_wire()
+            },
+            'difficulty': self.difficulty,
+            'settings': dict(self.settings),
+            'last_update_time': self.last_update_time,
+            'loop_running': self.loop_running,
+            'tick': self.tick,
+            'acks': {
+                f'player{player_num}': {'seq': seq, 't': sent_at}
+                for player_num, (seq, sent_at) in self.acks.items()
+            }
+        }
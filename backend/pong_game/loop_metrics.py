@@ -0,0 +1,213 @@
+"""
+Game loop instrumentation.
+
+With PONG_LOOP_METRICS on, the scheduler and the game runners record, per
+process and per game:
+
+- tick duration: wall time of a whole scheduler tick (process) and of each
+  game's callback (per game), in ms;
+- lateness: how far behind its schedule a tick started, in ms;
+- physics steps per tick, and the ticks where the catch-up was capped at
+  max_updates_per_frame (the backlog was discarded);
+- broadcast latency: time from the start of the tick to the frame being
+  queued for the players, in ms;
+- bytes per frame, as queued for the players;
+- errors raised by game callbacks.
+
+Values go into fixed-bucket histograms (count, sum, max and bucket counts),
+so recording is a bisect and a few additions. Reports are served by the
+admin-only GET /api/pong_game/metrics/ and, for their own game, to players
+sending {'type': 'debug_stats'} on the game socket.
+
+With metrics off, loop_metrics is None and the hooks cost one check.
+"""
+import bisect
+import time
+from django.conf import settings
+
+# Bucket upper bounds
+DURATION_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+STEP_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20)
+SIZE_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+class Histogram:
+    """Fixed-bucket histogram; the last bucket counts values above every bound"""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Records one value"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Estimates a quantile from the buckets.
+
+        Returns:
+            Upper bound of the bucket holding the quantile (max for the last one)
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def report(self):
+        """JSON-safe summary with the bucket counts"""
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 3),
+            'buckets': {
+                (str(bound) if index < len(self.bounds) else 'inf'): count
+                for index, (bound, count) in enumerate(zip(self.bounds + (None,), self.counts))
+            }
+        }
+
+
+class GameLoopMetrics:
+    """Metrics of one game"""
+
+    __slots__ = ('callback_ms', 'steps', 'broadcast_latency_ms', 'frame_bytes', 'errors', 'since')
+
+    def __init__(self):
+        self.callback_ms = Histogram(DURATION_BUCKETS_MS)
+        self.steps = Histogram(STEP_BUCKETS)
+        self.broadcast_latency_ms = Histogram(DURATION_BUCKETS_MS)
+        self.frame_bytes = Histogram(SIZE_BUCKETS)
+        self.errors = 0
+        self.since = time.time()
+
+    def report(self):
+        """JSON-safe summary"""
+        return {
+            'since': self.since,
+            'tick_duration_ms': self.callback_ms.report(),
+            'steps_per_tick': self.steps.report(),
+            'broadcast_latency_ms': self.broadcast_latency_ms.report(),
+            'bytes_per_frame': self.frame_bytes.report(),
+            'errors': self.errors
+        }
+
+
+class LoopMetrics:
+    """Metrics of this process's game loop and of the games it runs"""
+
+    def __init__(self):
+        self.tick_ms = Histogram(DURATION_BUCKETS_MS)
+        self.lateness_ms = Histogram(DURATION_BUCKETS_MS)
+        self.steps = Histogram(STEP_BUCKETS)
+        self.broadcast_latency_ms = Histogram(DURATION_BUCKETS_MS)
+        self.frame_bytes = Histogram(SIZE_BUCKETS)
+        self.capped_ticks = 0
+        self.errors = 0
+        self.since = time.time()
+        self.games = {}
+
+    def game(self, game_id):
+        """Returns the metrics of a game, creating them on first use"""
+        metrics = self.games.get(game_id)
+        if metrics is None:
+            metrics = self.games[game_id] = GameLoopMetrics()
+        return metrics
+
+    def record_tick(self, duration, lateness, steps, capped):
+        """
+        Records one scheduler tick.
+
+        Args:
+            duration: Seconds the whole tick took
+            lateness: Seconds the tick started after its scheduled time
+            steps: Physics steps run by the tick
+            capped: True if steps was limited by max_updates_per_frame
+        """
+        self.tick_ms.observe(duration * 1000)
+        self.lateness_ms.observe(max(0.0, lateness) * 1000)
+        self.steps.observe(steps)
+        if capped:
+            self.capped_ticks += 1
+
+    def record_callback(self, game_id, duration, steps):
+        """Records the callback of one game (seconds) and the physics steps it got"""
+        metrics = self.game(game_id)
+        metrics.callback_ms.observe(duration * 1000)
+        metrics.steps.observe(steps)
+
+    def record_broadcast(self, game_id, latency, size):
+        """
+        Records a frame queued for the players of a game.
+
+        Args:
+            game_id: The ID of the game
+            latency: Seconds since the start of the tick
+            size: Bytes of the frame
+        """
+        metrics = self.game(game_id)
+        latency_ms = latency * 1000
+        metrics.broadcast_latency_ms.observe(latency_ms)
+        metrics.frame_bytes.observe(size)
+        self.broadcast_latency_ms.observe(latency_ms)
+        self.frame_bytes.observe(size)
+
+    def record_error(self, game_id):
+        """Counts an exception raised by a game's callback"""
+        self.errors += 1
+        self.game(game_id).errors += 1
+
+    def forget_game(self, game_id):
+        """Drops the metrics of a game leaving this worker"""
+        self.games.pop(game_id, None)
+
+    def report(self, include_games=True):
+        """
+        JSON-safe summary of the process metrics.
+
+        Args:
+            include_games: Add the per-game reports
+        """
+        report = {
+            'since': self.since,
+            'tick_duration_ms': self.tick_ms.report(),
+            'lateness_ms': self.lateness_ms.report(),
+            'steps_per_tick': self.steps.report(),
+            'capped_ticks': self.capped_ticks,
+            'broadcast_latency_ms': self.broadcast_latency_ms.report(),
+            'bytes_per_frame': self.frame_bytes.report(),
+            'errors': self.errors
+        }
+        if include_games:
+            report['games'] = {
+                str(game_id): metrics.report() for game_id, metrics in list(self.games.items())
+            }
+        return report
+
+    def game_report(self, game_id):
+        """Report sent for the debug_stats command: the game and the process, without other games"""
+        metrics = self.games.get(game_id)
+        return {
+            'game': metrics.report() if metrics is not None else None,
+            'process': self.report(include_games=False)
+        }
+
+
+# Game loop metrics of this process, None unless PONG_LOOP_METRICS is on
+loop_metrics = LoopMetrics() if getattr(settings, 'PONG_LOOP_METRICS', False) else None
@@ -0,0 +1,70 @@
+import json
+from django.core.management.base import BaseCommand
+from pong_game import game_logic
+from pong_game.benchmarks import run_suite
+from pong_game.scheduler import PHYSICS_RATE
+
+
+class Command(BaseCommand):
+    help = "Benchmark suite for the game physics hot path (no database access)"
+
+    # The benchmark never touches the database, so skip the system checks
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=200, help='Number of synthetic games')
+        parser.add_argument('--ticks', type=int, default=2400, help='Scheduler ticks per difficulty')
+        parser.add_argument('--difficulty', action='append', choices=list(game_logic.DIFFICULTY_SETTINGS),
+                            help='Difficulty to run (repeatable), defaults to all')
+        parser.add_argument('--tick-rate', type=int, default=PHYSICS_RATE, help='Physics rate in Hz')
+        parser.add_argument('--batch', action='store_true', help='Step with the vectorized NumPy engine')
+        parser.add_argument('--swept', action='store_true',
+                            help='Use swept collisions (try with --tick-rate 60 or 120)')
+        parser.add_argument('--analytic', action='store_true',
+                            help='Use event-driven analytic physics (one scheduler tick per broadcast)')
+        parser.add_argument('--allocation-ticks', type=int, default=200,
+                            help='Scheduler ticks traced for allocation counts')
+        parser.add_argument('--function-iterations', type=int, default=100000,
+                            help='Calls per function for the function timings')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+        parser.add_argument('--output', help='Also write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        results = run_suite(
+            games=options['games'],
+            ticks=options['ticks'],
+            difficulties=options['difficulty'],
+            batch=options['batch'],
+            tick_rate=options['tick_rate'],
+            allocation_ticks=options['allocation_ticks'],
+            function_iterations=options['function_iterations'],
+            swept=options['swept'],
+            analytic=options['analytic']
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for difficulty, result in results['difficulties'].items():
+            ticks = result['ticks']
+            allocations = result['allocations']
+            self.stdout.write(
+                f"{difficulty}: {ticks['games']} games x {ticks['ticks'] * ticks['steps_per_tick']} ticks "
+                f"at {ticks['tick_rate']} Hz "
+                f"({ticks['engine']}, {ticks['collisions']}): "
+                f"{ticks['game_ticks_per_sec']:,.0f} game ticks/sec "
+                f"({ticks['game_seconds_per_sec']:,.0f} game seconds/sec), "
+                f"tick p50 {ticks['tick_us']['p50']:.0f} us, p99 {ticks['tick_us']['p99']:.0f} us "
+                f"({ticks['p99_budget_used']:.0%} of budget), "
+                f"{allocations['peak_bytes_per_tick']['mean']:,.0f} B peak/tick, "
+                f"{allocations['net_blocks_per_tick']:.2f} net blocks/tick"
+            )
+            self.stdout.write("    " + ", ".join(
+                f"{name} {timing['us_per_call']:.2f} us"
+                for name, timing in result['functions'].items()
+            ))
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from pong_game.models import GameInputLog
+from pong_game import replay
+
+
+class Command(BaseCommand):
+    help = "Re-simulates a finished game from its stored input log"
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_id', type=int, help='ID of the game to replay')
+
+    def handle(self, *args, **options):
+        try:
+            input_log = GameInputLog.objects.select_related('game').get(game_id=options['game_id'])
+        except GameInputLog.DoesNotExist:
+            raise CommandError(f"Game {options['game_id']} has no input log")
+
+        start = time.perf_counter()
+        game_state = replay.replay_input_log(input_log.data)
+        elapsed = time.perf_counter() - start
+
+        game = input_log.game
+        self.stdout.write(
+            f"Replayed game {game.id}: {game_state.tick} ticks in {elapsed:.3f}s "
+            f"({game_state.tick / input_log.tick_rate / max(elapsed, 1e-9):,.0f}x real time)"
+        )
+        self.stdout.write(
+            f"Matches won: {game_state.match_wins['player1']} - {game_state.match_wins['player2']} "
+            f"(stored: {game.final_score_player1} - {game.final_score_player2}), "
+            f"last match score: {game_state.left_paddle.score} - {game_state.right_paddle.score}"
+        )
+        if game_state.tick != input_log.ticks:
+            self.stdout.write(self.style.WARNING(
+                f"Replay stopped at tick {game_state.tick}, the log covers {input_log.ticks} ticks"
+            ))
@@ -377,6 +377,21 @@ class Game(models.Model):
         return True
 
 
+class GameInputLog(models.Model):
+    """Seed and compressed per-tick input log of a game, used to replay it (see replay.py)"""
+    
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='input_log')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    seed = models.BigIntegerField()
+    tick_rate = models.IntegerField()  # Physics steps per second
+    ticks = models.IntegerField(default=0)  # Physics steps simulated
+    data = models.BinaryField()  # zlib-compressed binary records
+    
+    def __str__(self):
+        return f"Input log of game {self.game_id} ({len(self.data)} bytes)"
+
+
 class Match(models.Model):
     MATCH_STATUS_CHOICES = [
         (StatusChoices.MATCH_IN_PROGRESS, 'In Progress'),
@@ -398,6 +413,10 @@ class Match(models.Model):
     score_player2 = models.IntegerField(default=0)  # Points in this match
     winner = models.CharField(max_length=10, choices=[('player1', 'Player 1'), ('player2', 'Player 2')], null=True, blank=True)
     
+    # Rallies (from the in-memory match ledger)
+    paddle_hits = models.IntegerField(default=0)  # Balls returned in this match
+    longest_rally = models.IntegerField(default=0)  # Most returns before a point
+    
     class Meta:
         unique_together = ('game', 'match_number')
         ordering = ['game', 'match_number']
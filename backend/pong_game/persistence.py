@@ -0,0 +1,358 @@
+"""
+Write-behind persistence of finished games.
+
+Saving a game used to run several synchronous queries (Game.objects.get,
+one Match.objects.create and exists() per match, two PlayerProfile saves)
+through database_sync_to_async while the game loop waited for them, and the
+profile update could run twice for the same game.
+
+Now the end of a game only builds immutable records from the in-memory
+state and hands them to the process-wide ResultWriter:
+
+- GameResult: final scores, winner, the matches of the game's ledger that
+  weren't written yet and whether the players' profiles count the game;
+- MatchRecords: matches that ended while the game goes on
+  (game_logic.save_match_results);
+- InputLogRecord: the input log of a game leaving memory (replay.py), which
+  is compressed in the writer's thread instead of on the event loop.
+
+A background task collects the records for PONG_RESULT_FLUSH_INTERVAL
+seconds (or until PONG_RESULT_BATCH_SIZE are waiting) and writes each batch
+in one transaction with bulk_create/bulk_update and F() increments on the
+profiles. Writing is idempotent per game_id: a game is only claimed while
+its row isn't completed or cancelled yet, so a result enqueued twice (or
+retried after a failed batch) updates the profiles once.
+"""
+import asyncio
+import traceback
+from datetime import datetime, timezone as dt_timezone
+from typing import NamedTuple
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+# Attempts at writing a batch before its records are given up on
+MAX_WRITE_ATTEMPTS = 3
+
+
+class MatchResult(NamedTuple):
+    """One match of a game, from its ledger entry (game_state.MatchLedger)"""
+    match_number: int
+    status: str
+    score_player1: int
+    score_player2: int
+    winner: str  # 'player1', 'player2' or None
+    started_at: float  # time.time() of the first serve
+    completed_at: float  # time.time() of the last point, None if unfinished
+    paddle_hits: int
+    longest_rally: int
+
+
+class GameResult(NamedTuple):
+    """Final result of a game, built when it ends and written later"""
+    game_id: str
+    game_over: bool  # The game was played (or forfeited) to the end
+    winner: str  # 'player1', 'player2' or None
+    match_wins_player1: int
+    match_wins_player2: int
+    completed_at: float  # time.time()
+    matches: tuple  # MatchResult per match not written yet
+    update_profiles: bool  # Count the game in both players' profiles
+
+
+class MatchRecords(NamedTuple):
+    """Matches that ended while their game goes on"""
+    game_id: str
+    matches: tuple  # MatchResult
+
+
+class InputLogRecord(NamedTuple):
+    """Input log of a game leaving memory (see replay.save_input_log)"""
+    game_id: str
+    log: object  # replay.InputLog, no longer written to
+    ticks: int
+
+
+class ResultWriter:
+    """
+    Background writer of GameResult, MatchRecords and InputLogRecord records.
+
+    enqueue() is all the game loop ever calls: a dictionary write and, on
+    first use, starting the writer task. Records are keyed by game so a
+    game enqueued again before its batch is written is only written once.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        if batch_size is None:
+            batch_size = getattr(settings, 'PONG_RESULT_BATCH_SIZE', 50)
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'PONG_RESULT_FLUSH_INTERVAL', 0.5)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        # (record type, game_id[, match number]) -> record, in arrival order
+        self.pending = {}
+        # Failed attempts per pending key
+        self.attempts = {}
+        self.written = 0
+        self.failed = 0
+        self._task = None
+        self._wakeup = None
+        self._idle = None
+
+    def enqueue(self, record):
+        """
+        Queues a record for the next batch.
+
+        Args:
+            record: GameResult, MatchRecords or InputLogRecord
+
+        Returns:
+            True if queued, False if the same record of that game was
+            already waiting
+        """
+        key = _record_key(record)
+        if key in self.pending:
+            return False
+        self.pending[key] = record
+
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._idle.clear()
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def flush(self):
+        """Waits until every queued record has been written (or given up on)"""
+        if self._task is None or self._task.done():
+            return
+        self._wakeup.set()
+        await self._idle.wait()
+
+    async def _run(self):
+        """Writer task: writes batches until nothing is left to write"""
+        try:
+            while self.pending:
+                # Let more records gather unless a full batch is already waiting
+                if len(self.pending) < self.batch_size:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                    except asyncio.TimeoutError:
+                        pass
+
+                keys = list(self.pending)[:self.batch_size]
+                batch = [self.pending[key] for key in keys]
+                try:
+                    await database_sync_to_async(write_batch)(batch)
+                except Exception as e:
+                    print(f"Error writing {len(batch)} game records: {str(e)}")
+                    traceback.print_exc()
+                    for key in keys:
+                        self.attempts[key] = self.attempts.get(key, 0) + 1
+                        if self.attempts[key] >= MAX_WRITE_ATTEMPTS:
+                            print(f"Giving up on {key[0]} of game {key[1]}")
+                            self.pending.pop(key, None)
+                            self.attempts.pop(key)
+                            self.failed += 1
+                    continue
+
+                for key in keys:
+                    self.pending.pop(key, None)
+                    self.attempts.pop(key, None)
+                self.written += len(batch)
+        finally:
+            self._task = None
+            self._idle.set()
+
+
+def _record_key(record):
+    """Key a record is deduplicated with while it waits to be written"""
+    key = (type(record).__name__, record.game_id)
+    if isinstance(record, MatchRecords):
+        # A game can end several matches before they're written
+        key += (record.matches[0].match_number,)
+    return key
+
+
+def _timestamp(value):
+    """Converts a time.time() value to an aware datetime (None stays None)"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def _match_row(game_id, match):
+    """Builds the Match row of a MatchResult"""
+    from .models import Match
+    return Match(
+        game_id=int(game_id),
+        match_number=match.match_number,
+        status=match.status,
+        score_player1=match.score_player1,
+        score_player2=match.score_player2,
+        winner=match.winner,
+        started_at=_timestamp(match.started_at),
+        completed_at=_timestamp(match.completed_at),
+        paddle_hits=match.paddle_hits,
+        longest_rally=match.longest_rally
+    )
+
+
+def write_batch(records):
+    """
+    Writes a batch of records in one transaction.
+
+    Every match of the batch goes into a single bulk_create.
+
+    Args:
+        records: GameResult, MatchRecords and InputLogRecord objects
+    """
+    from django.db import transaction
+    from .models import Game, Match
+    results = [record for record in records if isinstance(record, GameResult)]
+    match_records = [record for record in records if isinstance(record, MatchRecords)]
+    logs = [record for record in records if isinstance(record, InputLogRecord)]
+    with transaction.atomic():
+        matches = []
+        if results:
+            matches.extend(_write_results(results))
+        if match_records:
+            existing = set(Game.objects.filter(
+                id__in=[str(record.game_id) for record in match_records]
+            ).values_list('id', flat=True))
+            for record in match_records:
+                if int(record.game_id) in existing:
+                    matches.extend(_match_row(record.game_id, match) for match in record.matches)
+        if matches:
+            # Matches already written (e.g. by Game.create_new_match) are kept
+            Match.objects.bulk_create(matches, ignore_conflicts=True)
+        if logs:
+            _write_input_logs(logs)
+
+
+def _write_results(results):
+    """
+    Writes game results, skipping games that were already completed or cancelled.
+
+    Returns:
+        Match rows of the written games, for the batch's bulk_create
+    """
+    from django.db.models import Case, F, Value, When
+    from django.db.models.functions import Greatest
+    from django.utils import timezone
+    from .models import Game, PlayerProfile, StatusChoices
+
+    by_id = {str(result.game_id): result for result in results}
+    # Claim the games: only rows that aren't final yet are written, which is
+    # what makes writing a result twice harmless
+    games = list(
+        Game.objects.select_for_update()
+        .filter(id__in=list(by_id))
+        .exclude(status__in=[StatusChoices.COMPLETED, StatusChoices.CANCELLED])
+    )
+    if not games:
+        return []
+
+    now = timezone.now()
+    matches = []
+    profile_updates = []
+    for game in games:
+        result = by_id[str(game.id)]
+        game.status = StatusChoices.COMPLETED
+        if result.winner == 'player1':
+            game.winner_id = game.player1_id
+        elif result.winner == 'player2':
+            game.winner_id = game.player2_id
+        game.final_score_player1 = result.match_wins_player1
+        game.final_score_player2 = result.match_wins_player2
+        game.completed_at = _timestamp(result.completed_at)
+        game.updated_at = now
+
+        matches.extend(_match_row(game.id, match) for match in result.matches)
+
+        if result.update_profiles and game.player2_id is not None:
+            profile_updates.append((game, result))
+
+    Game.objects.bulk_update(games, [
+        'status', 'winner', 'final_score_player1', 'final_score_player2',
+        'completed_at', 'updated_at'
+    ])
+
+    if not profile_updates:
+        return matches
+
+    # Players without a profile yet get one first
+    player_ids = set()
+    for game, _ in profile_updates:
+        player_ids.update((game.player1_id, game.player2_id))
+    existing = set(
+        PlayerProfile.objects.filter(player_id__in=player_ids).values_list('player_id', flat=True)
+    )
+    PlayerProfile.objects.bulk_create(
+        [PlayerProfile(player_id=player_id) for player_id in player_ids - existing],
+        ignore_conflicts=True
+    )
+
+    # Increments computed by the database, so concurrent writers can't lose updates
+    for game, result in profile_updates:
+        if result.match_wins_player1 > result.match_wins_player2:
+            winner_id, loser_id = game.player1_id, game.player2_id
+            experience = 500
+            # Level from the new experience
+            level = (F('experience') + experience) / 1000
+            pure_win = result.match_wins_player2 == 0
+        else:
+            winner_id, loser_id = game.player2_id, game.player1_id
+            experience = 100
+            level = (F('experience') + experience) / (1000 * Greatest(F('level'), 1))
+            pure_win = False
+
+        winner_fields = {
+            'matches_played': F('matches_played') + 1,
+            'matches_won': F('matches_won') + 1,
+            'experience': F('experience') + experience,
+            'level': level,
+            # Achievements (see PlayerProfile.update_achievements)
+            'first_win': Value(True),
+            'triple_win': Case(When(matches_won=2, then=Value(True)), default=F('triple_win'))
+        }
+        if pure_win:
+            winner_fields['pure_win'] = Value(True)
+        PlayerProfile.objects.filter(player_id=winner_id).update(**winner_fields)
+        PlayerProfile.objects.filter(player_id=loser_id).update(
+            matches_played=F('matches_played') + 1,
+            matches_lost=F('matches_lost') + 1
+        )
+    return matches
+
+
+def _write_input_logs(logs):
+    """Compresses and stores input logs, replacing any earlier log of the same game"""
+    from .models import Game, GameInputLog
+
+    game_ids = set(
+        Game.objects.filter(id__in=[str(record.game_id) for record in logs]).values_list('id', flat=True)
+    )
+    rows = [
+        GameInputLog(
+            game_id=int(record.game_id),
+            seed=record.log.seed,
+            tick_rate=record.log.tick_rate,
+            ticks=record.ticks,
+            data=record.log.to_bytes()
+        )
+        for record in logs
+        if int(record.game_id) in game_ids
+    ]
+    GameInputLog.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['game'],
+        update_fields=['seed', 'tick_rate', 'ticks', 'data']
+    )
+
+
+# Single writer shared by every game in this process
+result_writer = ResultWriter()
@@ -0,0 +1,197 @@
+"""
+Physics stepping in separate worker processes.
+
+By default the scheduler advances every game on the daphne event loop, where
+physics competes with websocket I/O, database calls and the GIL. With
+PONG_PHYSICS_PROCESSES > 0 the playing games are split into shards, one per
+worker process, and every scheduler tick becomes one message per shard:
+
+- the front end sends the paddles that moved since the last tick (plus any
+  games entering or leaving the shard) through a pipe;
+- the shard runs the fixed physics steps with its own GameScheduler (scalar
+  or batched, like the front end would) and answers with the ball positions
+  and scores of the games that scored, or of every game on broadcast ticks.
+
+While a game is playing its shard is authoritative for the ball, the scores
+and the game's RNG; everything else (status, players, matches) stays on the
+front end. The RNG state travels with the game when it enters or leaves a
+shard, so a game draws from a single random sequence whichever process steps
+it. Waiting for the answers doesn't block the event loop, so sockets are
+served while the shards compute.
+"""
+import asyncio
+import multiprocessing
+import zlib
+from . import game_logic
+from .physics_shard import run_shard
+
+# How games are assigned to shards
+PLACEMENT_HASH = 'hash'  # stable: crc32(game_id) % shards
+PLACEMENT_LEAST_LOADED = 'least_loaded'  # shard with the fewest games
+
+
+class PhysicsPool:
+    """Front end of the shard processes, used by the scheduler"""
+
+    def __init__(self, processes, tick_rate, placement=PLACEMENT_LEAST_LOADED, batch_physics=False,
+                 swept_collisions=False):
+        self.processes = processes
+        self.tick_rate = tick_rate
+        self.placement = placement
+        self.batch_physics = batch_physics
+        self.swept_collisions = swept_collisions
+        self.connections = []
+        self.workers = []
+        # game_id -> shard index of the games currently loaded in a shard
+        self.assignments = {}
+        # Paddle positions last sent to the shards, only changes are sent
+        self.sent_paddles = {}
+
+    def start(self):
+        """Spawns the shard processes"""
+        # Spawn instead of fork: the front end runs an event loop and threads
+        context = multiprocessing.get_context('spawn')
+        for _ in range(self.processes):
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(
+                target=run_shard,
+                args=(child_conn, self.tick_rate, self.batch_physics, self.swept_collisions),
+                daemon=True
+            )
+            worker.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.workers.append(worker)
+
+    def stop(self):
+        """Stops the shard processes"""
+        for conn in self.connections:
+            try:
+                conn.send(None)
+                conn.close()
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker.join(timeout=1)
+        self.connections = []
+        self.workers = []
+        self.assignments = {}
+        self.sent_paddles = {}
+
+    @property
+    def running(self):
+        return bool(self.workers)
+
+    def _choose_shard(self, game_id):
+        """Picks the shard of a game entering the pool"""
+        if self.placement == PLACEMENT_HASH:
+            return zlib.crc32(str(game_id).encode()) % self.processes
+        loads = [0] * self.processes
+        for shard in self.assignments.values():
+            loads[shard] += 1
+        return loads.index(min(loads))
+
+    async def _receive(self, conn):
+        """Waits for a shard's answer without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = conn.fileno()
+
+        def ready():
+            loop.remove_reader(fd)
+            if future.done():
+                return
+            try:
+                future.set_result(conn.recv())
+            except Exception as e:
+                future.set_exception(e)
+
+        loop.add_reader(fd, ready)
+        try:
+            return await future
+        finally:
+            loop.remove_reader(fd)
+
+    async def step_games(self, game_ids, steps, broadcast_due=True):
+        """
+        Advances the physics of all playing games in the shard processes.
+
+        Args:
+            game_ids: IDs of the games to advance
+            steps: Number of fixed physics steps to run
+            broadcast_due: Whether every game's state must be up to date
+                           afterwards; otherwise only scoring games are
+                           copied back, like the batched engine does
+
+        Returns:
+            Dictionary mapping game IDs to whether a score happened
+        """
+        if not self.running:
+            self.start()
+
+        playing = {}
+        for game_id in game_ids:
+            game_state = game_logic.active_games.get(game_id)
+            if game_state is not None and game_state.game_status == 'playing':
+                playing[game_id] = game_state
+
+        # One message per shard: games leaving, games entering, moved paddles
+        messages = [(steps, broadcast_due, [], [], {}) for _ in range(self.processes)]
+        for game_id in list(self.assignments):
+            if game_id not in playing:
+                messages[self.assignments.pop(game_id)][3].append(game_id)
+                self.sent_paddles.pop(game_id, None)
+        for game_id, game_state in playing.items():
+            paddles = (game_state.left_paddle.y, game_state.right_paddle.y)
+            shard = self.assignments.get(game_id)
+            if shard is None:
+                shard = self.assignments[game_id] = self._choose_shard(game_id)
+                messages[shard][2].append(game_state)
+            elif self.sent_paddles.get(game_id) != paddles:
+                messages[shard][4][game_id] = paddles
+            self.sent_paddles[game_id] = paddles
+
+        for conn, message in zip(self.connections, messages):
+            conn.send(message)
+        answers = await asyncio.gather(*(self._receive(conn) for conn in self.connections))
+
+        results = dict.fromkeys(playing, False)
+        for game_state in playing.values():
+            game_state.tick += steps
+        for shard_results, removed in answers:
+            for game_id, (rng_state, values) in removed.items():
+                # The game left its shard, its RNG continues on the front end
+                game_state = game_logic.active_games.get(game_id)
+                if game_state is not None:
+                    game_state.rng.setstate(rng_state)
+                    _apply_values(game_state, values)
+
+            for game_id, (values, scored) in shard_results.items():
+                game_state = playing.get(game_id)
+                if game_state is not None:
+                    _apply_values(game_state, values)
+                    results[game_id] = scored
+        return results
+
+
+def _apply_values(game_state, values):
+    """Copies the ball, scores and paddle hits computed by a shard into a GameState"""
+    ball = game_state.ball
+    (ball.x, ball.y, ball.dx, ball.dy, ball.speed, ball.prev_x, ball.prev_y,
+     game_state.left_paddle.score, game_state.right_paddle.score, game_state.paddle_hits) = values
+
+
+def create_physics_pool(processes, tick_rate, placement, batch_physics, swept_collisions=False):
+    """
+    Builds a PhysicsPool, or returns None when physics runs in-process.
+
+    Args:
+        processes: Number of shard processes (0 disables the pool)
+        tick_rate: Physics rate in Hz
+        placement: PLACEMENT_HASH or PLACEMENT_LEAST_LOADED
+        batch_physics: Whether shards use the vectorized engine
+        swept_collisions: Whether shards use swept collisions
+    """
+    if processes <= 0:
+        return None
+    return PhysicsPool(processes, tick_rate, placement, batch_physics, swept_collisions)
@@ -0,0 +1,79 @@
+"""
+Entry point of the physics shard processes started by physics_pool.py.
+
+Kept free of module-level Django imports: a spawned process imports this
+module before Django is set up.
+"""
+
+
+def run_shard(conn, tick_rate, batch_physics, swept_collisions=False):
+    """
+    Main loop of a shard process.
+
+    Args:
+        conn: Pipe end connected to the front end
+        tick_rate: Physics rate in Hz
+        batch_physics: Whether the shard uses the vectorized engine
+        swept_collisions: Whether the shard uses swept collisions
+    """
+    import django
+    django.setup()
+    from . import game_logic
+    from .scheduler import GameScheduler
+
+    # In a shard process game_logic.active_games only holds this shard's games
+    games = game_logic.active_games
+    scheduler = GameScheduler(
+        tick_rate=tick_rate, batch_physics=batch_physics, physics_processes=0,
+        swept_collisions=swept_collisions
+    )
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        steps, broadcast_due, adds, removes, paddles = message
+
+        removed = {}
+        if removes and scheduler.batch_engine is not None:
+            # The engine's buffers are ahead of the GameState between broadcasts
+            scheduler.batch_engine.flush()
+        for game_id in removes:
+            game_state = games.pop(game_id, None)
+            if game_state is not None:
+                removed[game_id] = (game_state.rng.getstate(), _values(game_state))
+        for game_state in adds:
+            games[game_state.game_id] = game_state
+
+        for game_id, (left_y, right_y) in paddles.items():
+            game_state = games[game_id]
+            # Moved paddles go through the lag compensation history like on the front end
+            for player_num, y in ((1, left_y), (2, right_y)):
+                if game_state.paddle(player_num).y != y:
+                    game_logic.remember_paddle(game_state, player_num)
+                    game_state.paddle(player_num).y = y
+                    if scheduler.batch_engine is not None:
+                        scheduler.batch_engine.move_paddle(game_id, player_num, y)
+
+        scored = scheduler.step_games(list(games), steps, broadcast_due)
+
+        # Between broadcasts the front end only needs the games that scored
+        results = {
+            game_id: (_values(games[game_id]), game_scored)
+            for game_id, game_scored in scored.items()
+            if game_scored or broadcast_due
+        }
+        conn.send((results, removed))
+
+
+def _values(game_state):
+    """Ball, scores and paddle hits of a game, as sent back to the front end"""
+    ball = game_state.ball
+    return (
+        ball.x, ball.y, ball.dx, ball.dy, ball.speed, ball.prev_x, ball.prev_y,
+        game_state.left_paddle.score, game_state.right_paddle.score, game_state.paddle_hits
+    )
@@ -0,0 +1,128 @@
+"""
+Adaptive per-game rates.
+
+The physics rate is shared by every game (PONG_PHYSICS_RATE) so inputs,
+replays and the analytic mode all agree on what a tick is. What adapts is how
+often the scheduler and the broadcasts run:
+
+- when no game is playing, the scheduler clock only ticks at PONG_IDLE_RATE,
+  and games in waiting/menu/matchOver only get their callback at that rate
+  while other games are playing;
+- a playing game is broadcast at the rate configured for its difficulty
+  (PONG_BROADCAST_RATES), lowered while one of its players has a slow
+  connection: a high smoothed round-trip time (reported by the client with
+  its pings) or a backlog of frames that couldn't be written yet (reported
+  by the socket layer through report_client).
+
+Both players of a game get the same frames (they are encoded and serialized
+once), so the slowest player sets the rate of the game.
+"""
+from django.conf import settings
+
+# Smoothing factor of the round-trip time average
+RTT_SMOOTHING = 0.25
+# Never broadcast a playing game slower than this (Hz)
+MIN_BROADCAST_RATE = 10
+
+
+class ClientConditions:
+    """Connection measurements of one player socket"""
+
+    __slots__ = ('rtt', 'backlog')
+
+    def __init__(self):
+        self.rtt = None  # Smoothed round-trip time in ms
+        self.backlog = 0  # Frames waiting to be written to the socket
+
+    def slowdown(self):
+        """
+        Factor the broadcast rate is divided by for this client.
+
+        Returns:
+            1 for a healthy connection, 2 when slow, 4 when very slow
+        """
+        factor = 1
+        slow_rtt = getattr(settings, 'PONG_SLOW_CLIENT_RTT', 150)
+        if self.rtt is not None and self.rtt > slow_rtt:
+            factor = 2 if self.rtt <= 2 * slow_rtt else 4
+        slow_backlog = getattr(settings, 'PONG_SLOW_CLIENT_BACKLOG', 4)
+        if self.backlog > slow_backlog:
+            factor = max(factor, 2 if self.backlog <= 2 * slow_backlog else 4)
+        return factor
+
+
+# Measurements of the players of the games owned here: game_id -> {player_num: ClientConditions}
+client_conditions = {}
+
+
+def report_client(game_id, player_num, rtt=None, backlog=None):
+    """
+    Records a measurement of a player's connection.
+
+    Args:
+        game_id: The ID of the game
+        player_num: Which player (1 or 2)
+        rtt: Round-trip time in milliseconds, averaged with previous reports
+        backlog: Number of frames currently waiting to be written
+    """
+    conditions = client_conditions.setdefault(game_id, {})
+    client = conditions.get(player_num)
+    if client is None:
+        client = conditions[player_num] = ClientConditions()
+    if rtt is not None:
+        if client.rtt is None:
+            client.rtt = rtt
+        else:
+            client.rtt += (rtt - client.rtt) * RTT_SMOOTHING
+    if backlog is not None:
+        client.backlog = backlog
+
+
+def forget_client(game_id, player_num):
+    """Drops the measurements of a player whose socket closed"""
+    conditions = client_conditions.get(game_id)
+    if conditions is not None:
+        conditions.pop(player_num, None)
+        if not conditions:
+            del client_conditions[game_id]
+
+
+def forget_game(game_id):
+    """Drops the measurements of a game leaving memory"""
+    client_conditions.pop(game_id, None)
+
+
+def idle_rate():
+    """Scheduler rate (Hz) when games aren't playing"""
+    return getattr(settings, 'PONG_IDLE_RATE', 4)
+
+
+def broadcast_rate(game_state, base_rate):
+    """
+    Broadcast rate of a playing game.
+
+    Args:
+        game_state: The GameState
+        base_rate: Rate of the scheduler's broadcast ticks (Hz)
+
+    Returns:
+        Broadcast rate in Hz, at most base_rate
+    """
+    rates = getattr(settings, 'PONG_BROADCAST_RATES', {})
+    rate = min(base_rate, rates.get(game_state.difficulty, base_rate))
+
+    conditions = client_conditions.get(game_state.game_id)
+    if conditions:
+        rate /= max(client.slowdown() for client in conditions.values())
+    return min(base_rate, max(MIN_BROADCAST_RATE, rate))
+
+
+def broadcast_divisor(game_state, base_rate):
+    """
+    Number of scheduler broadcast ticks per broadcast of a game.
+
+    Args:
+        game_state: The GameState
+        base_rate: Rate of the scheduler's broadcast ticks (Hz)
+    """
+    return max(1, round(base_rate / broadcast_rate(game_state, base_rate)))
@@ -0,0 +1,216 @@
+"""
+Game registry: which worker owns which game.
+
+The authoritative GameState of a running game lives in the memory
+(game_logic.active_games) of exactly one worker, its owner. The registry
+records that ownership so several daphne workers can serve the same games:
+
+- the first worker a player of a game connects to claims the game and runs it;
+- a player connected to another worker is relayed: its inputs are forwarded
+  to the owner's inbox channel and it receives frames through the channel
+  layer group of the game;
+- the REST views read game summaries from the registry instead of reaching
+  into active_games, so they work on any worker.
+
+InProcessGameRegistry is the single-worker implementation (the default);
+RedisGameRegistry shares ownership and summaries between workers.
+"""
+import json
+import os
+import socket
+from django.conf import settings
+from . import game_logic
+
+# Identifies this worker process in ownership records
+WORKER_ID = os.getenv("PONG_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Ownership and summaries expire unless the owner keeps publishing them
+OWNER_TTL = 30  # seconds
+SUMMARY_TTL = 30  # seconds
+
+
+def summarize_game(game_state):
+    """
+    Builds the JSON-safe summary of a game used by the REST views.
+
+    Args:
+        game_state: The GameState to summarize
+
+    Returns:
+        Dictionary with positions, scores, status and players
+    """
+    return {
+        'game_id': game_state.game_id,
+        'owner': WORKER_ID,
+        'players': {
+            'player1': game_state.players['player1'].id,
+            'player2': game_state.players['player2'].id
+        },
+        'ball_position': [game_state.ball.x, game_state.ball.y],
+        'left_paddle_position': game_state.left_paddle.y,
+        'right_paddle_position': game_state.right_paddle.y,
+        'scores': {
+            'left': game_state.left_paddle.score,
+            'right': game_state.right_paddle.score
+        },
+        'match_wins': dict(game_state.match_wins),
+        'current_match': game_state.current_match,
+        'status': game_state.game_status,
+        'difficulty': game_state.difficulty
+    }
+
+
+class InProcessGameRegistry:
+    """Registry for a single worker: this process owns every game"""
+
+    is_distributed = False
+
+    def __init__(self):
+        self.owners = {}
+
+    def claim(self, game_id, inbox):
+        """
+        Claims a game for this worker unless another worker owns it.
+
+        Args:
+            game_id: The ID of the game
+            inbox: Channel name where the owner receives forwarded inputs
+
+        Returns:
+            Ownership record {'worker': ..., 'inbox': ...} of the owner
+        """
+        return self.owners.setdefault(game_id, {'worker': WORKER_ID, 'inbox': inbox})
+
+    def owner(self, game_id):
+        """Returns the ownership record of a game, or None"""
+        return self.owners.get(game_id)
+
+    def release(self, game_id):
+        """Forgets a game that ended on its owner"""
+        self.owners.pop(game_id, None)
+
+    def publish(self, summaries):
+        """Nothing to share, summaries are built from active_games on demand"""
+
+    def get_summary(self, game_id):
+        """
+        Returns the summary of a running game.
+
+        Args:
+            game_id: The ID of the game
+
+        Returns:
+            Summary dictionary, or None if the game isn't running
+        """
+        game_state = game_logic.active_games.get(game_id)
+        if game_state is None:
+            return None
+        return summarize_game(game_state)
+
+    def games_for_player(self, user_id):
+        """
+        Returns the summaries of every running game of a player.
+
+        Args:
+            user_id: The ID of the player
+
+        Returns:
+            List of summary dictionaries
+        """
+        return [
+            summarize_game(game_state)
+            for game_state in list(game_logic.active_games.values())
+            if str(user_id) in (str(game_state.players['player1'].id),
+                                str(game_state.players['player2'].id))
+        ]
+
+
+class RedisGameRegistry:
+    """Registry shared by every worker through Redis"""
+
+    is_distributed = True
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _owner_key(game_id):
+        return f"pong:game:{game_id}:owner"
+
+    @staticmethod
+    def _summary_key(game_id):
+        return f"pong:game:{game_id}:summary"
+
+    @staticmethod
+    def _player_key(user_id):
+        return f"pong:player:{user_id}:games"
+
+    def claim(self, game_id, inbox):
+        """Atomically claims a game (SET NX), or returns the current owner"""
+        record = {'worker': WORKER_ID, 'inbox': inbox}
+        for _ in range(2):
+            if self.redis.set(self._owner_key(game_id), json.dumps(record), nx=True, ex=OWNER_TTL):
+                return record
+            existing = self.redis.get(self._owner_key(game_id))
+            if existing is not None:
+                return json.loads(existing)
+            # The previous owner expired between SET and GET, try again
+        return record
+
+    def owner(self, game_id):
+        """Returns the ownership record of a game, or None"""
+        existing = self.redis.get(self._owner_key(game_id))
+        return json.loads(existing) if existing is not None else None
+
+    def release(self, game_id):
+        """Removes ownership, summary and player index entries of a game"""
+        summary = self.get_summary(game_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(self._owner_key(game_id), self._summary_key(game_id))
+        if summary:
+            for user_id in summary['players'].values():
+                pipe.srem(self._player_key(user_id), game_id)
+        pipe.execute()
+
+    def publish(self, summaries):
+        """
+        Stores game summaries and refreshes ownership, in one round trip.
+
+        Args:
+            summaries: Summary dictionaries of games owned by this worker
+        """
+        pipe = self.redis.pipeline()
+        for summary in summaries:
+            game_id = summary['game_id']
+            pipe.set(self._summary_key(game_id), json.dumps(summary), ex=SUMMARY_TTL)
+            pipe.expire(self._owner_key(game_id), OWNER_TTL)
+            for user_id in summary['players'].values():
+                pipe.sadd(self._player_key(user_id), game_id)
+                pipe.expire(self._player_key(user_id), SUMMARY_TTL)
+        pipe.execute()
+
+    def get_summary(self, game_id):
+        """Returns the last published summary of a game, or None"""
+        summary = self.redis.get(self._summary_key(game_id))
+        return json.loads(summary) if summary is not None else None
+
+    def games_for_player(self, user_id):
+        """Returns the published summaries of every running game of a player"""
+        game_ids = list(self.redis.smembers(self._player_key(user_id)))
+        if not game_ids:
+            return []
+        summaries = self.redis.mget([self._summary_key(game_id) for game_id in game_ids])
+        return [json.loads(summary) for summary in summaries if summary is not None]
+
+
+def create_game_registry():
+    """Builds the registry selected by the PONG_GAME_REGISTRY setting"""
+    backend = getattr(settings, 'PONG_GAME_REGISTRY', 'memory')
+    if backend == 'redis':
+        return RedisGameRegistry(getattr(settings, 'PONG_REDIS_URL', 'redis://redis:6379/1'))
+    return InProcessGameRegistry()
+
+
+# Registry shared by the consumers, the scheduler callbacks and the views
+game_registry = create_game_registry()
@@ -0,0 +1,332 @@
+"""
+Input logs and headless replays.
+
+Every game has its own seeded RNG (GameState.seed), so the simulation is
+fully determined by the seed, the difficulty and what the players did. While
+a game runs, its inputs are recorded with the physics tick they apply to:
+
+- paddle positions (left/right);
+- match ends (check_match_end succeeded), new matches and the game end.
+
+GameState.tick only advances while the game is playing, so a replay doesn't
+need to know about pauses between matches. The log is a sequence of
+fixed-size binary records, zlib-compressed and stored in a GameInputLog row
+linked to the Game (written behind by persistence.py). replay_input_log re-simulates a finished game headlessly,
+much faster than real time.
+"""
+import struct
+import zlib
+from . import game_logic, persistence
+
+# Header: magic, format version, seed, physics rate (Hz), difficulty, flags,
+# lag compensation ticks
+LOG_MAGIC = b'PGIL'
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct('<4sBIHBBH')
+
+# Header flags
+FLAG_SWEPT_COLLISIONS = 0x01
+FLAG_ANALYTIC_PHYSICS = 0x02
+
+# Record kinds
+LEFT_PADDLE = 1
+RIGHT_PADDLE = 2
+MATCH_END = 3
+NEW_MATCH = 4
+GAME_END = 5
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+# Paddle positions are kept in hundredths of a pixel so the log can store
+# them as small integers and the replay gets the exact same floats back
+POSITION_SCALE = 100
+
+
+def quantize_position(position):
+    """Rounds a paddle position to the precision recorded in input logs"""
+    return round(float(position) * POSITION_SCALE) / POSITION_SCALE
+
+
+def _write_varint(buffer, value):
+    """Appends an unsigned LEB128 varint"""
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, offset):
+    """Reads an unsigned LEB128 varint, returns (value, next offset)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+class InputLog:
+    """
+    Binary input log of one running game.
+
+    Each record is a kind byte and the tick delta since the previous record
+    as a varint; paddle records add the zigzag varint difference to that
+    paddle's previous position (in hundredths of a pixel). Small paddle moves
+    take a few bytes before compression.
+    """
+
+    __slots__ = ('seed', 'tick_rate', 'difficulty', 'swept_collisions', 'analytic_physics',
+                 'lag_ticks', 'records', 'last_tick', 'positions')
+
+    def __init__(self, seed, tick_rate, difficulty, swept_collisions=False, analytic_physics=False,
+                 lag_ticks=0):
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.difficulty = difficulty
+        self.swept_collisions = swept_collisions
+        self.analytic_physics = analytic_physics
+        self.lag_ticks = lag_ticks
+        self.records = bytearray()
+        self.last_tick = 0
+        self.positions = {LEFT_PADDLE: 0, RIGHT_PADDLE: 0}
+
+    def record(self, tick, kind, value=0.0):
+        """
+        Appends a record.
+
+        Args:
+            tick: Physics tick the input applies to (GameState.tick)
+            kind: Record kind (LEFT_PADDLE, RIGHT_PADDLE, MATCH_END, ...)
+            value: Paddle position for paddle records (see quantize_position)
+        """
+        records = self.records
+        records.append(kind)
+        _write_varint(records, tick - self.last_tick)
+        self.last_tick = tick
+
+        if kind in self.positions:
+            position = round(value * POSITION_SCALE)
+            delta = position - self.positions[kind]
+            self.positions[kind] = position
+            # Zigzag: small negative and positive moves both stay short
+            _write_varint(records, delta * 2 if delta >= 0 else -delta * 2 - 1)
+
+    def to_bytes(self):
+        """Returns the compressed log: header followed by every record"""
+        header = LOG_HEADER.pack(
+            LOG_MAGIC, LOG_VERSION, self.seed, self.tick_rate,
+            DIFFICULTIES.index(self.difficulty),
+            (FLAG_SWEPT_COLLISIONS if self.swept_collisions else 0) |
+            (FLAG_ANALYTIC_PHYSICS if self.analytic_physics else 0),
+            self.lag_ticks
+        )
+        return zlib.compress(header + bytes(self.records), 9)
+
+
+def decode_input_log(data):
+    """
+    Decompresses and parses an input log.
+
+    Args:
+        data: Bytes produced by InputLog.to_bytes
+
+    Returns:
+        Tuple (header dict, list of (tick, kind, value) records)
+    """
+    raw = zlib.decompress(bytes(data))
+    if len(raw) < LOG_HEADER.size:
+        raise ValueError("Not a supported game input log")
+    magic, version, seed, tick_rate, difficulty, flags, lag_ticks = LOG_HEADER.unpack_from(raw)
+    if magic != LOG_MAGIC or version != LOG_VERSION:
+        raise ValueError("Not a supported game input log")
+    header = {
+        'seed': seed,
+        'tick_rate': tick_rate,
+        'difficulty': DIFFICULTIES[difficulty],
+        'swept_collisions': bool(flags & FLAG_SWEPT_COLLISIONS),
+        'analytic_physics': bool(flags & FLAG_ANALYTIC_PHYSICS),
+        'lag_ticks': lag_ticks
+    }
+
+    records = []
+    positions = {LEFT_PADDLE: 0, RIGHT_PADDLE: 0}
+    tick = 0
+    offset = LOG_HEADER.size
+    while offset < len(raw):
+        kind = raw[offset]
+        delta, offset = _read_varint(raw, offset + 1)
+        tick += delta
+        value = 0.0
+        if kind in positions:
+            zigzag, offset = _read_varint(raw, offset)
+            positions[kind] += (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1)
+            value = positions[kind] / POSITION_SCALE
+        records.append((tick, kind, value))
+    return header, records
+
+
+# Input logs of the games in active_games, keyed by game ID
+input_logs = {}
+
+
+def start_input_log(game_state, tick_rate, swept_collisions=False, analytic_physics=False):
+    """Starts recording the inputs of a game that was just created"""
+    input_logs[game_state.game_id] = InputLog(
+        game_state.seed, tick_rate, game_state.difficulty, swept_collisions, analytic_physics,
+        game_state.lag_ticks
+    )
+
+
+def record_input(game_id, kind, value=0.0):
+    """
+    Records an input of a running game at its current tick.
+
+    Args:
+        game_id: The ID of the game
+        kind: Record kind
+        value: Paddle position for paddle records
+    """
+    log = input_logs.get(game_id)
+    game_state = game_logic.active_games.get(game_id)
+    if log is None or game_state is None:
+        return
+    log.record(game_state.tick, kind, value)
+
+
+def record_paddle(game_id, player_num):
+    """Records the current position of a player's paddle"""
+    game_state = game_logic.active_games.get(game_id)
+    if game_state is None:
+        return
+    kind = LEFT_PADDLE if player_num == 1 else RIGHT_PADDLE
+    record_input(game_id, kind, game_state.paddle(player_num).y)
+
+
+def save_input_log(game_id):
+    """
+    Queues the input log of a game that is leaving memory and forgets it.
+
+    The log is compressed and stored by the write-behind writer
+    (persistence.result_writer), off the event loop.
+
+    Args:
+        game_id: The ID of the game
+
+    Returns:
+        Boolean indicating if the log was queued
+    """
+    log = input_logs.pop(game_id, None)
+    game_state = game_logic.active_games.get(game_id)
+    if log is None or game_state is None or game_state.tick == 0:
+        # Nothing was simulated, there is nothing to replay
+        return False
+    log.record(game_state.tick, GAME_END)
+    return persistence.result_writer.enqueue(
+        persistence.InputLogRecord(game_id, log, game_state.tick)
+    )
+
+
+def discard_input_log(game_id):
+    """Forgets the input log of a game without saving it"""
+    input_logs.pop(game_id, None)
+
+
+def _apply_record(game_id, game_state, kind, value):
+    """
+    Applies one recorded input to a replayed game.
+
+    Returns:
+        False once the game has ended, True otherwise
+    """
+    if kind == LEFT_PADDLE:
+        game_logic.remember_paddle(game_state, 1)
+        game_state.left_paddle.y = value
+        game_state.trajectory = None
+    elif kind == RIGHT_PADDLE:
+        game_logic.remember_paddle(game_state, 2)
+        game_state.right_paddle.y = value
+        game_state.trajectory = None
+    elif kind == MATCH_END:
+        game_logic.check_match_end(game_id)
+    elif kind == NEW_MATCH:
+        game_logic.reset_for_new_match(game_id)
+        game_state.game_status = 'playing'
+    elif kind == GAME_END:
+        return False
+    return True
+
+
+def _replay_analytic(game_id, game_state, records, tick_rate, on_tick):
+    """Replays a game played with analytic physics, one jump per record"""
+    for tick, kind, value in records:
+        if game_state.game_status == 'playing' and tick > game_state.tick:
+            game_logic.advance_ball_analytic(game_id, tick, tick_rate)
+            if on_tick is not None:
+                on_tick(game_state)
+        if not _apply_record(game_id, game_state, kind, value):
+            break
+    return game_state
+
+
+def replay_input_log(data, on_tick=None):
+    """
+    Re-simulates a game from its input log, as fast as possible.
+
+    The game is stepped in game_logic.active_games under a private key, so
+    run replays outside the game server process (e.g. the replay_game
+    management command).
+
+    Args:
+        data: Compressed input log (GameInputLog.data)
+        on_tick: Optional callable on_tick(game_state) after each physics step
+                 (after each jump to a record for analytic physics)
+
+    Returns:
+        The final GameState
+    """
+    header, records = decode_input_log(data)
+    game_id = f"replay-{header['seed']}"
+    game_state = game_logic.create_game_state(game_id, {
+        'difficulty': header['difficulty'],
+        'player1_id': None,
+        'player2_id': None,
+        'player1_username': 'player1',
+        'player2_username': 'player2',
+        'seed': header['seed']
+    })
+    game_state.game_status = 'playing'
+    game_logic.enable_lag_compensation(game_state, header['lag_ticks'])
+    delta_time = 1 / header['tick_rate']
+    # Replay with the collision mode the game was played with
+    update_physics = (
+        game_logic.update_game_physics_swept if header['swept_collisions']
+        else game_logic.update_game_physics
+    )
+
+    game_logic.active_games[game_id] = game_state
+    try:
+        if header['analytic_physics']:
+            return _replay_analytic(game_id, game_state, records, header['tick_rate'], on_tick)
+
+        index = 0
+        while True:
+            # Apply everything recorded for this tick, in recorded order
+            while index < len(records) and records[index][0] <= game_state.tick:
+                _, kind, value = records[index]
+                index += 1
+                if not _apply_record(game_id, game_state, kind, value):
+                    return game_state
+
+            # Out of records, or stuck between matches with nothing left to apply
+            if index >= len(records) or game_state.game_status != 'playing':
+                return game_state
+
+            update_physics(game_id, delta_time)
+            game_state.tick += 1
+            if on_tick is not None:
+                on_tick(game_state)
+    finally:
+        game_logic.active_games.pop(game_id, None)
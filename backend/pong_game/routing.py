@@ -1,8 +1,9 @@
 from django.urls import re_path
 from .consumers import MatchmakingConsumer
-from .game_consumers import GameConsumer
+from .game_consumers import GameConsumer, SpectatorConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/matchmaking/$', MatchmakingConsumer.as_asgi()),
     re_path(r'ws/game/(?P<game_id>[^/]+)/$', GameConsumer.as_asgi()),
+    re_path(r'ws/game/(?P<game_id>[^/]+)/spectate/$', SpectatorConsumer.as_asgi()),
 ]
\ No newline at end of file
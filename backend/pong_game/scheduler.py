@@ -0,0 +1,439 @@
+import asyncio
+import time
+import traceback
+from django.conf import settings
+from . import game_logic, rates, replay
+from .batch_physics import BatchPhysicsEngine
+from .loop_metrics import loop_metrics
+from .physics_pool import create_physics_pool, PLACEMENT_LEAST_LOADED
+
+# Shared clock rates
+PHYSICS_RATE = 240  # Hz
+BROADCAST_RATE = 60  # Hz
+MAX_UPDATES_PER_FRAME = 5  # Limit catch-up steps to prevent CPU spikes
+# Below this many playing games the fixed NumPy overhead outweighs batching
+BATCH_MIN_GAMES = 32
+
+
+class GameScheduler:
+    """
+    Process-wide scheduler that steps every registered game on one shared
+    fixed-rate clock.
+
+    Instead of one asyncio task per game, a single driver task wakes up
+    PHYSICS_RATE times per second, advances the physics of every game that is
+    currently playing and then hands each game to its registered callback so
+    the consumer can handle scoring, match end and broadcasting. Paddle
+    inputs are queued (queue_paddle) and applied at the start of the next
+    tick. When no game is playing the clock slows down to the idle rate
+    (see rates.py) until wake() is called.
+
+    The physics is advanced by game_logic.update_game_physics, or depending
+    on the settings by its swept variant (PONG_SWEPT_COLLISIONS), a
+    BatchPhysicsEngine (PONG_BATCH_PHYSICS, batch_physics.py) or shard
+    processes (PONG_PHYSICS_PROCESSES, physics_pool.py). With
+    PONG_ANALYTIC_PHYSICS games aren't stepped at all and the driver only
+    wakes up when a broadcast is due (game_logic.advance_ball_analytic).
+    """
+
+    def __init__(self, tick_rate=None, broadcast_rate=BROADCAST_RATE,
+                 max_updates_per_frame=MAX_UPDATES_PER_FRAME, batch_physics=None,
+                 physics_processes=None, swept_collisions=None, analytic_physics=None):
+        if tick_rate is None:
+            tick_rate = getattr(settings, 'PONG_PHYSICS_RATE', PHYSICS_RATE)
+        self.tick_rate = tick_rate
+        self.tick_interval = 1 / tick_rate
+        # Broadcast every N ticks so broadcasts stay aligned with the clock
+        self.broadcast_every = max(1, round(tick_rate / broadcast_rate))
+        self.broadcast_rate = tick_rate / self.broadcast_every
+        self.max_updates_per_frame = max_updates_per_frame
+        self.tick_count = 0
+        self._callbacks = {}
+        self._task = None
+        self._wakeup = None
+
+        if analytic_physics is None:
+            analytic_physics = getattr(settings, 'PONG_ANALYTIC_PHYSICS', False)
+        self.analytic_physics = bool(analytic_physics)
+        # Analytic games only need the clock when a broadcast is due
+        self.wake_ticks = self.broadcast_every if self.analytic_physics else 1
+        # Callbacks of games that aren't playing run every N clock ticks
+        self.idle_every = max(1, round(tick_rate / self.wake_ticks / rates.idle_rate()))
+        self._wake_time = 0.0
+        # Ticks analytic games were already advanced since the last wakeup,
+        # and games that scored while doing so
+        self._synced = {}
+        self._pending_scores = set()
+
+        # Latest paddle target per (game_id, player_num) since the last tick,
+        # with the tick offset it arrived at and the client's sequence number
+        # and timestamp: {key: (position, offset, seq, sent_at)}
+        self._pending_inputs = {}
+        # Paddle inputs per game: game_id -> [applied, coalesced]
+        self.input_stats = {}
+
+        if swept_collisions is None:
+            swept_collisions = getattr(settings, 'PONG_SWEPT_COLLISIONS', False)
+        self.swept_collisions = bool(swept_collisions)
+        self.update_physics = (
+            game_logic.update_game_physics_swept if self.swept_collisions
+            else game_logic.update_game_physics
+        )
+
+        # Lag compensation window of new games, in physics ticks
+        self.lag_ticks = 0
+        if not self.analytic_physics:
+            # Analytic games keep no per-tick paddle positions to test against
+            lag_ms = getattr(settings, 'PONG_LAG_COMPENSATION_MS', 0)
+            self.lag_ticks = max(0, round(lag_ms / 1000 * tick_rate))
+
+        if batch_physics is None:
+            batch_physics = getattr(settings, 'PONG_BATCH_PHYSICS', False)
+        if self.lag_ticks:
+            # The vectorized engine only knows the current paddle positions
+            batch_physics = False
+        self.batch_engine = None
+        # The vectorized engine mirrors the discrete step only
+        if (batch_physics and not self.swept_collisions and not self.analytic_physics and
+                BatchPhysicsEngine.is_available()):
+            self.batch_engine = BatchPhysicsEngine()
+
+        if physics_processes is None:
+            physics_processes = getattr(settings, 'PONG_PHYSICS_PROCESSES', 0)
+        if self.analytic_physics:
+            # Nothing left worth offloading to other processes
+            physics_processes = 0
+        self.physics_pool = create_physics_pool(
+            physics_processes, tick_rate,
+            getattr(settings, 'PONG_PHYSICS_PLACEMENT', PLACEMENT_LEAST_LOADED),
+            bool(batch_physics), self.swept_collisions
+        )
+
+    def register(self, game_id, callback):
+        """
+        Registers a game with the scheduler and starts the driver if needed.
+
+        Args:
+            game_id: The ID of the game
+            callback: Coroutine function called once per tick as
+                      callback(current_time, score_happened, broadcast_due)
+
+        Returns:
+            True if the game was registered, False if it already was
+        """
+        if game_id in self._callbacks:
+            return False
+
+        self._callbacks[game_id] = callback
+        if game_id in game_logic.active_games:
+            game_logic.active_games[game_id].loop_running = True
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    def unregister(self, game_id):
+        """
+        Removes a game from the scheduler.
+
+        Args:
+            game_id: The ID of the game
+        """
+        self._callbacks.pop(game_id, None)
+        if game_id in game_logic.active_games:
+            game_logic.active_games[game_id].loop_running = False
+
+    def wake(self):
+        """Ends an idle wait right away, call it when a game starts playing"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def is_registered(self, game_id):
+        """Checks if a game is currently driven by the scheduler"""
+        return game_id in self._callbacks
+
+    def step_games(self, game_ids, steps, broadcast_due=True):
+        """
+        Advances the physics of all playing games by a number of fixed steps.
+
+        Args:
+            game_ids: IDs of the games to advance
+            steps: Number of fixed physics steps to run
+            broadcast_due: Whether every game's state must be up to date
+                           afterwards (only relevant for batched physics)
+
+        Returns:
+            Dictionary mapping game IDs to whether a score happened
+        """
+        playing = []
+        for game_id in game_ids:
+            game_state = game_logic.active_games.get(game_id)
+            if game_state is not None and game_state.game_status == 'playing':
+                playing.append(game_state)
+
+        if self.analytic_physics:
+            return self._step_analytic(playing, steps)
+
+        if self.batch_engine is not None:
+            if len(playing) >= BATCH_MIN_GAMES:
+                return self._step_batch(playing, steps, broadcast_due)
+            # Hand any batched games back to the scalar path
+            self.batch_engine.sync_games([])
+
+        now = time.time()
+        results = {}
+        update_physics = self.update_physics
+        for game_state in playing:
+            game_id = game_state.game_id
+            score_happened = False
+            for _ in range(steps):
+                if update_physics(game_id, self.tick_interval) == 1:
+                    score_happened = True
+                # Per step, lag compensation looks at the tick like a replay does
+                game_state.tick += 1
+            game_state.last_update_time = now
+            results[game_id] = score_happened
+        return results
+
+    def _step_batch(self, playing, steps, broadcast_due):
+        """Advances all playing games with the vectorized engine"""
+        engine = self.batch_engine
+        engine.sync_games(playing)
+
+        scored = None
+        for _ in range(steps):
+            step_scored = engine.step(self.tick_interval) == 1
+            scored = step_scored if scored is None else scored | step_scored
+
+        # Scoring games are handled by their callbacks this tick, and every
+        # game is about to be broadcast on broadcast ticks
+        if broadcast_due:
+            engine.flush()
+        else:
+            engine.flush(scored.nonzero()[0])
+
+        now = time.time()
+        for game_state in playing:
+            game_state.tick += steps
+            game_state.last_update_time = now
+        return dict(zip(engine.game_ids, scored.tolist()))
+
+    def _step_analytic(self, playing, steps):
+        """Advances all playing games in closed form to the current tick"""
+        now = time.time()
+        results = dict.fromkeys(self._pending_scores, True)
+        synced = self._synced
+        tick_rate = self.tick_rate
+        for game_state in playing:
+            game_id = game_state.game_id
+            target_tick = game_state.tick + steps - synced.get(game_id, 0)
+            if game_logic.advance_ball_analytic(game_id, target_tick, tick_rate) == 1:
+                results[game_id] = True
+            elif game_id not in results:
+                results[game_id] = False
+            game_state.last_update_time = now
+        synced.clear()
+        self._pending_scores.clear()
+        return results
+
+    def queue_paddle(self, game_id, player_num, position, seq=None, sent_at=None):
+        """
+        Queues a paddle target, applied at the start of the next clock tick.
+
+        Only the latest target of a player is kept until then, so a client
+        sending faster than the physics rate costs one dictionary write per
+        message instead of a paddle update and an input log record.
+
+        Args:
+            game_id: The ID of the game
+            player_num: Which player (1 or 2)
+            position: Target Y position of the paddle
+            seq: Client sequence number of the input, acknowledged once applied
+            sent_at: Client timestamp of the input (ms), echoed with the ack
+
+        Returns:
+            True if an older target of this tick was replaced
+        """
+        offset = 0
+        if self.analytic_physics and self._task is not None:
+            elapsed = int((asyncio.get_running_loop().time() - self._wake_time) / self.tick_interval)
+            # Never run ahead of what the next wakeup advances
+            offset = min(elapsed, self.wake_ticks - 1)
+
+        key = (game_id, player_num)
+        coalesced = key in self._pending_inputs
+        self._pending_inputs[key] = (position, offset, seq, sent_at)
+
+        stats = self.input_stats.get(game_id)
+        if stats is None:
+            stats = self.input_stats[game_id] = [0, 0]
+        if coalesced:
+            stats[1] += 1
+        return coalesced
+
+    def apply_inputs(self):
+        """Applies the queued paddle targets and records them in the input logs"""
+        if not self._pending_inputs:
+            return
+        pending = self._pending_inputs
+        self._pending_inputs = {}
+
+        items = pending.items()
+        if self.analytic_physics:
+            # In arrival order, each game advanced to the tick its input arrived at
+            items = sorted(items, key=lambda item: item[1][1])
+
+        for (game_id, player_num), (position, offset, seq, sent_at) in items:
+            game_state = game_logic.active_games.get(game_id)
+            if game_state is None:
+                continue
+            if offset:
+                self._advance_analytic(game_state, offset)
+            game_logic.update_paddle_position(game_id, player_num, position)
+            if self.batch_engine is not None:
+                self.batch_engine.move_paddle(game_id, player_num, game_state.paddle(player_num).y)
+            replay.record_paddle(game_id, player_num)
+            if seq is not None:
+                game_state.acks[player_num] = (seq, sent_at)
+            stats = self.input_stats.get(game_id)
+            if stats is not None:
+                stats[0] += 1
+
+    def forget_inputs(self, game_id):
+        """
+        Drops the input counters of a game leaving memory.
+
+        Returns:
+            The [applied, coalesced] counters, or None
+        """
+        return self.input_stats.pop(game_id, None)
+
+    def _advance_analytic(self, game_state, offset):
+        """
+        Brings an analytic game up to a tick offset since the last wakeup,
+        ahead of the rest of the next wakeup.
+        """
+        if game_state.game_status != 'playing':
+            return
+        game_id = game_state.game_id
+        done = self._synced.get(game_id, 0)
+        if offset <= done:
+            return
+        target_tick = game_state.tick + offset - done
+        if game_logic.advance_ball_analytic(game_id, target_tick, self.tick_rate) == 1:
+            # Reported to the game's callback by this wakeup
+            self._pending_scores.add(game_id)
+        self._synced[game_id] = offset
+
+    async def _step_pool(self, game_ids, steps, broadcast_due):
+        """Advances the playing games in the shard processes"""
+        try:
+            return await self.physics_pool.step_games(game_ids, steps, broadcast_due)
+        except Exception as e:
+            # Keep the games running on the event loop if a shard died
+            print(f"Error in physics pool, stepping in-process from now on: {str(e)}")
+            traceback.print_exc()
+            self.physics_pool.stop()
+            self.physics_pool = None
+            return self.step_games(game_ids, steps, broadcast_due)
+
+    async def _run(self):
+        """Driver task: runs until no game is registered anymore"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        self._wakeup = asyncio.Event()
+
+        try:
+            while self._callbacks:
+                # Work out how many physics steps are due since the last tick
+                lateness = loop.time() - next_tick
+                steps = self.wake_ticks + max(0, int(lateness / self.tick_interval))
+                max_steps = self.max_updates_per_frame * self.wake_ticks
+                capped = steps > max_steps
+                if capped:
+                    # Discard the backlog instead of spiraling when the CPU can't keep up
+                    steps = max_steps
+                    next_tick = loop.time() - (steps - self.wake_ticks) * self.tick_interval
+
+                self._wake_time = loop.time()
+                playing = await self._tick(time.time(), steps)
+                if loop_metrics is not None and playing:
+                    loop_metrics.record_tick(loop.time() - self._wake_time, lateness, steps, capped)
+
+                if not playing:
+                    # Nothing to simulate: tick at the idle rate until a game starts
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), 1 / rates.idle_rate())
+                    except asyncio.TimeoutError:
+                        pass
+                    next_tick = loop.time()
+                    continue
+
+                next_tick += steps * self.tick_interval
+                await asyncio.sleep(max(0, next_tick - loop.time()))
+        finally:
+            self._task = None
+            self._wakeup = None
+
+    async def _tick(self, current_time, steps):
+        """
+        Runs a single clock tick for every registered game.
+
+        Returns:
+            Number of games that were playing
+        """
+        self.tick_count += 1
+        broadcast_due = self.analytic_physics or self.tick_count % self.broadcast_every == 0
+
+        # Drop games that were removed from memory without unregistering
+        for game_id in list(self._callbacks):
+            if game_id not in game_logic.active_games:
+                self._callbacks.pop(game_id, None)
+
+        self.apply_inputs()
+
+        if self.physics_pool is not None:
+            results = await self._step_pool(list(self._callbacks), steps, broadcast_due)
+        else:
+            results = self.step_games(list(self._callbacks), steps, broadcast_due)
+
+        # Games that aren't playing are only looked at on idle ticks
+        idle_due = not results or self.tick_count % self.idle_every == 0
+
+        for game_id, callback in list(self._callbacks.items()):
+            if game_id in results:
+                score_happened = results[game_id]
+                # Callbacks only act on scores and broadcasts, skip them otherwise
+                if not score_happened and not broadcast_due:
+                    continue
+                game_broadcast_due = broadcast_due
+            elif idle_due:
+                score_happened = False
+                game_broadcast_due = True
+            else:
+                continue
+            started = time.perf_counter() if loop_metrics is not None else 0.0
+            try:
+                await callback(current_time, score_happened, game_broadcast_due)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in game tick for game {game_id}: {str(e)}")
+                traceback.print_exc()
+                if loop_metrics is not None:
+                    loop_metrics.record_error(game_id)
+            if loop_metrics is not None:
+                loop_metrics.record_callback(
+                    game_id, time.perf_counter() - started, steps if game_id in results else 0
+                )
+        return len(results)
+
+    @property
+    def tick_started(self):
+        """Event loop time the current (or last) tick started at"""
+        return self._wake_time
+
+
+# Single scheduler shared by every game in this process
+game_scheduler = GameScheduler()
@@ -63,7 +63,8 @@ class MatchSerializer(serializers.ModelSerializer):
         model = Match
         fields = ['id', 'match_number', 'status', 
                   'score_player1', 'score_player2', 
-                  'winner', 'created_at', 'completed_at']
+                  'winner', 'created_at', 'started_at', 'completed_at',
+                  'paddle_hits', 'longest_rally']
 
 class GameInviteSerializer(serializers.ModelSerializer):
     sender_username = serializers.CharField(source='sender.player.username', read_only=True)
@@ -0,0 +1,427 @@
+"""
+Spectator mode: ws/game/<game_id>/spectate/.
+
+Players get every broadcast frame of their game; spectators get a slower
+stream (PONG_SPECTATOR_RATE frames per second) of the same snapshot/delta
+frames (frames.py), with their own sequence numbers. Each game watched on a
+worker has one SpectatorFeed:
+
+- on the worker owning the game, GameRunner.tick calls publish() once per
+  tick: at the spectator rate, the frame is encoded by the feed's own
+  FrameEncoder and serialized (JSON text, and packed binary for deltas)
+  once, then appended to the feed's ring of the last PONG_SPECTATOR_QUEUE
+  frames. That's the only work done on the game loop, whatever the number
+  of viewers;
+- every spectator socket has a writer task reading the ring from its own
+  cursor and sending the shared bytes. A viewer that falls a whole ring
+  behind skips to the next keyframe, so a slow viewer costs at most a ring
+  of frames and never slows the game or the other viewers down;
+- spectators connected to another worker are served by a relay feed there:
+  the owner sends each frame once per relaying worker (not per viewer) to
+  the channel of that feed, which fills its own ring. Those sends are
+  queued in the feed's RelaySender and made by its own task, so the game
+  loop never waits for the channel layer either; when the layer falls
+  PONG_SPECTATOR_QUEUE frames behind, the queued frames are dropped and the
+  next frame is a keyframe.
+
+Joining viewers, and viewers that lagged behind, wait for the next frame to
+be a keyframe (the feed forces one). Status changes are sent as keyframes
+too, since deltas only carry the moving parts. The sockets are closed when
+the game leaves the worker: 1000 when it ended, DRAINING_CLOSE_CODE when it
+was handed off to another worker.
+"""
+import asyncio
+import collections
+import json
+import traceback
+from typing import NamedTuple
+from django.conf import settings
+from . import frames
+from .tasks import spawn_detached
+
+# Spectator frames per second
+SPECTATOR_RATE = getattr(settings, 'PONG_SPECTATOR_RATE', 20)
+# Frames kept per feed, i.e. how far behind a viewer may fall before it
+# skips to the next keyframe
+SPECTATOR_QUEUE = getattr(settings, 'PONG_SPECTATOR_QUEUE', 32)
+# Spectators per game and worker
+MAX_SPECTATORS = getattr(settings, 'PONG_MAX_SPECTATORS', 500)
+
+# Close code of spectator sockets over MAX_SPECTATORS
+TOO_MANY_SPECTATORS_CLOSE_CODE = 4029
+
+
+class Frame(NamedTuple):
+    """A spectator frame, serialized once for every viewer"""
+    keyframe: bool
+    text: str  # JSON message
+    binary: bytes  # Packed delta for binary clients, None for keyframes
+
+
+class SpectatorFeed:
+    """
+    Ring of the last spectator frames of one game on this worker.
+
+    Feeds on the owner encode the frames (publish); relay feeds are filled
+    with the frames the owner sends to their channel (push).
+    """
+
+    def __init__(self, game_id, relay=False, size=SPECTATOR_QUEUE):
+        self.game_id = game_id
+        self.relay = relay
+        self.ring = collections.deque(maxlen=size)
+        # Frames pushed so far: ring[i] is frame number published - len(ring) + i
+        self.published = 0
+        self.viewers = set()
+        self.encoder = None if relay else frames.FrameEncoder(keyframe_interval=max(1, SPECTATOR_RATE))
+        self.interval = 1.0 / SPECTATOR_RATE
+        self.next_publish = 0.0
+        self.last_status = None
+        self.keyframe_wanted = True
+        # Owner only: channels of the relay feeds of other workers, and the
+        # sender of the frames queued for them
+        self.relay_channels = set()
+        self.sender = None
+        # Relay only: channel the owner sends to and the task reading it
+        self.channel = None
+        self.reader = None
+        self.close_code = None
+        self._updated = asyncio.Event()
+
+    @property
+    def oldest(self):
+        """Number of the oldest frame still in the ring"""
+        return self.published - len(self.ring)
+
+    def publish(self, game_state, now):
+        """
+        Encodes a frame when one is due (owner feeds, from GameRunner.tick).
+
+        Args:
+            game_state: The GameState of the game
+            now: Scheduler time of the tick
+
+        Returns:
+            The new Frame, or None when no frame was due
+        """
+        status_changed = game_state.game_status != self.last_status
+        if not status_changed:
+            if game_state.game_status != 'playing' and not self.keyframe_wanted:
+                # Nothing moves, nothing to send
+                return None
+            if now < self.next_publish:
+                return None
+        # Kept on the spectator rate's grid, so ticks that don't divide it
+        # evenly still average SPECTATOR_RATE frames per second
+        self.next_publish += self.interval
+        if self.next_publish <= now:
+            self.next_publish = now + self.interval
+        self.last_status = game_state.game_status
+
+        if status_changed or self.keyframe_wanted:
+            self.encoder.force_keyframe()
+            self.keyframe_wanted = False
+        message = self.encoder.encode(game_state)
+        binary = message.pop('binary', None)
+        frame = Frame(message['type'] == 'game_state', json.dumps(message), binary)
+        self.push(frame)
+        return frame
+
+    def push(self, frame):
+        """Appends a frame to the ring and wakes the viewers up"""
+        self.ring.append(frame)
+        self.published += 1
+        self._wake()
+
+    def want_keyframe(self):
+        """Asks for the next frame to be a keyframe (joining or lagging viewer)"""
+        self.keyframe_wanted = True
+
+    def close(self, code):
+        """Ends the feed; the viewers' writers close their sockets with code"""
+        self.close_code = code
+        self._wake()
+
+    def _wake(self):
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def wait(self, position):
+        """Waits until frame number position is published or the feed closes"""
+        while self.published <= position and self.close_code is None:
+            await self._updated.wait()
+
+
+class RelaySender:
+    """
+    Frames of an owner feed waiting to be sent to the relay feeds of other
+    workers, sent by their own task so the game loop never waits for the
+    channel layer.
+    """
+
+    def __init__(self, channel_layer, feed, max_frames=SPECTATOR_QUEUE):
+        self.channel_layer = channel_layer
+        self.feed = feed
+        self.max_frames = max_frames
+        self.queue = collections.deque()
+        self.sent = 0
+        self.dropped = 0
+        self._task = None
+
+    def put(self, frame):
+        """
+        Queues a frame for every relay feed; when the queue is full, what is
+        queued is dropped and the feed's next frame is a keyframe.
+
+        Args:
+            frame: The Frame to send
+        """
+        self.queue.append({
+            'type': 'spectator.frame',
+            'keyframe': frame.keyframe,
+            'text': frame.text,
+            'binary': frame.binary
+        })
+        if len(self.queue) > self.max_frames:
+            # Relayed viewers would miss deltas anyway: start over on a keyframe
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.feed.want_keyframe()
+            return
+        self._start()
+
+    def put_close(self, code):
+        """Tells the relay feeds the game left this worker, after the queued frames"""
+        self.queue.append({'type': 'spectator.close', 'code': code})
+        self._start()
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            # Fresh context, the sender outlives the tick that queued the first frame
+            self._task = spawn_detached(self._run())
+
+    async def _run(self):
+        """Sender task: runs until the queue is empty"""
+        feed = self.feed
+        while self.queue:
+            message = self.queue.popleft()
+            for channel in list(feed.relay_channels):
+                try:
+                    await self.channel_layer.send(channel, message)
+                except Exception as e:
+                    print(f"Error relaying spectator frame of game {feed.game_id}: {str(e)}")
+                    feed.relay_channels.discard(channel)
+            self.sent += 1
+
+
+# Feeds of the games watched on this worker, keyed by game ID
+feeds = {}
+
+
+def publish(channel_layer, game_id, game_state, now):
+    """
+    Publishes the next spectator frame of a game owned by this worker, if
+    it has spectators and a frame is due. Called once per game tick; never
+    waits, frames for other workers are queued.
+
+    Args:
+        channel_layer: The channel layer, for the relay feeds
+        game_id: The ID of the game
+        game_state: The GameState of the game
+        now: Scheduler time of the tick
+    """
+    feed = feeds.get(game_id)
+    if feed is None or feed.relay:
+        return
+    frame = feed.publish(game_state, now)
+    if frame is None or not feed.relay_channels:
+        return
+    if feed.sender is None:
+        feed.sender = RelaySender(channel_layer, feed)
+    feed.sender.put(frame)
+
+
+def add_relay(game_id, channel):
+    """
+    Owner side: starts sending a game's spectator frames to a relay feed.
+
+    Args:
+        game_id: The ID of the game, owned by this worker
+        channel: Channel of the relay feed on the other worker
+    """
+    feed = feeds.get(game_id)
+    if feed is None:
+        feed = feeds[game_id] = SpectatorFeed(game_id)
+    feed.relay_channels.add(channel)
+    feed.want_keyframe()
+
+
+def remove_relay(game_id, channel):
+    """Owner side: stops sending frames to a relay feed"""
+    feed = feeds.get(game_id)
+    if feed is None:
+        return
+    feed.relay_channels.discard(channel)
+    _drop_if_unused(feed)
+
+
+def request_keyframe(game_id):
+    """Owner side: a relay feed has viewers waiting for a keyframe"""
+    feed = feeds.get(game_id)
+    if feed is not None:
+        feed.want_keyframe()
+
+
+async def join(channel_layer, game_id, owner_inbox, local):
+    """
+    Attaches a viewer to the feed of a game, creating the feed on first use.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+        owner_inbox: Inbox of the worker owning the game
+        local: True when this worker owns the game
+
+    Returns:
+        The SpectatorFeed, or None when the game already has MAX_SPECTATORS
+    """
+    feed = feeds.get(game_id)
+    if feed is None:
+        feed = feeds[game_id] = SpectatorFeed(game_id, relay=not local)
+        if feed.relay:
+            feed.channel = await channel_layer.new_channel(prefix="pong.spectate")
+            feed.reader = asyncio.create_task(_read_relay(channel_layer, feed))
+            await channel_layer.send(owner_inbox, {
+                'type': 'game.spectate',
+                'game_id': game_id,
+                'channel': feed.channel
+            })
+    if len(feed.viewers) >= MAX_SPECTATORS:
+        return None
+    return feed
+
+
+async def leave(channel_layer, feed, viewer, owner_inbox):
+    """Detaches a viewer, dropping the feed once nobody watches it"""
+    feed.viewers.discard(viewer)
+    if feed.viewers or feeds.get(feed.game_id) is not feed:
+        return
+    if feed.relay:
+        del feeds[feed.game_id]
+        if feed.reader is not None:
+            feed.reader.cancel()
+        if feed.close_code is None:
+            await channel_layer.send(owner_inbox, {
+                'type': 'game.unspectate',
+                'game_id': feed.game_id,
+                'channel': feed.channel
+            })
+    else:
+        _drop_if_unused(feed)
+
+
+async def want_keyframe(channel_layer, feed, owner_inbox):
+    """Gets a keyframe into a feed soon, asking the owner for relay feeds"""
+    if not feed.relay:
+        feed.want_keyframe()
+        return
+    await channel_layer.send(owner_inbox, {
+        'type': 'game.spectate_keyframe',
+        'game_id': feed.game_id
+    })
+
+
+def close_game(channel_layer, game_id, code):
+    """
+    Closes the feed of a game leaving this worker (ended or handed off) and
+    tells the relay feeds of other workers, once their queued frames are sent.
+
+    Args:
+        channel_layer: The channel layer of this worker
+        game_id: The ID of the game
+        code: Close code for the spectator sockets
+    """
+    feed = feeds.pop(game_id, None)
+    if feed is None:
+        return
+    feed.close(code)
+    if feed.relay_channels:
+        if feed.sender is None:
+            feed.sender = RelaySender(channel_layer, feed)
+        feed.sender.put_close(code)
+
+
+def _drop_if_unused(feed):
+    if not feed.viewers and not feed.relay_channels and feeds.get(feed.game_id) is feed:
+        del feeds[feed.game_id]
+
+
+async def _read_relay(channel_layer, feed):
+    """Relay feed: fills the ring with the frames sent by the owner"""
+    try:
+        while True:
+            message = await channel_layer.receive(feed.channel)
+            if message['type'] == 'spectator.close':
+                if feeds.get(feed.game_id) is feed:
+                    del feeds[feed.game_id]
+                feed.close(message.get('code', 1000))
+                return
+            feed.push(Frame(message['keyframe'], message['text'], message.get('binary')))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Error reading spectator frames of game {feed.game_id}: {str(e)}")
+        traceback.print_exc()
+        feed.close(1011)
+
+
+class Viewer:
+    """Writer of one spectator socket: sends the feed's frames from its own cursor"""
+
+    def __init__(self, feed, consumer):
+        self.feed = feed
+        self.consumer = consumer
+        # Number of the next frame to send
+        self.position = feed.published
+        self.waiting_for_keyframe = True
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    async def run(self, request_keyframe):
+        """
+        Sends frames until the feed closes; returns the close code.
+
+        Args:
+            request_keyframe: Coroutine function getting a keyframe into the feed
+        """
+        feed = self.feed
+        await request_keyframe()
+        while True:
+            await feed.wait(self.position)
+            if feed.published <= self.position and feed.close_code is not None:
+                return feed.close_code
+
+            if self.position < feed.oldest:
+                # A whole ring behind: skip what was lost, resume on a keyframe
+                self.frames_skipped += feed.oldest - self.position
+                self.position = feed.oldest
+                if not self.waiting_for_keyframe:
+                    self.waiting_for_keyframe = True
+                    await request_keyframe()
+
+            while self.position < feed.published:
+                frame = feed.ring[self.position - feed.oldest]
+                self.position += 1
+                if self.waiting_for_keyframe:
+                    if not frame.keyframe:
+                        self.frames_skipped += 1
+                        continue
+                    self.waiting_for_keyframe = False
+                if frame.binary is not None and self.consumer.binary_frames:
+                    await self.consumer.send(bytes_data=frame.binary)
+                else:
+                    await self.consumer.send(text_data=frame.text)
+                self.frames_sent += 1
+                if self.position < feed.oldest:
+                    # Fell behind while sending
+                    break
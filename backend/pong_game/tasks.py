@@ -0,0 +1,32 @@
+"""
+Background tasks that don't belong to whoever starts them.
+
+Timer callbacks, outbox senders and the drain task are started from
+whatever happens to need them first: a consumer, a scheduler tick or a
+request run through async_to_sync. spawn_detached() starts them in a fresh
+context, so they don't inherit that caller's context (and with it the
+request's thread executor), and keeps a reference to each task until it
+finishes: the event loop only holds weak references, so a task nothing
+else refers to could be garbage collected before it is done.
+"""
+import asyncio
+import contextvars
+
+# Tasks started by spawn_detached() that haven't finished yet
+_detached = set()
+
+
+def spawn_detached(coro):
+    """
+    Runs a coroutine as a task detached from the caller.
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        The asyncio Task, referenced here until it is done
+    """
+    task = contextvars.Context().run(asyncio.create_task, coro)
+    _detached.add(task)
+    task.add_done_callback(_detached.discard)
+    return task
@@ -1,3 +1,583 @@
-from django.test import TestCase
+import json
+import random
+import struct
+import zlib
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TransactionTestCase
+from authentication.models import User
+from . import frames, game_consumers, game_logic, persistence, replay, timers
+from .batch_physics import BatchPhysicsEngine
+from .scheduler import BATCH_MIN_GAMES, GameScheduler
+from .models import Game, Match, StatusChoices
 
-# Create your tests here.
+
+class FakeClock:
+    """Stands in for the time module of timers.py"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+class DrivenByTest:
+    """Takes the place of the driver task, so the test advances the wheel"""
+
+    def done(self):
+        return False
+
+
+class TimerWheelTests(SimpleTestCase):
+    """Timers fire on the wheel tick of their deadline, whatever level they start on"""
+
+    def setUp(self):
+        # Not aligned on any slot or level boundary
+        self.clock = FakeClock(12345.67)
+        patcher = mock.patch.object(timers, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wheel = timers.TimerWheel()
+        self.wheel._task = DrivenByTest()
+        self.fired = []
+
+    def schedule(self, delay, name=None):
+        """Schedules a timer recording its name and the wheel tick it fired at"""
+        timer = self.wheel.schedule(delay, self.record, name if name is not None else delay)
+        # Due on the first wheel tick at or after the deadline
+        self.assertGreaterEqual(timer.expires * timers.RESOLUTION, self.clock.now + delay - 1e-6)
+        self.assertLess(timer.expires * timers.RESOLUTION, self.clock.now + delay + timers.RESOLUTION + 1e-6)
+        return timer
+
+    def record(self, name):
+        self.fired.append((name, self.wheel.current_tick))
+
+    def run_until(self, ticks):
+        """Advances the wheel tick by tick, like the driver does"""
+        target = self.wheel.current_tick + ticks
+        while self.wheel.current_tick < target:
+            # Callbacks scheduling timers see the time of the tick they fire at
+            self.clock.now = (self.wheel.current_tick + 1) * timers.RESOLUTION
+            self.wheel._advance()
+
+    def test_fires_across_level_boundaries(self):
+        level0 = timers.SLOTS * timers.RESOLUTION
+        level1 = level0 * timers.SLOTS
+        delays = [0, 0.05, 0.1, level0 - 0.1, level0, level0 + 0.1, 2 * level0 + 0.05,
+                  level1 - 0.1, level1, level1 + 0.1, 3 * level1 + 7.3]
+        expected = {delay: self.schedule(delay).expires for delay in delays}
+
+        self.run_until(round(max(delays) / timers.RESOLUTION) + 2)
+
+        self.assertEqual(dict(self.fired), expected)
+        self.assertEqual(len(self.fired), len(delays))
+        self.assertEqual(self.wheel.count, 0)
+
+    def test_fires_beyond_wheel_range(self):
+        wheel_range = timers.RESOLUTION * timers.SLOTS ** timers.LEVELS
+        delays = [wheel_range - 1, wheel_range + 0.1, 2.5 * wheel_range]
+        expected = {delay: self.schedule(delay).expires for delay in delays}
+
+        self.run_until(round(max(delays) / timers.RESOLUTION) + 2)
+
+        self.assertEqual(dict(self.fired), expected)
+        self.assertEqual(len(self.fired), len(delays))
+
+    def test_schedule_while_running(self):
+        self.schedule(3.0, 'first')
+        self.run_until(17)
+        # Scheduled from a later tick, across the next level 0 turn
+        second = self.schedule(7.0, 'second')
+
+        self.run_until(200)
+
+        self.assertEqual([name for name, _ in self.fired], ['first', 'second'])
+        self.assertEqual(self.fired[1][1], second.expires)
+
+    def test_cancel(self):
+        kept = self.schedule(1.0, 'kept')
+        cancelled = self.schedule(1.0, 'cancelled')
+        far = self.schedule(500.0, 'far')
+
+        self.assertTrue(cancelled.cancel())
+        self.assertFalse(cancelled.cancel())
+        self.assertTrue(far.cancel())
+        self.assertEqual(self.wheel.count, 1)
+
+        self.run_until(6000)
+
+        self.assertEqual(self.fired, [('kept', kept.expires)])
+        self.assertFalse(kept.pending)
+        self.assertFalse(kept.cancel())
+
+    def test_cancel_from_callback(self):
+        scheduled = {}
+        cancelled = []
+
+        def cancel_others(name):
+            self.record(name)
+            # Timers of a tick fire in no particular order: whichever goes
+            # first cancels the other, which must then not fire
+            other = 'b' if name == 'a' else 'a'
+            for target in (other, 'later'):
+                if scheduled[target].cancel():
+                    cancelled.append(target)
+
+        for name in ('a', 'b'):
+            scheduled[name] = self.wheel.schedule(2.0, cancel_others, name)
+        self.assertEqual(scheduled['a'].expires, scheduled['b'].expires)
+        # On a later level 0 turn
+        scheduled['later'] = self.schedule(10.0, 'later')
+        self.schedule(10.0, 'kept')
+
+        self.run_until(200)
+
+        names = [name for name, _ in self.fired]
+        self.assertEqual(len(names), 2)
+        self.assertIn(names[0], ('a', 'b'))
+        self.assertEqual(names[1], 'kept')
+        self.assertEqual(sorted(cancelled), sorted(['later', 'b' if names[0] == 'a' else 'a']))
+        self.assertEqual(self.fired[0][1], scheduled['a'].expires)
+        self.assertEqual(self.wheel.count, 0)
+
+    def test_schedule_from_callback(self):
+        def reschedule(name):
+            self.record(name)
+            self.schedule(0, 'now')
+            self.schedule(5.0, 'later')
+
+        self.wheel.schedule(1.0, reschedule, 'first')
+
+        self.run_until(100)
+
+        names = [name for name, _ in self.fired]
+        self.assertEqual(names, ['first', 'now', 'later'])
+        # A timer due already fires on the next tick, not the current one
+        self.assertEqual(self.fired[1][1], self.fired[0][1] + 1)
+
+    def test_random_timers_and_cancels(self):
+        rng = random.Random(4242)
+        expected = {}
+        pending = []
+        for name in range(2000):
+            if pending and rng.random() < 0.1:
+                self.run_until(rng.randint(1, 700))
+            delay = rng.choice((rng.uniform(0, 10), rng.uniform(0, 500), rng.uniform(0, 3000)))
+            timer = self.schedule(delay, name)
+            expected[name] = timer.expires
+            pending.append((name, timer))
+            if rng.random() < 0.25:
+                cancel_name, cancel_timer = pending.pop(rng.randrange(len(pending)))
+                if cancel_timer.cancel():
+                    del expected[cancel_name]
+
+        self.run_until(round(3000 / timers.RESOLUTION) + 2)
+
+        self.assertEqual(len(self.fired), len(expected))
+        self.assertEqual(dict(self.fired), expected)
+        self.assertEqual(self.wheel.count, 0)
+
+
+def decode_binary_delta(data):
+    """Unpacks a binary delta the way the client does (gameWebsocket.ts)"""
+    kind, seq, mask = frames.DELTA_HEADER.unpack_from(data)
+    offset = frames.DELTA_HEADER.size
+    delta = {}
+    for bit, (key, fmt) in enumerate(zip(frames.DELTA_KEYS, frames.DELTA_VALUE_FORMATS)):
+        if mask & (1 << bit):
+            delta[key] = struct.unpack_from('<' + fmt, data, offset)[0]
+            offset += struct.calcsize(fmt)
+    return kind, seq, delta, offset
+
+
+class FrameCodecTests(SimpleTestCase):
+    """Keyframes and deltas rebuild the game state the server sent"""
+
+    def setUp(self):
+        self.game_state = game_logic.create_game_state('codec', {
+            'difficulty': 'hard', 'player1_id': 1, 'player2_id': 2,
+            'player1_username': 'left', 'player2_username': 'right', 'seed': 7
+        })
+        self.encoder = frames.FrameEncoder()
+
+    def move(self, rng):
+        """Changes a random subset of the fields carried by deltas"""
+        game_state = self.game_state
+        ball = game_state.ball
+        if rng.random() < 0.8:
+            ball.x += rng.uniform(-9, 9)
+            ball.y += rng.uniform(-9, 9)
+        if rng.random() < 0.2:
+            ball.dx, ball.dy = -ball.dx, rng.uniform(-5, 5)
+            ball.speed += 0.25
+        if rng.random() < 0.5:
+            game_state.left_paddle.y = rng.uniform(0, 600)
+        if rng.random() < 0.5:
+            game_state.right_paddle.y = rng.uniform(0, 600)
+        if rng.random() < 0.05:
+            game_state.left_paddle.score += 1
+        if rng.random() < 0.3:
+            seq, _ = game_state.acks[1]
+            game_state.acks[1] = (seq + 1, rng.uniform(0, 1e6))
+        game_state.tick += rng.randint(1, 4)
+
+    def test_first_frame_is_keyframe(self):
+        message = self.encoder.encode(self.game_state)
+
+        self.assertEqual(message['type'], 'game_state')
+        self.assertEqual(message['seq'], 1)
+        self.assertTrue(message['keyframe'])
+        self.assertEqual(message['state'], self.game_state.to_wire())
+
+    def test_deltas_rebuild_snapshots(self):
+        rng = random.Random(1)
+        self.encoder.encode(self.game_state)
+        previous = dict(zip(frames.DELTA_KEYS, frames.snapshot(self.game_state)))
+
+        for seq in range(2, 2 + frames.KEYFRAME_INTERVAL):
+            self.move(rng)
+            message = self.encoder.encode(self.game_state)
+
+            self.assertEqual(message['type'], 'game_delta')
+            self.assertEqual(message['seq'], seq)
+            previous.update(message['delta'])
+            self.assertEqual(previous, dict(zip(frames.DELTA_KEYS, frames.snapshot(self.game_state))))
+
+        # Keyframe interval reached
+        self.assertEqual(self.encoder.encode(self.game_state)['type'], 'game_state')
+
+    def test_unchanged_state_sends_empty_delta(self):
+        self.encoder.encode(self.game_state)
+        message = self.encoder.encode(self.game_state)
+
+        self.assertEqual(message['delta'], {})
+        self.assertEqual(decode_binary_delta(message['binary'])[2], {})
+
+    def test_forced_keyframe(self):
+        self.encoder.encode(self.game_state)
+        self.encoder.force_keyframe()
+
+        message = self.encoder.encode(self.game_state)
+
+        self.assertEqual(message['type'], 'game_state')
+        self.assertEqual(message['seq'], 2)
+
+    def test_join_keyframe_keeps_sequence(self):
+        self.encoder.encode(self.game_state)
+        self.encoder.encode(self.game_state)
+
+        joining = self.encoder.join_keyframe(self.game_state)
+        following = self.encoder.encode(self.game_state)
+
+        self.assertEqual(joining['seq'], 2)
+        self.assertEqual((following['type'], following['seq']), ('game_state', 3))
+
+    def test_binary_and_json_deltas_match(self):
+        rng = random.Random(2)
+        self.encoder.encode(self.game_state)
+
+        for _ in range(40):
+            self.move(rng)
+            message = self.encoder.encode(self.game_state)
+            from_json = json.loads(json.dumps({key: value for key, value in message.items() if key != 'binary'}))
+            kind, seq, from_binary, size = decode_binary_delta(message['binary'])
+
+            self.assertEqual(kind, frames.BINARY_DELTA)
+            self.assertEqual(seq, from_json['seq'])
+            self.assertEqual(size, len(message['binary']))
+            self.assertEqual(from_json['delta'], message['delta'])
+            self.assertEqual(set(from_binary), set(from_json['delta']))
+            for key, value in from_json['delta'].items():
+                if key in ('ls', 'rs', 'tk', 'a1', 'a2', 't1', 't2'):
+                    # Integers, and timestamps as float64
+                    self.assertEqual(from_binary[key], value, key)
+                else:
+                    # float32 keeps the two decimals sent
+                    self.assertAlmostEqual(from_binary[key], value, places=2, msg=key)
+
+    def test_unpack_paddle_moves(self):
+        self.assertEqual(
+            frames.unpack_client_message(frames.PADDLE_MOVE.pack(frames.BINARY_PADDLE_MOVE, 120.5)),
+            {'type': 'paddle_move', 'position': 120.5}
+        )
+        self.assertEqual(
+            frames.unpack_client_message(
+                frames.PADDLE_MOVE_SEQ.pack(frames.BINARY_PADDLE_MOVE_SEQ, 3.0, 7, 1234.25)
+            ),
+            {'type': 'paddle_move', 'position': 3.0, 'seq': 7, 't': 1234.25}
+        )
+
+    def test_unpack_unknown_messages(self):
+        valid = frames.PADDLE_MOVE.pack(frames.BINARY_PADDLE_MOVE, 1.0)
+
+        self.assertIsNone(frames.unpack_client_message(b''))
+        self.assertIsNone(frames.unpack_client_message(valid[:-1]))
+        self.assertIsNone(frames.unpack_client_message(b'\x09' + valid[1:]))
+        self.assertIsNone(frames.unpack_client_message(valid + b'\x00'))
+
+
+def physics_snapshot(game_state):
+    """Everything a physics step may change, for comparing two games"""
+    ball = game_state.ball
+    return (
+        ball.x, ball.y, ball.dx, ball.dy, ball.speed, ball.prev_x, ball.prev_y,
+        game_state.left_paddle.y, game_state.right_paddle.y,
+        game_state.left_paddle.score, game_state.right_paddle.score,
+        game_state.paddle_hits, game_state.tick, game_state.rng.getstate()
+    )
+
+
+@skipUnless(BatchPhysicsEngine.is_available(), "NumPy isn't installed")
+class BatchPhysicsTests(SimpleTestCase):
+    """The vectorized engine steps games exactly like the scalar physics"""
+
+    def create_games(self, prefix, count):
+        game_ids = [f"{prefix}-{i}" for i in range(count)]
+        for i, game_id in enumerate(game_ids):
+            game_logic.active_games[game_id] = game_logic.create_game_state(game_id, {
+                'difficulty': ('easy', 'medium', 'hard')[i % 3], 'player1_id': 1, 'player2_id': 2,
+                'player1_username': 'left', 'player2_username': 'right', 'seed': 1000 + i
+            })
+            game_logic.set_game_status(game_id, 'playing')
+            self.addCleanup(game_logic.active_games.pop, game_id, None)
+        return game_ids
+
+    def test_batch_matches_scalar(self):
+        count = BATCH_MIN_GAMES + 8
+        scalar = GameScheduler(tick_rate=60, batch_physics=False, physics_processes=0,
+                               swept_collisions=False, analytic_physics=False)
+        batch = GameScheduler(tick_rate=60, batch_physics=True, physics_processes=0,
+                              swept_collisions=False, analytic_physics=False)
+        self.assertIsNotNone(batch.batch_engine)
+        self.addCleanup(batch.batch_engine.sync_games, [])
+        runs = [(scalar, self.create_games('scalar', count)), (batch, self.create_games('batch', count))]
+        rng = random.Random(5)
+
+        for _ in range(3000):
+            # Same inputs for both copies of a game, only some games move
+            moves = [
+                (i, rng.choice((1, 2)), rng.uniform(-20, 620))
+                for i in range(count) if rng.random() < 0.3
+            ]
+            steps = rng.choice((1, 1, 1, 2, 4))
+            broadcast_due = rng.random() < 0.3
+            outputs = []
+            for scheduler, game_ids in runs:
+                for i, player_num, position in moves:
+                    scheduler.queue_paddle(game_ids[i], player_num, position)
+                scheduler.apply_inputs()
+                scored = scheduler.step_games(game_ids, steps, broadcast_due)
+                output = [scored[game_id] for game_id in game_ids]
+                if broadcast_due:
+                    # Every game is written back before a broadcast
+                    output += [physics_snapshot(game_logic.active_games[game_id]) for game_id in game_ids]
+                outputs.append(output)
+            self.assertEqual(outputs[0], outputs[1])
+
+        batch.batch_engine.sync_games([])
+        for scalar_id, batch_id in zip(runs[0][1], runs[1][1]):
+            self.assertEqual(
+                physics_snapshot(game_logic.active_games[scalar_id]),
+                physics_snapshot(game_logic.active_games[batch_id])
+            )
+        # Games did score and hit paddles, so those paths were compared too
+        self.assertTrue(any(game_logic.active_games[game_id].paddle_hits for game_id in runs[1][1]))
+        self.assertTrue(any(game_logic.active_games[game_id].left_paddle.score for game_id in runs[1][1]))
+
+
+class InputLogTests(SimpleTestCase):
+    """Input logs round-trip and replay a game to the state it ended in"""
+
+    def test_records_round_trip(self):
+        rng = random.Random(11)
+        log = replay.InputLog(4000000000, 240, 'hard', swept_collisions=True, lag_ticks=12)
+        expected = []
+        tick = 0
+        for _ in range(5000):
+            # Mostly small steps, with gaps long enough for multi-byte varints
+            tick += rng.choice((0, 1, 2, 5, 200, 70000))
+            kind = rng.choice((replay.LEFT_PADDLE, replay.RIGHT_PADDLE, replay.LEFT_PADDLE,
+                               replay.RIGHT_PADDLE, replay.MATCH_END, replay.NEW_MATCH))
+            value = 0.0
+            if kind in (replay.LEFT_PADDLE, replay.RIGHT_PADDLE):
+                value = replay.quantize_position(rng.choice((rng.uniform(0, 500), rng.uniform(-1, 1) * 1e5)))
+            log.record(tick, kind, value)
+            expected.append((tick, kind, value))
+
+        header, records = replay.decode_input_log(log.to_bytes())
+
+        self.assertEqual(header, {
+            'seed': 4000000000, 'tick_rate': 240, 'difficulty': 'hard',
+            'swept_collisions': True, 'analytic_physics': False, 'lag_ticks': 12
+        })
+        self.assertEqual(records, expected)
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            replay.decode_input_log(zlib.compress(b'PGIL'))
+        with self.assertRaises(ValueError):
+            replay.decode_input_log(zlib.compress(b'XXXX' + bytes(replay.LOG_HEADER.size)))
+
+    def play(self, game_id, seed, max_ticks):
+        """
+        Plays a game the way GameConsumer.game_tick and start_next_match do,
+        with paddles following the ball and missing it now and then.
+
+        Returns:
+            The GameState once the game is over or max_ticks ran
+        """
+        scheduler = GameScheduler(tick_rate=120, batch_physics=False, physics_processes=0,
+                                  swept_collisions=False, analytic_physics=False)
+        game_state = game_logic.create_game_state(game_id, {
+            'difficulty': 'hard', 'player1_id': 1, 'player2_id': 2,
+            'player1_username': 'left', 'player2_username': 'right', 'seed': seed
+        })
+        game_logic.enable_lag_compensation(game_state, 3)
+        game_logic.active_games[game_id] = game_state
+        self.addCleanup(game_logic.active_games.pop, game_id, None)
+        replay.start_input_log(game_state, scheduler.tick_rate)
+        self.addCleanup(replay.discard_input_log, game_id)
+        game_logic.set_game_status(game_id, 'playing')
+
+        rng = random.Random(seed)
+        while game_state.game_status != 'gameOver' and game_state.tick < max_ticks:
+            if game_state.game_status == 'matchOver':
+                game_logic.reset_for_new_match(game_id)
+                replay.record_input(game_id, replay.NEW_MATCH)
+                game_logic.set_game_status(game_id, 'playing')
+            if rng.random() < 0.25:
+                player_num = rng.choice((1, 2))
+                target = game_state.ball.y - game_logic.PADDLE_HEIGHT / 2 + rng.uniform(-70, 70)
+                scheduler.queue_paddle(game_id, player_num, replay.quantize_position(target))
+                scheduler.apply_inputs()
+            if scheduler.step_games([game_id], 1)[game_id]:
+                game_logic.record_point(game_id)
+                if game_logic.check_match_end(game_id):
+                    replay.record_input(game_id, replay.MATCH_END)
+        return game_state
+
+    def test_replay_reaches_the_recorded_state(self):
+        game_state = self.play('recorded', 77, 200000)
+        self.assertEqual(game_state.game_status, 'gameOver')
+        log = replay.input_logs.pop('recorded')
+        log.record(game_state.tick, replay.GAME_END)
+
+        replayed = replay.replay_input_log(log.to_bytes())
+
+        self.assertEqual(replayed.ball.to_wire(), game_state.ball.to_wire())
+        self.assertEqual(replayed.left_paddle.to_wire(), game_state.left_paddle.to_wire())
+        self.assertEqual(replayed.right_paddle.to_wire(), game_state.right_paddle.to_wire())
+        self.assertEqual(
+            (replayed.tick, replayed.game_status, replayed.winner, replayed.match_wins,
+             replayed.current_match, replayed.paddle_hits, replayed.rng.getstate()),
+            (game_state.tick, game_state.game_status, game_state.winner, game_state.match_wins,
+             game_state.current_match, game_state.paddle_hits, game_state.rng.getstate())
+        )
+
+
+class AbandonedGameTests(TransactionTestCase):
+    """A game a player left is written as completed, not lost to the cancelled status"""
+
+    def setUp(self):
+        self.player1 = User.objects.create_user(email='left@pong.test', username='left', password='x')
+        self.player2 = User.objects.create_user(email='right@pong.test', username='right', password='x')
+        game = Game.objects.create(player1=self.player1, player2=self.player2, status=StatusChoices.IN_PROGRESS)
+        self.game_id = str(game.id)
+
+        # A writer of its own, written as soon as it's flushed
+        patcher = mock.patch.object(persistence, 'result_writer', persistence.ResultWriter(flush_interval=0))
+        self.writer = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.game_state = game_logic.create_game_state(self.game_id, {
+            'difficulty': 'medium', 'player1_id': self.player1.id, 'player2_id': self.player2.id,
+            'player1_username': 'left', 'player2_username': 'right', 'seed': 3
+        })
+        game_logic.active_games[self.game_id] = self.game_state
+        self.addCleanup(game_logic.active_games.pop, self.game_id, None)
+        for num in (1, 2):
+            game_logic.set_player_connection(self.game_id, num, True)
+        game_logic.set_game_status(self.game_id, 'playing')
+        self.game_state.match_wins['player1'] = 1
+
+        # Group messages are delivered to the remaining player's consumer
+        self.consumer = game_consumers.GameConsumer()
+        self.consumer.game_id = self.game_id
+        self.consumer.send_json = mock.AsyncMock()
+        self.consumer.close = mock.AsyncMock()
+        self.channel_layer = mock.Mock()
+        self.channel_layer.group_send = mock.AsyncMock(side_effect=self.deliver)
+
+    async def deliver(self, group, message):
+        self.assertEqual(group, f"game_{self.game_id}")
+        await getattr(self.consumer, message['type'])(message)
+
+    @async_to_sync
+    async def leave(self, player_num, run):
+        """Player player_num leaves, run ends the game; returns once the result is written"""
+        if not self.game_state.player(player_num).held:
+            game_logic.set_player_connection(self.game_id, player_num, False)
+        try:
+            await run(self.channel_layer, self.game_id, player_num)
+            await self.writer.flush()
+        finally:
+            game_consumers.cancel_deadline(self.game_id)
+
+    def test_abandoned_game_is_completed(self):
+        self.leave(2, game_consumers.abandon_game)
+
+        game = Game.objects.get(id=self.game_id)
+        self.assertEqual(game.status, StatusChoices.COMPLETED)
+        self.assertEqual((game.final_score_player1, game.final_score_player2), (1, 0))
+        self.assertIsNotNone(game.completed_at)
+        self.assertEqual(self.writer.written, 1)
+        self.consumer.close.assert_awaited_once_with(code=4000)
+
+    def test_player_who_stayed_wins(self):
+        # Player 2 leads but leaves
+        self.game_state.match_wins.update(player1=0, player2=2)
+
+        self.leave(2, game_consumers.abandon_game)
+
+        game = Game.objects.get(id=self.game_id)
+        self.assertEqual(game.status, StatusChoices.COMPLETED)
+        self.assertEqual(game.winner_id, self.player1.id)
+        self.assertEqual((game.final_score_player1, game.final_score_player2), (0, 2))
+
+    def test_reconnect_grace_expiry(self):
+        game_logic.set_player_connection(self.game_id, 1, False, hold_slot=True)
+        self.assertEqual(self.game_state.game_status, 'paused')
+
+        self.leave(1, game_consumers.expire_reconnect_grace)
+
+        game = Game.objects.get(id=self.game_id)
+        self.assertEqual(game.status, StatusChoices.COMPLETED)
+        self.assertEqual(game.winner_id, self.player2.id)
+        self.assertFalse(self.game_state.player(1).held)
+        self.assertEqual(Match.objects.filter(game_id=self.game_id).count(), 1)
+
+    def test_abandoned_game_keeps_match_ledger(self):
+        game_state = self.game_state
+        # Match 1: rallies of 3 and 4 hits, won by player 1
+        game_state.paddle_hits += 3
+        game_logic.record_point(self.game_id)
+        game_state.paddle_hits += 4
+        game_logic.record_point(self.game_id)
+        game_state.winner = 'player1'
+        game_logic.close_match_record(game_state)
+        # Match 2: abandoned during its first rally
+        game_state.current_match = 2
+        game_state.winner = None
+        game_logic.open_match_record(game_state)
+        game_state.paddle_hits += 2
+
+        self.leave(2, game_consumers.abandon_game)
+
+        matches = list(Match.objects.filter(game_id=self.game_id).order_by('match_number').values_list(
+            'match_number', 'status', 'winner', 'paddle_hits', 'longest_rally'
+        ))
+        self.assertEqual(matches, [
+            (1, StatusChoices.MATCH_COMPLETED, 'player1', 7, 4),
+            (2, StatusChoices.MATCH_IN_PROGRESS, None, 2, 2),
+        ])
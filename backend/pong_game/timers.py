@@ -0,0 +1,198 @@
+"""
+Shared timer wheel for game deadlines.
+
+Game deadlines used to be polled: every connection waiting for its
+opponent ran a task waking up once per second, and every game checked its
+inactivity timeout on each scheduler tick. They are now timers of a single
+hierarchical timer wheel per process:
+
+- opponent wait (GameConsumer.start_opponent_wait, PONG_OPPONENT_WAIT);
+- inactivity of a game nobody is connected to (PONG_INACTIVE_TIMEOUT);
+- matchOver auto-advance to the next match (PONG_NEXT_MATCH_DELAY);
+- reconnection grace of a player whose connection dropped (PONG_RECONNECT_GRACE);
+- game invite expiry (PONG_INVITE_TTL).
+
+The wheel has LEVELS levels of SLOTS slots. Level 0 slots are RESOLUTION
+seconds apart, each level above covers a whole turn of the level below. A
+timer goes into the slot of the lowest level whose range covers its
+deadline and moves down a level whenever the level below completes a turn,
+so schedule() and Timer.cancel() are O(1) and the driver only looks at the
+slot that is due. One driver task runs while timers are pending.
+"""
+import asyncio
+import math
+import time
+import traceback
+from .tasks import spawn_detached
+
+# Seconds between two level 0 slots
+RESOLUTION = 0.1
+# Slots per level and number of levels: 6.4 s, 409.6 s and 7.3 h ranges
+SLOTS = 64
+LEVELS = 3
+
+
+class Timer:
+    """A scheduled callback, returned by TimerWheel.schedule"""
+
+    __slots__ = ('wheel', 'expires', 'callback', 'args', 'bucket')
+
+    def __init__(self, wheel, expires, callback, args):
+        self.wheel = wheel
+        self.expires = expires  # Wheel tick the timer is due at
+        self.callback = callback
+        self.args = args
+        # Slot the timer is in, None once fired or cancelled
+        self.bucket = None
+
+    def cancel(self):
+        """Cancels the timer; returns False if it already fired or was cancelled"""
+        if self.bucket is None:
+            return False
+        self.bucket.discard(self)
+        self.bucket = None
+        self.wheel.count -= 1
+        return True
+
+    @property
+    def pending(self):
+        """True until the timer fires or is cancelled"""
+        return self.bucket is not None
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel driven by one asyncio task.
+
+    Callbacks may be plain functions or coroutine functions; coroutines are
+    run as tasks so a slow callback doesn't hold up the other timers.
+    """
+
+    def __init__(self, resolution=RESOLUTION, slots=SLOTS, levels=LEVELS):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        # Last wheel tick processed
+        self.current_tick = self._tick_at(time.monotonic())
+        self.count = 0
+        self.fired = 0
+        self._task = None
+
+    def _tick_at(self, timestamp):
+        return int(timestamp / self.resolution)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Calls callback(*args) in delay seconds; must run on the event loop.
+
+        Args:
+            delay: Seconds from now
+            callback: Function or coroutine function
+            *args: Arguments of the callback
+
+        Returns:
+            Timer, whose cancel() removes it in O(1)
+        """
+        if self.count == 0:
+            # Nothing pending: skip the ticks that passed while idle
+            self.current_tick = self._tick_at(time.monotonic())
+        expires = math.ceil((time.monotonic() + max(0.0, delay)) / self.resolution)
+        timer = Timer(self, expires, callback, args)
+        self._insert(timer)
+        self.count += 1
+
+        if self._task is None or self._task.done():
+            # Fresh context: timers scheduled from a request (async_to_sync)
+            # must not tie the driver to that request's thread executor
+            self._task = spawn_detached(self._run())
+        return timer
+
+    def _insert(self, timer, cascading=False):
+        """
+        Puts a timer into the slot of the lowest level covering its deadline.
+
+        While cascading, the slot of the current tick is still to be fired;
+        otherwise timers already due go into the next one.
+        """
+        delta = timer.expires - self.current_tick
+        if delta < 0 or (delta == 0 and not cascading):
+            # Due already, fired with the next tick
+            bucket = self.wheels[0][(self.current_tick + 1) % self.slots]
+        else:
+            bucket = None
+            span = self.slots
+            for level in range(self.levels):
+                if delta < span:
+                    bucket = self.wheels[level][(timer.expires // (span // self.slots)) % self.slots]
+                    break
+                span *= self.slots
+            if bucket is None:
+                # Beyond the wheel: parked in the last slot of the top level
+                # and put back in place when that slot cascades
+                top = span // self.slots // self.slots
+                bucket = self.wheels[-1][(self.current_tick // top + self.slots - 1) % self.slots]
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def _cascade(self, level):
+        """Moves the timers of the current slot of a level down the wheel"""
+        index = (self.current_tick // self.slots ** level) % self.slots
+        bucket = self.wheels[level][index]
+        self.wheels[level][index] = set()
+        for timer in bucket:
+            self._insert(timer, cascading=True)
+
+    def _advance(self):
+        """Processes one wheel tick and fires the timers due at it"""
+        self.current_tick += 1
+        # Higher levels first, so their timers can land in the lower ones
+        for level in range(self.levels - 1, 0, -1):
+            if self.current_tick % self.slots ** level == 0:
+                self._cascade(level)
+
+        index = self.current_tick % self.slots
+        due = self.wheels[0][index]
+        if not due:
+            return
+        self.wheels[0][index] = set()
+        for timer in list(due):
+            if timer.bucket is not due:
+                # Cancelled by a callback fired before it
+                continue
+            timer.bucket = None
+            self.count -= 1
+            self.fired += 1
+            try:
+                result = timer.callback(*timer.args)
+                if asyncio.iscoroutine(result):
+                    spawn_detached(_run_callback(result))
+            except Exception as e:
+                print(f"Error in timer callback {getattr(timer.callback, '__name__', timer.callback)}: {str(e)}")
+                traceback.print_exc()
+
+    async def _run(self):
+        """Driver task: advances the wheel while timers are pending"""
+        try:
+            while True:
+                target = self._tick_at(time.monotonic())
+                while self.current_tick < target:
+                    self._advance()
+                if self.count == 0:
+                    return
+                await asyncio.sleep(max(0.0, (self.current_tick + 1) * self.resolution - time.monotonic()))
+        finally:
+            self._task = None
+
+
+async def _run_callback(coroutine):
+    """Runs a coroutine callback, logging its errors"""
+    try:
+        await coroutine
+    except Exception as e:
+        print(f"Error in timer callback: {str(e)}")
+        traceback.print_exc()
+
+
+# Timer wheel shared by every game in this process
+game_timers = TimerWheel()
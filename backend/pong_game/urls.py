@@ -14,6 +14,11 @@ urlpatterns = [
     path('preferences/', views.UserPreferencesView.as_view(), name='preferences'),
     path('player-status/', views.PlayerGameStatusView.as_view(), name='player-status'),
 
+    # Admin only: drain this worker before a restart
+    path('drain/', views.DrainView.as_view(), name='drain'),
+    # Admin only: send queue and game loop metrics of this worker
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+
     # Get current user's profile
     path('profile/', views.PlayerProfileView.as_view(), name='profile'),
     
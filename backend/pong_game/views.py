@@ -12,6 +12,11 @@ from rest_framework.permissions import IsAuthenticated
 from authentication.models import User
 from users.utils import send_notification
 from django.utils import timezone
+from django.conf import settings
+from datetime import timedelta
+
+# Seconds a game invite can be answered (see schedule_invite_expiry)
+INVITE_TTL = getattr(settings, 'PONG_INVITE_TTL', 300)
 
 
 class PlayerProfileView(APIView):
@@ -119,26 +124,23 @@ class GameStateView(APIView):
                 return Response({"error": "You are not a participant in this game"}, 
                                status=status.HTTP_403_FORBIDDEN)
             
-            # Check if game is active in memory (imported from consumers)
-            from .consumers import active_games
+            # Ask the registry, the game may be running on another worker
+            from .registry import game_registry
             
-            if game_id not in active_games:
+            summary = game_registry.get_summary(game_id)
+            if summary is None:
                 return Response({"error": "Game is not currently active"}, 
                                status=status.HTTP_404_NOT_FOUND)
             
             # Return a simplified version of the game state
-            game_state = active_games[game_id]
             simplified_state = {
-                "ball_position": [game_state["ball"]["x"], game_state["ball"]["y"]],
-                "left_paddle_position": game_state["left_paddle"]["y"],
-                "right_paddle_position": game_state["right_paddle"]["y"],
-                "scores": {
-                    "left": game_state["left_paddle"]["score"],
-                    "right": game_state["right_paddle"]["score"]
-                },
-                "match_wins": game_state["match_wins"],
-                "current_match": game_state["current_match"],
-                "status": game_state["game_status"]
+                "ball_position": summary["ball_position"],
+                "left_paddle_position": summary["left_paddle_position"],
+                "right_paddle_position": summary["right_paddle_position"],
+                "scores": summary["scores"],
+                "match_wins": summary["match_wins"],
+                "current_match": summary["current_match"],
+                "status": summary["status"]
             }
             
             return Response(simplified_state)
@@ -151,42 +153,78 @@ class ActiveGamesView(APIView):
     def get(self, request):
         """List all active games the user is participating in"""
         try:
-            # Import active games from consumers
-            from .consumers import active_games
+            # Running games of this user, whichever worker owns them
+            from .registry import game_registry
             
-            # Filter games where user is a participant
             user_games = []
-            for game_id, game_state in active_games.items():
-                if (str(game_state["players"]["player1"]["id"]) == str(request.user.id) or
-                    str(game_state["players"]["player2"]["id"]) == str(request.user.id)):
+            for summary in game_registry.games_for_player(request.user.id):
+                game_id = summary["game_id"]
+                # Get database game object for additional info
+                try:
+                    game = Game.objects.get(id=game_id)
                     
-                    # Get database game object for additional info
-                    try:
-                        game = Game.objects.get(id=game_id)
-                        
-                        # Create a summary of the game
-                        game_summary = {
-                            "id": game_id,
-                            "opponent": {
-                                "username": game.player2.username if request.user.id == game.player1_id else game.player1.username,
-                                "avatar": game.player2.avatar if request.user.id == game.player1_id else game.player1.avatar
-                            },
-                            "status": game_state["game_status"],
-                            "current_match": game_state["current_match"],
-                            "match_wins": game_state["match_wins"],
-                            "theme": game_state["theme"],
-                            "difficulty": game_state["difficulty"],
-                            "created_at": game.created_at
-                        }
-                        user_games.append(game_summary)
-                    except Game.DoesNotExist:
-                        # Skip if game doesn't exist in database
-                        pass
+                    # Create a summary of the game
+                    game_summary = {
+                        "id": game_id,
+                        "opponent": {
+                            "username": game.player2.username if request.user.id == game.player1_id else game.player1.username,
+                            "avatar": game.player2.avatar if request.user.id == game.player1_id else game.player1.avatar
+                        },
+                        "status": summary["status"],
+                        "current_match": summary["current_match"],
+                        "match_wins": summary["match_wins"],
+                        "difficulty": summary["difficulty"],
+                        "created_at": game.created_at
+                    }
+                    user_games.append(game_summary)
+                except Game.DoesNotExist:
+                    # Skip if game doesn't exist in database
+                    pass
             
             return Response(user_games)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
+class DrainView(APIView):
+    """Admin endpoint to drain the worker serving the request (see drain.py)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """Report the drain progress of this worker"""
+        from . import drain
+        return Response(drain.drain_status())
+
+    def post(self, request):
+        """Start draining this worker: no new games, running ones end or are handed off"""
+        from asgiref.sync import async_to_sync
+        from . import drain
+        try:
+            # Runs on the event loop of the worker, where the games live
+            drain_status = async_to_sync(drain.start_drain)(f"admin {request.user.username}")
+            return Response(drain_status, status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+class MetricsView(APIView):
+    """Admin endpoint reporting the game metrics of the worker serving the request"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """
+        Send queue depths and dropped frames of this worker (see fanout.py),
+        and its game loop histograms when PONG_LOOP_METRICS is on (see
+        loop_metrics.py)
+        """
+        from . import fanout
+        from .loop_metrics import loop_metrics
+        from .registry import WORKER_ID
+        return Response({
+            'worker': WORKER_ID,
+            'send_queues': fanout.queue_stats(),
+            'loop': loop_metrics.report() if loop_metrics is not None else None
+        })
+
+
 class UserPreferencesView(APIView):
     permission_classes = [IsAuthenticated]
     """API endpoint for managing user preferences"""
@@ -304,6 +342,44 @@ class GameHistoryView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
     
 
+def schedule_invite_expiry(invite_id, invitation_code):
+    """
+    Expires a pending invite after PONG_INVITE_TTL seconds with a timer of
+    the shared timer wheel (timers.py).
+
+    Args:
+        invite_id: The ID of the GameInvite
+        invitation_code: Its code, to find the invite notification
+    """
+    from asgiref.sync import async_to_sync
+    from .timers import game_timers
+
+    async def schedule():
+        # Runs on the worker's event loop, where the timer wheel lives
+        game_timers.schedule(INVITE_TTL, expire_invite, invite_id, invitation_code)
+
+    async_to_sync(schedule)()
+
+
+async def expire_invite(invite_id, invitation_code):
+    """Invite expiry deadline"""
+    from channels.db import database_sync_to_async
+    await database_sync_to_async(_expire_invite)(invite_id, invitation_code)
+
+
+def _expire_invite(invite_id, invitation_code):
+    """Marks an invite that is still pending as expired, and its notification as read"""
+    from users.models import Notification
+    expired = GameInvite.objects.filter(
+        id=invite_id, status=StatusChoices.PENDING
+    ).update(status=StatusChoices.EXPIRED)
+    if expired:
+        Notification.objects.filter(
+            notification_type='game_invite',
+            data__invitation_code=invitation_code
+        ).update(is_read=True)
+
+
 class GameInviteView(APIView):
     def post(self, request):
         """Create a game invitation"""
@@ -349,7 +425,8 @@ class GameInviteView(APIView):
                     sender=sender_profile,
                     receiver=receiver_profile,
                     invitation_code=invitation_code,
-                    status=StatusChoices.PENDING
+                    status=StatusChoices.PENDING,
+                    expires_at=timezone.now() + timedelta(seconds=INVITE_TTL)
                 )
             except Exception as invite_error:
                 return Response(
@@ -371,6 +448,12 @@ class GameInviteView(APIView):
                 )
             except Exception as notify_error:
                 pass
+
+            # Expired by a timer; is_expired() still catches it if the timer is lost
+            try:
+                schedule_invite_expiry(invite.id, invitation_code)
+            except Exception as timer_error:
+                print(f"Could not schedule invite expiry: {str(timer_error)}")
             
             serializer = GameInviteSerializer(invite)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -408,12 +491,22 @@ class GameInviteResponseView(APIView):
                 return Response({
                     "error": "Invalid invitation code"
                 }, status=status.HTTP_404_NOT_FOUND)
-            
+
             # Check if the current user is the recipient
             if invite.receiver.player != request.user:
                 return Response({
                     "error": "This invitation is not for you"
                 }, status=status.HTTP_403_FORBIDDEN)
+
+            # Pending invites past their expiry can't be answered anymore,
+            # mark them expired like the expiry timer does
+            if invite.expires_at and timezone.now() > invite.expires_at:
+                _expire_invite(invite.id, invitation_code)
+                invite.status = StatusChoices.EXPIRED
+                return Response({
+                    "message": f"Invitation has already been {invite.status}",
+                    "status": invite.status
+                }, status=status.HTTP_200_OK)
             
             # Get the action
             action = request.data.get('action')
@@ -6,6 +6,41 @@ echo "Running Django migrations"
 python manage.py makemigrations
 python manage.py migrate
 
-echo "Starting Django server"
+PONG_WORKERS="${PONG_WORKERS:-1}"
 
-exec daphne -p 8000 -b 0.0.0.0 backend.asgi:application
+# A deploy's SIGTERM drains the workers (SIGUSR1, see pong_game/drain.py):
+# they stop taking new games, let the running ones end and exit on their own
+draining=0
+pids=()
+drain() {
+    draining=1
+    echo "Draining Django workers"
+    kill -USR1 "${pids[@]}" 2>/dev/null || true
+}
+trap drain TERM
+
+if [ "$PONG_WORKERS" -le 1 ]; then
+    echo "Starting Django server"
+    daphne -p 8000 -b 0.0.0.0 backend.asgi:application &
+    pids+=($!)
+else
+    # Several workers share game ownership through Redis; nginx hashes game
+    # sockets to worker i on port 8000 + i (see nginx/tools/generate_upstreams.sh)
+    export PONG_GAME_REGISTRY="${PONG_GAME_REGISTRY:-redis}"
+
+    echo "Starting $PONG_WORKERS Django workers"
+    for ((i = 0; i < PONG_WORKERS; i++)); do
+        PONG_WORKER_ID="worker-$i" daphne -p $((8000 + i)) -b 0.0.0.0 backend.asgi:application &
+        pids+=($!)
+    done
+fi
+
+# Stop the container as soon as one worker exits, or once all of them
+# exited when draining
+while true; do
+    status=0
+    wait -n || status=$?
+    if [ "$draining" -eq 0 ] || [ -z "$(jobs -pr)" ]; then
+        exit $status
+    fi
+done
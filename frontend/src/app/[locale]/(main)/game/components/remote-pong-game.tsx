@@ -192,6 +192,12 @@ const RemotePongGame: React.FC<RemotePongGameProps> = ({
         frameCountRef.current = 0;
         lastFpsUpdateRef.current = now;
       }
+
+      // Show the round-trip time measured by the connection
+      const latency = connectionRef.current?.getLatency();
+      if (latency !== null && latency !== undefined) {
+        setConnectionState(prev => prev.ping === latency ? prev : { ...prev, ping: latency });
+      }
     }, 1000);
     
     // Cleanup on unmount
@@ -6,6 +6,53 @@ type ConnectionChangeCallback = (connected: boolean) => void;
 type PlayerNumberCallback = (playerNumber: number) => void;
 type ForceDisconnectCallback = (reason: string) => void;
 
+// Binary frame layouts (little-endian), see backend/pong_game/frames.py
+//   server -> client delta: uint8 kind, uint32 seq, uint16 field mask, values
+//   server -> client merged delta: uint8 kind, uint32 seq, uint32 base, uint16 field mask, values
+//   client -> server paddle_move: uint8 kind, float32 position, uint32 input seq,
+//                                 float64 timestamp
+const BINARY_DELTA = 1;
+const BINARY_MERGED_DELTA = 2;
+const BINARY_PADDLE_MOVE_SEQ = 2;
+const DELTA_KEYS = ['bx', 'by', 'bdx', 'bdy', 'bs', 'ly', 'ry', 'ls', 'rs', 'tk', 'a1', 't1', 'a2', 't2'];
+// Positions, velocities and speed are float32, scores uint16, tick and input
+// sequence numbers uint32, timestamps float64: [kind, size] per key
+const DELTA_FORMATS: [string, number][] = [
+  ['f', 4], ['f', 4], ['f', 4], ['f', 4], ['f', 4], ['f', 4], ['f', 4],
+  ['H', 2], ['H', 2], ['I', 4], ['I', 4], ['d', 8], ['I', 4], ['d', 8]
+];
+
+function decodeBinaryDelta(buffer: ArrayBuffer) {
+  const view = new DataView(buffer);
+  const kind = view.byteLength > 0 ? view.getUint8(0) : null;
+  // A merged delta (frames dropped by the server's send queue) also carries
+  // the sequence number it applies on top of
+  const merged = kind === BINARY_MERGED_DELTA;
+  if ((kind !== BINARY_DELTA && !merged) || view.byteLength < (merged ? 11 : 7)) {
+    return null;
+  }
+  const seq = view.getUint32(1, true);
+  const base = merged ? view.getUint32(5, true) : seq - 1;
+  const mask = view.getUint16(merged ? 9 : 5, true);
+  const delta: Record<string, number> = {};
+  let offset = merged ? 11 : 7;
+  DELTA_KEYS.forEach((key, bit) => {
+    if (!(mask & (1 << bit))) return;
+    const [kind, size] = DELTA_FORMATS[bit];
+    if (kind === 'f') {
+      delta[key] = view.getFloat32(offset, true);
+    } else if (kind === 'H') {
+      delta[key] = view.getUint16(offset, true);
+    } else if (kind === 'I') {
+      delta[key] = view.getUint32(offset, true);
+    } else {
+      delta[key] = view.getFloat64(offset, true);
+    }
+    offset += size;
+  });
+  return { type: 'game_delta', seq, base, delta };
+}
+
 export default class GameConnection {
   private socket: WebSocket | null = null;
   private gameId: string;
@@ -29,6 +76,36 @@ export default class GameConnection {
   // Player information
   private playerNumber: number | null = null;
 
+  // Snapshot/delta state: last full state rebuilt from keyframes and deltas
+  private lastState: any = null;
+  private lastSeq: number | null = null;
+  private resyncRequested = false;
+
+  // Opt in to binary delta frames unless disabled at build time
+  private binaryFrames = process.env.NEXT_PUBLIC_GAME_BINARY_FRAMES !== 'false';
+
+  // Round-trip time, measured with pings and reported back to the server
+  // so it can lower the broadcast rate on slow connections
+  private pingInterval: NodeJS.Timeout | null = null;
+  private pingPeriod = 2000;
+  private latency: number | null = null;
+
+  // Client-side prediction: paddle inputs the server hasn't acknowledged yet.
+  // Frames carry the last applied input sequence per player, the own paddle
+  // is shown at the newest unacknowledged target instead of the server's.
+  private inputSeq = 0;
+  private pendingInputs: { seq: number, position: number }[] = [];
+  private inputLatency: number | null = null;
+
+  // Reconnect-and-resume: after an unexpected close the server holds our slot
+  // for reconnectGrace seconds; we reconnect with the resume token it sent in
+  // connection_established (kept per tab, so a reload resumes too)
+  private resumeToken: string | null = null;
+  private reconnectGrace = 0;
+  private reconnectDeadline: number | null = null;
+  private reconnectAttempt = 0;
+  private reconnectTimer: NodeJS.Timeout | null = null;
+  private closedByUser = false;
 
   constructor(
     gameId: string, 
@@ -46,6 +123,7 @@ export default class GameConnection {
     this.onConnectionChange = onConnectionChange;
     this.onPlayerNumber = onPlayerNumber;
     this.onForceDisconnect = onForceDisconnect;
+    this.resumeToken = this.loadResumeToken();
   }
 
   connect() {
@@ -56,11 +134,15 @@ export default class GameConnection {
 
     // Create WebSocket URL with game ID and authentication token
     const host = process.env.NEXT_PUBLIC_WS_URL ||'wss://localhost';
-    const wsUrl = `${host}/ws/game/${this.gameId}/?token=${this.token}`;
+    const format = this.binaryFrames ? '&format=binary' : '';
+    const resume = this.resumeToken ? `&resume=${this.resumeToken}` : '';
+    const wsUrl = `${host}/ws/game/${this.gameId}/?token=${this.token}${format}${resume}`;
+    this.closedByUser = false;
     
     try {
       // Create new WebSocket connection
       this.socket = new WebSocket(wsUrl);
+      this.socket.binaryType = 'arraybuffer';
       
       // Set up event handlers
       this.socket.onopen = this.handleOpen.bind(this);
@@ -85,6 +167,14 @@ export default class GameConnection {
 
   private handleMessage(event: MessageEvent) {
     try {
+      if (event.data instanceof ArrayBuffer) {
+        const delta = decodeBinaryDelta(event.data);
+        if (delta) {
+          this.handleDelta(delta);
+        }
+        return;
+      }
+
       const message = JSON.parse(event.data);
       
       switch (message.type) {
@@ -94,11 +184,36 @@ export default class GameConnection {
             this.playerNumber = message.player_number;
             this.onPlayerNumber(message.player_number);
           }
+          if (message.resume_token) {
+            this.resumeToken = message.resume_token;
+            this.reconnectGrace = message.reconnect_grace || 0;
+            this.saveResumeToken(message.resume_token);
+          }
+          // Back in: the server sends a keyframe next
+          this.reconnectAttempt = 0;
+          this.reconnectDeadline = null;
           break;
           
         case 'game_state':
-          // Pass game state to callback function
-          this.onGameState(message.state);
+          // Full keyframe: becomes the base for the following deltas
+          this.lastState = message.state;
+          if (message.seq !== undefined) {
+            this.lastSeq = message.seq;
+            this.resyncRequested = false;
+          }
+          this.onGameState(this.reconcile(message.state));
+          break;
+
+        case 'game_delta':
+          this.handleDelta(message);
+          break;
+
+        case 'pong':
+          if (typeof message.t === 'number') {
+            const rtt = performance.now() - message.t;
+            // Smooth out single slow round trips
+            this.latency = this.latency === null ? rtt : this.latency + (rtt - this.latency) * 0.25;
+          }
           break;
           
         case 'game_status_changed':
@@ -110,7 +225,9 @@ export default class GameConnection {
           // Handle opponent connection/disconnection
           const isOpponent = this.playerNumber !== null && message.player !== this.playerNumber;
           if (isOpponent && !message.connected) {
-            // Opponent disconnected - we'll handle this via force_disconnect
+            // Opponent disconnected - the server pauses the game (game_status_changed)
+            // while it holds their slot, and sends force_disconnect if they don't
+            // come back within message.reconnect_grace seconds
           }
           break;
           
@@ -136,17 +253,149 @@ export default class GameConnection {
     }
   }
 
+  // Apply a delta frame on top of the last known state
+  private handleDelta(message: any) {
+    // Deltas apply on top of the previous frame, merged ones on top of their base
+    const base = typeof message.base === 'number' ? message.base : message.seq - 1;
+    if (this.lastState === null || this.lastSeq === null || base !== this.lastSeq) {
+      // Missed a frame: ask the server for a keyframe (once until it arrives)
+      if (!this.resyncRequested) {
+        this.resyncRequested = this.sendMessage('resync');
+      }
+      return;
+    }
+
+    const delta = message.delta || {};
+    const state = this.lastState;
+    const ball = { ...state.ball };
+    const leftPaddle = { ...state.left_paddle };
+    const rightPaddle = { ...state.right_paddle };
+
+    if (delta.bx !== undefined) { ball.prev_x = ball.x; ball.x = delta.bx; }
+    if (delta.by !== undefined) { ball.prev_y = ball.y; ball.y = delta.by; }
+    if (delta.bdx !== undefined) ball.dx = delta.bdx;
+    if (delta.bdy !== undefined) ball.dy = delta.bdy;
+    if (delta.bs !== undefined) ball.speed = delta.bs;
+    if (delta.ly !== undefined) leftPaddle.y = delta.ly;
+    if (delta.ry !== undefined) rightPaddle.y = delta.ry;
+    if (delta.ls !== undefined) leftPaddle.score = delta.ls;
+    if (delta.rs !== undefined) rightPaddle.score = delta.rs;
+
+    const acks = { ...(state.acks || {}) };
+    if (delta.a1 !== undefined) acks.player1 = { seq: delta.a1, t: delta.t1 ?? acks.player1?.t };
+    if (delta.a2 !== undefined) acks.player2 = { seq: delta.a2, t: delta.t2 ?? acks.player2?.t };
+    const tick = delta.tk !== undefined ? delta.tk : state.tick;
+
+    this.lastState = { ...state, ball, left_paddle: leftPaddle, right_paddle: rightPaddle, acks, tick };
+    this.lastSeq = message.seq;
+    this.onGameState(this.reconcile(this.lastState));
+  }
+
+  // Drop the inputs the server has applied and predict the own paddle from the rest.
+  // lastState stays authoritative: deltas keep applying on top of it.
+  private reconcile(state: any) {
+    if (this.playerNumber === null || !state || !state.acks) {
+      return state;
+    }
+    const ack = state.acks[`player${this.playerNumber}`];
+    if (ack && typeof ack.seq === 'number') {
+      const acknowledged = this.pendingInputs.filter(input => input.seq <= ack.seq);
+      if (acknowledged.length > 0 && typeof ack.t === 'number' && ack.t > 0) {
+        // Input to acknowledgment delay, including the broadcast interval
+        this.inputLatency = performance.now() - ack.t;
+      }
+      this.pendingInputs = this.pendingInputs.filter(input => input.seq > ack.seq);
+    }
+    if (this.pendingInputs.length === 0) {
+      return state;
+    }
+    const predicted = this.pendingInputs[this.pendingInputs.length - 1].position;
+    const paddleKey = this.playerNumber === 1 ? 'left_paddle' : 'right_paddle';
+    return { ...state, [paddleKey]: { ...state[paddleKey], y: predicted } };
+  }
+
+  getInputLatency() {
+    return this.inputLatency;
+  }
+
   private handleClose(event: CloseEvent) {
-    this.onConnectionChange(false);
     this.socket = null;
     
     // Stop game loop
     this.stopGameLoop();
+
+    // The frames after the reconnection start from a fresh keyframe
+    this.lastState = null;
+    this.lastSeq = null;
+    this.resyncRequested = false;
+
+    if (this.shouldReconnect(event.code)) {
+      this.scheduleReconnect();
+      return;
+    }
+    this.clearResumeToken();
+    this.onConnectionChange(false);
   }
 
   private handleError(error: Event) {
+    // Always followed by a close, which decides whether to reconnect
     console.error('Game WebSocket error:', error);
-    this.onConnectionChange(false);
+  }
+
+  // Closes that end the session: by us, game over or cancelled (1000, 4000),
+  // authentication or game errors (4001, 4003, 4004), forced (4002) and a
+  // refused resume token (4009). Anything else is a dropped connection or a
+  // draining server (4503), retried while the server holds our slot.
+  private shouldReconnect(code: number) {
+    if (this.closedByUser || !this.resumeToken) {
+      return false;
+    }
+    if ([1000, 4000, 4001, 4002, 4003, 4004, 4009].includes(code)) {
+      return false;
+    }
+    if (this.reconnectDeadline === null) {
+      this.reconnectDeadline = Date.now() + this.reconnectGrace * 1000;
+    }
+    return Date.now() < this.reconnectDeadline;
+  }
+
+  // Exponential backoff from 250ms, at most 4s between attempts
+  private scheduleReconnect() {
+    const delay = Math.min(250 * 2 ** this.reconnectAttempt, 4000);
+    this.reconnectAttempt += 1;
+    this.reconnectTimer = setTimeout(() => {
+      this.reconnectTimer = null;
+      this.connect();
+    }, delay);
+  }
+
+  private resumeKey() {
+    return `pong-resume-${this.gameId}`;
+  }
+
+  private loadResumeToken() {
+    try {
+      return typeof sessionStorage !== 'undefined' ? sessionStorage.getItem(this.resumeKey()) : null;
+    } catch {
+      return null;
+    }
+  }
+
+  private saveResumeToken(token: string) {
+    try {
+      sessionStorage.setItem(this.resumeKey(), token);
+    } catch {
+      // Storage unavailable: resuming still works without a reload
+    }
+  }
+
+  private clearResumeToken() {
+    this.resumeToken = null;
+    try {
+      sessionStorage.removeItem(this.resumeKey());
+    } catch {
+      // Storage unavailable
+    }
   }
   
   private processQueuedMessages() {
@@ -185,7 +434,7 @@ export default class GameConnection {
     
     if (significantMove && intervalElapsed) {
       // Send immediately if both conditions are met
-      this.sendMessage('paddle_move', { position });
+      this.sendPaddleMessage(position);
       this.lastSentPaddleY = position;
       this.lastSendTime = now;
       this.paddleMoveQueued = false;
@@ -205,7 +454,7 @@ export default class GameConnection {
     this.gameLoopInterval = setInterval(() => {
       const now = Date.now();
       if (this.paddleMoveQueued && this.currentPaddleY !== null && now - this.lastSendTime >= this.minSendInterval) {
-        const sent = this.sendMessage('paddle_move', { position: this.currentPaddleY });
+        const sent = this.sendPaddleMessage(this.currentPaddleY);
         if (sent) {
           this.lastSentPaddleY = this.currentPaddleY;
           this.lastSendTime = now;
@@ -213,6 +462,13 @@ export default class GameConnection {
         }
       }
     },  this.minSendInterval); // 33ms = 30 updates per second
+
+    // Measure the round trip, sending the previous measurement along
+    if (this.pingInterval) {
+      clearInterval(this.pingInterval);
+    }
+    this.sendPing();
+    this.pingInterval = setInterval(() => this.sendPing(), this.pingPeriod);
   }
   
   private stopGameLoop() {
@@ -220,8 +476,53 @@ export default class GameConnection {
       clearInterval(this.gameLoopInterval);
       this.gameLoopInterval = null;
     }
+    if (this.pingInterval) {
+      clearInterval(this.pingInterval);
+      this.pingInterval = null;
+    }
+  }
+
+  private sendPing() {
+    const data: Record<string, number> = { t: performance.now() };
+    if (this.latency !== null) {
+      data.rtt = Math.round(this.latency);
+    }
+    this.sendMessage('ping', data);
   }
   
+  // paddle_move is the only high-rate client message, pack it when possible.
+  // Each input is numbered so frames can acknowledge it (client-side prediction).
+  private sendPaddleMessage(position: number) {
+    const seq = this.inputSeq + 1;
+    const t = performance.now();
+    let sent = false;
+    if (!this.binaryFrames) {
+      sent = this.sendMessage('paddle_move', { position, seq, t });
+    } else if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      const buffer = new ArrayBuffer(17);
+      const view = new DataView(buffer);
+      view.setUint8(0, BINARY_PADDLE_MOVE_SEQ);
+      view.setFloat32(1, position, true);
+      view.setUint32(5, seq, true);
+      view.setFloat64(9, t, true);
+      try {
+        this.socket.send(buffer);
+        sent = true;
+      } catch (error) {
+        console.error('Error sending message:', error);
+      }
+    }
+    if (sent) {
+      this.inputSeq = seq;
+      this.pendingInputs.push({ seq, position });
+      // Bounded: inputs that never get acknowledged (e.g. while paused) age out
+      if (this.pendingInputs.length > 64) {
+        this.pendingInputs.shift();
+      }
+    }
+    return sent;
+  }
+
   private sendMessage(type: string, data: any = {}) {
     if (this.socket && this.socket.readyState === WebSocket.OPEN) {
       const message = {
@@ -263,6 +564,12 @@ export default class GameConnection {
 
   disconnect() {
     this.stopGameLoop();
+    this.closedByUser = true;
+    this.clearResumeToken();
+    if (this.reconnectTimer) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
     
     if (this.socket) {
       try {
@@ -281,4 +588,9 @@ export default class GameConnection {
   getPlayerNumber() {
     return this.playerNumber;
   }
+
+  // Smoothed round-trip time in ms, null until the first pong
+  getLatency() {
+    return this.latency === null ? null : Math.round(this.latency);
+  }
 }
\ No newline at end of file
@@ -0,0 +1,33 @@
+#!/bin/sh
+
+# Writes the upstreams for the backend workers started by backend/prod.sh.
+# Worker i (0-based) listens on port 8000 + i.
+#
+# Game websockets use a consistent hash ring keyed on the game ID (ketama),
+# so both players of a game land on the same worker, and adding or removing
+# a worker only moves about 1/N of the games. A worker that stops answering
+# is left out of the ring for fail_timeout and its games move to the next
+# worker on the ring.
+
+UPSTREAM_CONF="/etc/nginx/conf.d/upstreams.conf"
+PONG_WORKERS="${PONG_WORKERS:-1}"
+
+servers=""
+i=0
+while [ "$i" -lt "$PONG_WORKERS" ]; do
+    servers="$servers    server backend:$((8000 + i)) max_fails=1 fail_timeout=10s;
+"
+    i=$((i + 1))
+done
+
+cat > "$UPSTREAM_CONF" <<CONF
+upstream backend_workers {
+    least_conn;
+$servers}
+
+upstream game_workers {
+    hash \$game_id consistent;
+$servers}
+CONF
+
+echo "Backend upstreams written to $UPSTREAM_CONF ($PONG_WORKERS workers)"